@@ -1,9 +1,20 @@
 import streamlit as st
 import pandas as pd
-from demand_forecast import smoothing
-from orders_to_trans import forecast_pipeline
-from optimization import optimization_model
-import os
+from demand_forecast import smoothing, brand_report, chart_frame, chart_filename, render_chart
+from orders_to_trans import forecast_transactions, total_transactions, brand_frame
+from optimization import optimization_model_batch, staffing_for_month, compile_forecast, compile_capabilities
+from ingest import monthly_demand
+from model_selection import select_demand_models
+from scenarios import scenario_staffing
+from what_if import what_if, shadow_prices
+from shift_planning import plan_shifts, daily_totals, WEEKDAY_PROFILE, SHIFTS_PER_MONTH
+from result_cache import ResultCache, make_key
+from profiling import span, start_collection, enable_json_logging
+from jobs import JobManager, JobCancelled
+from warmup import prewarm
+from tables import TABLE_TYPES, FORMATS, read_table as read_file, write_table, bundle
+import functools
+import uuid
 
 st.set_page_config(
     page_title="JR286 Labor Forecasting",
@@ -11,6 +22,165 @@ st.set_page_config(
     layout="wide"
 )
 
+# Results shared by every session; keyed on uploaded bytes and model parameters
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(max_entries=64, max_bytes=256 * 1024 ** 2)
+
+result_cache = get_result_cache()
+
+# Background jobs of every session; CPC_MAX_JOBS caps how many run at once on this server
+@st.cache_resource
+def get_job_manager():
+    return JobManager()
+
+job_manager = get_job_manager()
+
+# statsmodels, scipy and matplotlib load on first use; importing them once per server in the
+# background means the first Step 1 or Step 3 run rarely waits for them
+@st.cache_resource
+def start_prewarm():
+    return prewarm()
+
+start_prewarm()
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "cancelled_jobs" not in st.session_state:
+    st.session_state.cancelled_jobs = {}  # slot -> key of the inputs whose job was cancelled
+
+# Timing spans of this script run (shown in the performance panel) and JSON span logs on stderr
+enable_json_logging()
+perf_spans = start_collection()
+
+def read_table(raw, name):
+    with span('upload.parse', file=name, bytes=len(raw)):
+        return read_file(raw, name)
+
+# One-click downloads of a step's outputs: the table the next step takes (main, a (stem, frame)
+# pair or None) and a zip of all of them ({stem: frame}), as Parquet or CSV. Files are only
+# written when a button is clicked.
+def download_tables(step, main, outputs):
+    fmt = st.radio("Download format", list(FORMATS), format_func=str.capitalize, horizontal=True, key=f"{step}_format")
+    extension, mime = FORMATS[fmt]
+    col1, col2 = st.columns(2)
+    if main is not None:
+        stem, frame = main
+        with col1:
+            st.download_button(f"Download {stem.replace('_', ' ')}", functools.partial(write_table, frame, fmt),
+                               file_name=stem + extension, mime=mime, key=f"{step}_main", on_click="ignore")
+    with col2:
+        st.download_button(f"Download all {step.replace('step', 'Step ')} outputs (zip)", functools.partial(bundle, outputs, fmt),
+                           file_name=f"{step}_{fmt}.zip", mime="application/zip", key=f"{step}_bundle", on_click="ignore")
+
+# Step 1: charts come back as data (see demand_forecast.forecast_chart), so the cached result holds no images
+# Sub-monthly rows (e.g. the 1st and 15th) are summed into their month first.
+# With auto_select every series gets its best model from a rolling-origin backtest;
+# the selection table (or None) and the per-brand preparation report are appended to smoothing()'s results.
+def run_smoothing(raw, name, auto_select=False, progress=None):
+    demand = monthly_demand(read_table(raw, name))
+    workers = job_manager.workers_per_job()
+    selection = None
+    if auto_select:
+        try:
+            selection = select_demand_models(demand, workers=workers, progress=progress)
+        except (KeyError, ValueError, TypeError):  # malformed upload: let smoothing() explain what is wrong
+            selection = None
+    if selection is None:
+        result = smoothing(demand, workers=workers, progress=progress)
+    else:
+        result = smoothing(demand, workers=workers, engine='auto', selection=selection, progress=progress)
+    report = None if type(result[0]) == str else brand_report(demand, result[4][:len(result[2])])
+    return result + (selection, report)
+
+# Background job bodies: they run on the job manager's threads and put their result in the shared cache
+def step1_job(job, key, raw, name, auto_select):
+    value = run_smoothing(raw, name, auto_select, progress=job.report)
+    result_cache.put(key, value)
+    return value
+
+def step3_job(job, key, brands, transactions, employees, integer=False, time_limit=10.0):
+    job.report(0, 1, f'Solving staffing for {len(brands)} brands')
+    value = optimization_model_batch(brands, transactions, employees, sensitivity=True,
+                                     integer=integer, time_limit=time_limit, progress=job.report)
+    result_cache.put(key, value)
+    return value
+
+# Progress of a session's running job, polled without rerunning the rest of the page;
+# the whole page reruns once the job is done or cancelled
+@st.fragment(run_every=1)
+def show_job(slot):
+    job = job_manager.get(st.session_state.session_id, slot)
+    if job is None or job.done():
+        st.rerun()
+    st.progress(job.progress, text=job.message)
+    if st.button("Cancel", key=f"cancel_{slot}"):
+        st.session_state.cancelled_jobs[slot] = job.key
+        job.cancel()
+        st.rerun()
+
+# Result of a stage for these inputs, computed by a background job of this session:
+# the value once the job is done, otherwise None while its progress (or a restart button) is shown
+def run_job(slot, key, fn, *args):
+    if st.session_state.cancelled_jobs.get(slot) == key:
+        st.write("Cancelled.")
+        if not st.button("Restart", key=f"restart_{slot}"):
+            return None
+        del st.session_state.cancelled_jobs[slot]
+    job = job_manager.submit(st.session_state.session_id, slot, key, fn, key, *args)
+    if not job.done():
+        show_job(slot)
+        return None
+    if job.future.cancelled() or isinstance(job.error(), JobCancelled):
+        return None
+    claim_job_spans(slot, key)
+    return job.result()
+
+# A finished job's timing spans, added once to the panel of the run that first shows its result
+# (usually a cache hit, as the job stores its result in the shared cache)
+def claim_job_spans(slot, key):
+    job = job_manager.get(st.session_state.session_id, slot)
+    if job is not None and job.key == key and job.done() and job.spans:
+        perf_spans.extend(job.spans)
+        job.spans = []
+
+# Step 2: validation message (str) or the projected transactions of every brand plus their monthly total
+def run_transactions(summary_raw, summary_name, quantity_raw, quantity_name):
+    summary = read_table(summary_raw, summary_name)
+    quantity = read_table(quantity_raw, quantity_name)
+
+    if "transactions" not in summary.columns or "quantity" not in summary.columns:
+        return "ERROR: Transaction summary must have 'transactions' and 'quantity' columns."
+    elif "brand" not in summary.columns:
+        return "ERROR: Transaction summary must have a 'brand' column."
+    elif "341_transactions" not in summary.columns or "341_quantity" not in summary.columns:
+        return "ERROR: Transaction summary must have '341_transactions' and '341_quantity' columns."
+    elif "Date" not in quantity.columns:
+        return "ERROR: Quantity forecast must have a 'Date' column."
+
+    quantity = quantity.set_index("Date").rename(columns=str)
+    summary_brands = set(summary['brand'].astype(str))
+    forecast_brands = [b for b in quantity.columns if b in summary_brands]
+    if not forecast_brands:
+        return "ERROR: At least one brand column in the quantity forecast must match a brand in the transaction summary."
+    elif len(quantity) != 12:
+        return "ERROR: Quantity forecast must have 12 months of data."
+
+    projected = forecast_transactions(summary, quantity[forecast_brands].fillna(0))
+    total = total_transactions(projected)
+    total['Date'] = pd.to_datetime(total['Date']).dt.strftime('%Y-%m')
+    total = total.fillna(0)
+    return projected, total
+
+# Step 3 under uncertainty: staffing quantiles over Monte Carlo demand scenarios (or an error message)
+def run_scenarios(demand_raw, demand_name, summary_raw, summary_name, brands, employees, scenarios):
+    try:
+        return scenario_staffing(
+            monthly_demand(read_table(demand_raw, demand_name)), read_table(summary_raw, summary_name),
+            dict(zip(brands, employees)), scenarios=scenarios, workers=job_manager.workers_per_job()
+        )
+    except (KeyError, ValueError) as e:
+        return f"ERROR: Unable to simulate scenarios ({e}). Brand names must match the brands in the Step 1 demand data."
+
 # Labor Forecasting App
 st.title("JR286 Labor Forecasting")
 
@@ -31,7 +201,7 @@ if page == "Forecasting":
     with col1:
         st.subheader("Upload Data")
         st.write("Data should be a monthly time series dataset with order numbers and total quantity.")
-        demand_data = st.file_uploader("Upload Demand Data", type=["csv", "xlsx"])    
+        demand_data = st.file_uploader("Upload Demand Data", type=TABLE_TYPES)    
     with col2:
         st.subheader("Sample Data")
         st.write("Please reference the provided documentation for a comprehensive breakdown of data syntax and formatting.")
@@ -44,46 +214,83 @@ if page == "Forecasting":
         }), use_container_width=True, hide_index=True)
 
     if demand_data is not None:
-        if demand_data.name.endswith('.csv'):
-            demand_data = pd.read_csv(demand_data)
-        elif demand_data.name.endswith('.xlsx'):
-            demand_data = pd.read_excel(demand_data)
+        if not demand_data.name.lower().endswith(tuple('.' + t for t in TABLE_TYPES)):
+            st.write("Please upload a valid CSV, Excel, Parquet or Arrow file.")
+
+        raw = demand_data.getvalue()
+        auto_select = st.checkbox(
+            "Automatic model selection",
+            help="Backtest trend, seasonality, damping and log/raw variants for every brand and use the best one (slower).",
+            key="auto_select"
+        )
+        step1_key = make_key("smoothing", raw, demand_data.name, auto_select)
+        with span('app.step1'):
+            hit, step1 = result_cache.get(step1_key)
+        if hit:
+            claim_job_spans('step1', step1_key)
         else:
-            st.write("Please upload a valid CSV or Excel file.")
-
-        quantity = pd.DataFrame()
-
-        order_plots, qty_plots, order_tables, qty_tables, brands = smoothing(demand_data)
+            step1 = run_job('step1', step1_key, step1_job, raw, demand_data.name, auto_select)
+
+        if step1 is not None:
+            quantity = pd.DataFrame()
+
+            order_plots, qty_plots, order_tables, qty_tables, brands, selection, report = step1
+            reasons = {} if report is None else dict(zip(report['Brand'], report['Status']))
+            if selection is not None:
+                with st.expander("Selected models (rolling-origin backtest)"):
+                    st.dataframe(selection, use_container_width=True, hide_index=True)
+            if report is not None:
+                with st.expander("Data preparation report"):
+                    st.dataframe(report, use_container_width=True, hide_index=True)
         
-        if type(order_plots) == str and qty_plots == 0:
-            st.write(order_plots)
-        else:
-            for i,brand in enumerate(brands):
-                st.subheader(f"Brand {brand} Forecast:")
-                if i < len(order_plots):
-                    o_col, q_col = st.columns(2)
-                    with o_col:
-                        st.image(order_plots[i])
-                        st.dataframe(order_tables[i], use_container_width=True)
-                    with q_col:
-                        st.image(qty_plots[i])
-                        st.dataframe(qty_tables[i], use_container_width=True)
-
-                    qty_tables: list[pd.DataFrame]
-                    qty_tables[i].rename(columns = {'Forecasted Quantity': f'{brand}'}, inplace=True)
-                    quantity = pd.concat([quantity, qty_tables[i][f'{brand}']], axis=1)
-
-                    if os.path.exists(order_plots[i]):
-                        os.remove(order_plots[i])
-                    if os.path.exists(qty_plots[i]):
-                        os.remove(qty_plots[i])
-                else:
-                    st.write(f"Brand {brand} needs at least 12 months of data to forecast.")
-
-        st.subheader("Downloadable data for Step 2:")
-        quantity = quantity.reset_index(drop=False, names=['Date'])
-        quantity = quantity.fillna(0)
-        st.dataframe(quantity, use_container_width=True, hide_index=True)            
+            if type(order_plots) == str and qty_plots == 0:
+                st.write(order_plots)
+            else:
+                for i,brand in enumerate(brands):
+                    st.subheader(f"Brand {brand} Forecast:")
+                    if i < len(order_plots):
+                        o_col, q_col = st.columns(2)
+                        with o_col:
+                            st.dataframe(order_tables[i], use_container_width=True)
+                        with q_col:
+                            st.dataframe(qty_tables[i], use_container_width=True)
+                        # Charts are drawn by the browser when the expander is opened; PNGs only on download
+                        with st.expander(f"Charts for brand {brand}"):
+                            o_col, q_col = st.columns(2)
+                            for col, chart in ((o_col, order_plots[i]), (q_col, qty_plots[i])):
+                                with col:
+                                    st.line_chart(chart_frame(chart))
+                                    st.download_button(
+                                        "Download PNG", functools.partial(render_chart, chart),
+                                        file_name=chart_filename(chart), mime="image/png",
+                                        key=f"png_{chart_filename(chart)}", on_click="ignore"
+                                    )
+
+                        qty_tables: list[pd.DataFrame]
+                        qty_tables[i].rename(columns = {'Forecasted Quantity': f'{brand}'}, inplace=True)
+                        quantity = pd.concat([quantity, qty_tables[i][f'{brand}']], axis=1)
+                    else:
+                        st.write(f"Brand {brand} was not forecast: {reasons.get(brand, 'needs at least 12 months of data')}.")
+
+            st.subheader("Downloadable data for Step 2:")
+            quantity = quantity.reset_index(drop=False, names=['Date'])
+            quantity = quantity.fillna(0)
+            st.dataframe(quantity, use_container_width=True, hide_index=True)
+
+            if type(order_plots) != str:
+                forecasted = brands[:len(order_tables)]
+                outputs = {'quantity_forecast': quantity}
+                if forecasted:
+                    outputs['demand_forecast'] = pd.concat([
+                        pd.DataFrame({'Brand': brand, 'Month': o.index, 'Forecasted Orders': o.iloc[:, 0].to_numpy(),
+                                      'Forecasted Quantity': q.iloc[:, 0].to_numpy()})
+                        for o, q, brand in zip(order_tables, qty_tables, forecasted)
+                    ], ignore_index=True)
+                if report is not None:
+                    outputs['brand_report'] = report
+                if selection is not None:
+                    outputs['model_selection'] = selection
+                download_tables('step1', ('quantity_forecast', quantity), outputs)
 
     # Section 2: Transaction Forecasting
     st.header("Step 2: Forecast Transaction Counts")
@@ -91,63 +298,37 @@ if page == "Forecasting":
     
     col1, col2 = st.columns(2)
     with col1:
-        summary = st.file_uploader("Upload Transaction Summary", type=["csv", "xlsx"])
+        summary = st.file_uploader("Upload Transaction Summary", type=TABLE_TYPES)
     with col2:
-        quantity = st.file_uploader("Upload Quantity Forecast", type=["csv", "xlsx"])
+        quantity = st.file_uploader("Upload Quantity Forecast", type=TABLE_TYPES)
     if summary is not None and quantity is not None:
         try:
-            if summary.name.endswith(".csv"):
-                summary = pd.read_csv(summary)
+            summary_raw = summary.getvalue()
+            quantity_raw = quantity.getvalue()
+            with span('app.step2'):
+                step2 = result_cache.get_or_compute(
+                    make_key("forecast_transactions", summary_raw, summary.name, quantity_raw, quantity.name),
+                    run_transactions, summary_raw, summary.name, quantity_raw, quantity.name
+                )
+
+            if type(step2) == str:
+                st.write(step2)
             else:
-                summary = pd.read_excel(summary)
-
-            if quantity.name.endswith(".csv"):
-                quantity = pd.read_csv(quantity)
-            else:
-                quantity = pd.read_excel(quantity)
-
-            if "transactions" not in summary.columns or "quantity" not in summary.columns:
-                st.write("ERROR: Transaction summary must have 'transactions' and 'quantity' columns.")
-            elif not all(b in summary['brand'].astype(str).values for b in ["400", "451", "900", "no_brand"]):                
-                st.write("ERROR: Transaction summary must have 'brand' column with brands 400, 451, 900, and no_brand.")
-            
-            elif "451" not in quantity.columns or "900" not in quantity.columns:
-                st.write("ERROR: Brands '451' and '900' must be columns in the quantity forecast data.")
-            elif "Date" not in quantity.columns:
-                st.write("ERROR: Quantity forecast must have a 'Date' column.")
-                        
-            elif len(quantity["451"]) != 12 or len(quantity["900"]) != 12:
-                st.write("ERROR: Quantity forecast must have 12 months of data for both brands '451' and '900'.")
-            else:
-                quantity = quantity.set_index("Date")
-
-                forecast_451 = quantity["451"]
-                forecast_900 = quantity["900"]
-                
-                out400, out451, out900, outNB = forecast_pipeline(summary, forecast_451, forecast_900)
-                
-                # add together the dataframes
-                total = pd.concat([out400, out451, out900, outNB], axis=0)
-                total = total.groupby('Month').sum().reset_index()
-                total['Month'] = pd.to_datetime(total['Month']).dt.strftime('%Y-%m')
-                total = total.rename(columns={'Month': 'Date'})
-                total = total.fillna(0)
+                projected, total = step2
 
-                st.write("Transactions for 400:")
-                st.dataframe(out400, use_container_width=True, hide_index=True)
-
-                st.write("Transactions for 451:")
-                st.dataframe(out451, use_container_width=True, hide_index=True)
-
-                st.write("Transactions for 900:")
-                st.dataframe(out900, use_container_width=True, hide_index=True)
-
-                st.write("Transactions for No Brand:")
-                st.dataframe(outNB, use_container_width=True, hide_index=True)
+                st.write("Transactions by brand:")
+                step2_brands = list(dict.fromkeys(projected['Brand']))
+                shown_brand = st.selectbox("Brand", step2_brands, key="step2_brand")
+                st.dataframe(brand_frame(projected, shown_brand), use_container_width=True, hide_index=True)
 
                 st.write("Total Transactions:")
                 st.dataframe(total, use_container_width=True, hide_index=True)
 
+                # Per-brand transaction forecasts upload into Step 3 as they are
+                outputs = {'transactions': projected, 'total_transactions': total}
+                outputs.update({f'transactions_{b}': brand_frame(projected, b) for b in step2_brands})
+                download_tables('step2', (f'transactions_{shown_brand}', brand_frame(projected, shown_brand)), outputs)
+
         # except ValueError:
         #     st.write("Please enter valid numeric values for orders and quantity.")
         except Exception as e:
@@ -158,36 +339,41 @@ if page == "Forecasting":
     st.header("Step 3: Labor Optimization Model")
     st.write("Use the data from the transaction forecast and historical employee productivity data with this model to determine the number of employees needed by position in a month for each brand.")
 
-    # Use session state to persist data across reruns
+    # Use session state to persist data across reruns; uploads are kept compiled
+    # (optimization.ForecastMatrix / CapabilityMatrix), so solves do no pandas work
     if "transactions" not in st.session_state:
         st.session_state.transactions = []
     if "employees" not in st.session_state:
         st.session_state.employees = []
     if "brands" not in st.session_state:
         st.session_state.brands = []
+    if "upload_digests" not in st.session_state:
+        st.session_state.upload_digests = []
 
     with st.form("add_brand_form", clear_on_submit=True):
         brand = st.text_input("Brand Name")
         col1, col2 = st.columns(2)
         with col1:
-            transaction = st.file_uploader("Upload Transaction Forecast", type=["csv", "xlsx"], key="transaction_file")
+            transaction = st.file_uploader("Upload Transaction Forecast", type=TABLE_TYPES, key="transaction_file")
         with col2:
-            employee = st.file_uploader("Upload Employee Capabilities", type=["csv", "xlsx"], key="employee_file")
+            employee = st.file_uploader("Upload Employee Capabilities", type=TABLE_TYPES, key="employee_file")
         add_clicked = st.form_submit_button("Add Brand")
         if add_clicked:
             if brand and transaction is not None and employee is not None:
-                if transaction.name.endswith('.csv'):
-                    transaction_df = pd.read_csv(transaction)
+                try:
+                    forecast = compile_forecast(read_table(transaction.getvalue(), transaction.name))
+                    capabilities = compile_capabilities(read_table(employee.getvalue(), employee.name))
+                except (KeyError, ValueError) as e:
+                    st.warning(f"Could not read the uploads for brand {brand}: the forecast needs '###_transactions' "
+                               f"columns and the capabilities a 'Position' column plus one numeric column per type ({e}).")
                 else:
-                    transaction_df = pd.read_excel(transaction)
-                if employee.name.endswith('.csv'):
-                    employee_df = pd.read_csv(employee)
-                else:
-                    employee_df = pd.read_excel(employee)
-                st.session_state.transactions.append(transaction_df)
-                st.session_state.employees.append(employee_df)
-                st.session_state.brands.append(brand)
-                st.success(f"Added brand: {brand}")
+                    st.session_state.transactions.append(forecast)
+                    st.session_state.employees.append(capabilities)
+                    st.session_state.brands.append(brand)
+                    st.session_state.upload_digests.append(
+                        (make_key("upload", transaction.getvalue()), make_key("upload", employee.getvalue()))
+                    )
+                    st.success(f"Added brand: {brand}")
             else:
                 st.warning("Please provide a brand name and upload both files.")
 
@@ -201,31 +387,55 @@ if page == "Forecasting":
         st.session_state.opt_row_index = 0
     if "opt_results" not in st.session_state:
         st.session_state.opt_results = None
+    if "opt_plan" not in st.session_state:
+        st.session_state.opt_plan = None  # (key of the inputs it was solved for, month-indexed plan, LP sensitivity)
+    if "opt_pending" not in st.session_state:
+        st.session_state.opt_pending = False
 
     if st.session_state.transactions:
         colA, colB = st.columns(2)
         with colA:
             run_opt = st.button("Run Optimization")
+            opt_integer = st.checkbox(
+                "Whole employees (integer optimization)",
+                help="Search for the plan with the fewest whole employees instead of rounding every role up.",
+                key="opt_integer"
+            )
+            opt_time_limit = st.number_input("Time limit (s)", min_value=1, max_value=300, value=10, step=5,
+                                             key="opt_time_limit", disabled=not opt_integer)
 
         with colB:
             # Create a dropdown for selecting the month
-            month_options = list(st.session_state.transactions[0]['Date']) if 'Date' in st.session_state.transactions[0].columns else list(range(1, len(st.session_state.transactions[0]) + 1))
+            month_options = list(st.session_state.transactions[0].labels)
             selected_month = st.selectbox("Select Month", month_options, key="opt_dropdown")
-            if 'Date' in st.session_state.transactions[0].columns:
-                row_index = month_options.index(selected_month)
-            else:
-                row_index = selected_month - 1
+            row_index = month_options.index(selected_month)
 
-        # Only run optimization if button is clicked or slider is changed
-        if run_opt or row_index != st.session_state.opt_row_index:
+        # Only run optimization if button is clicked or slider is changed; every month is solved
+        # at once, so changing the month afterwards is just a lookup in the stored plan
+        # The plan is solved by a background job; opt_pending keeps polling it across reruns
+        if run_opt or row_index != st.session_state.opt_row_index or st.session_state.opt_pending:
             st.session_state.opt_row_index = row_index
-            staffings, totals, success = optimization_model(
-                st.session_state.brands,
-                st.session_state.transactions,
-                st.session_state.employees,
-                row_index
-            )
-            st.session_state.opt_results = (staffings, totals, success)
+            plan_key = make_key("optimization_model_batch", st.session_state.brands, st.session_state.upload_digests,
+                                opt_integer, opt_time_limit if opt_integer else None)
+            if st.session_state.opt_plan is None or st.session_state.opt_plan[0] != plan_key:
+                with span('app.step3'):
+                    hit, step3 = result_cache.get(plan_key)
+                if hit:
+                    claim_job_spans('step3', plan_key)
+                else:
+                    step3 = run_job(
+                        'step3', plan_key, step3_job, list(st.session_state.brands),
+                        list(st.session_state.transactions), list(st.session_state.employees),
+                        opt_integer, float(opt_time_limit)
+                    )
+                st.session_state.opt_pending = step3 is None and st.session_state.cancelled_jobs.get('step3') != plan_key
+                if step3 is not None:
+                    plan, _, duals = step3
+                    st.session_state.opt_plan = (plan_key, plan, duals)
+            if st.session_state.opt_plan is not None and st.session_state.opt_plan[0] == plan_key:
+                st.session_state.opt_results = staffing_for_month(
+                    st.session_state.opt_plan[1], st.session_state.brands, row_index
+                )
 
         # Display results if available
         if st.session_state.opt_results:
@@ -249,6 +459,146 @@ if page == "Forecasting":
                 st.write("An error occurred while optimizing staffing.")
 
             st.subheader(f"Total Employees across All Brands: {sum(totals)}")
+            plan = st.session_state.opt_plan[1] if st.session_state.opt_plan is not None else None
+            if success and plan is not None and "Gap" in plan.columns:
+                month = plan[plan["row"] == st.session_state.opt_row_index].groupby("brand_index")
+                gap = (month["Gap"].first() * month["Employees"].sum()).sum() / max(1, sum(totals))
+                st.caption("Whole-employee plan, proven optimal." if gap == 0 else
+                           f"Whole-employee plan, at most {gap:.1%} above the fewest employees possible.")
+
+        # What-if questions on the solved month, answered from the LP sensitivity data
+        if st.session_state.opt_plan is not None and st.session_state.opt_results and st.session_state.opt_results[2]:
+            with st.expander("What-if analysis"):
+                _, plan, duals = st.session_state.opt_plan
+                w_name = st.selectbox("Brand", st.session_state.brands, key="whatif_brand")
+                w_brand = st.session_state.brands.index(w_name)
+                w_row = st.session_state.opt_row_index
+                prices = shadow_prices(duals, w_brand, w_row)
+                st.write("Sensitivity of this month's plan:")
+                st.dataframe(prices, use_container_width=True, hide_index=True)
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    w_types = st.multiselect("Transaction types", list(prices['Type']), key="whatif_types")
+                    w_demand = st.number_input("Demand change (%)", value=10.0, step=5.0, key="whatif_demand")
+                with col2:
+                    w_roles = list(st.session_state.employees[w_brand].roles)
+                    w_role = st.selectbox("Role", ["(none)"] + w_roles, key="whatif_role")
+                    w_capability = st.number_input("Productivity change (%)", value=0.0, step=5.0, key="whatif_capability")
+
+                demand_change = {t: w_demand / 100 for t in w_types}
+                capability_change = {w_role: w_capability / 100} if w_role != "(none)" and w_capability else None
+                if demand_change or capability_change:
+                    answer = what_if(plan, duals, st.session_state.employees[w_brand], st.session_state.transactions[w_brand],
+                                     w_brand, w_row, demand_change, capability_change)
+                    if answer['success']:
+                        st.dataframe(answer['staffing'], use_container_width=True, hide_index=True)
+                        st.write(f"Total Employees Needed: {answer['total_base']} -> {answer['total']}")
+                        st.caption({
+                            'sensitivity': "Answered from the shadow prices; the optimal basis is unchanged.",
+                            'basis': "Answered by re-solving the unchanged optimal basis.",
+                            'resolve': "The optimal basis changed, so the month was solved again.",
+                        }[answer['method']] + (" Both plans staff whole employees, like the plan above."
+                                               if answer['integer'] else ""))
+                    else:
+                        st.write(answer['message'])
+
+        # Day x shift staffing for one brand, its monthly forecast spread by a weekday profile
+        with st.expander("Daily and shift plan"):
+            s_name = st.selectbox("Brand", st.session_state.brands, key="shift_brand")
+            s_brand = st.session_state.brands.index(s_name)
+            weekdays = st.data_editor(
+                pd.DataFrame({'Weekday': ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'], 'Weight': WEEKDAY_PROFILE}),
+                hide_index=True, disabled=['Weekday'], key="shift_weekdays"
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                max_change = st.number_input("Largest headcount change between shifts (0: any)", min_value=0, value=0,
+                                             key="shift_max_change")
+            with col2:
+                min_staff = st.number_input("Minimum staff per role on open shifts", min_value=0, value=0,
+                                            key="shift_min_staff")
+            if st.button("Plan Shifts"):
+                weights = tuple(float(w) for w in weekdays['Weight'].fillna(0))
+                with span('app.step3.shifts'):
+                    try:
+                        st.session_state.shift_plan = result_cache.get_or_compute(
+                            make_key("plan_shifts", s_name, st.session_state.upload_digests[s_brand], weights,
+                                     max_change, min_staff),
+                            plan_shifts, st.session_state.employees[s_brand], st.session_state.transactions[s_brand],
+                            weights, None, SHIFTS_PER_MONTH, max_change or None, min_staff
+                        )
+                    except ValueError as e:
+                        st.session_state.shift_plan = f"ERROR: {e}"
+            shift_plan = st.session_state.get("shift_plan")
+            if type(shift_plan) == str:
+                st.write(shift_plan)
+            elif shift_plan is not None:
+                s_table, s_success = shift_plan
+                if not s_success:
+                    st.write("No shift staffing meets the demand under these limits.")
+                else:
+                    st.dataframe(daily_totals(s_table), use_container_width=True, hide_index=True)
+                    st.download_button("Download shift plan (CSV)", s_table.to_csv(index=False), file_name="shift_plan.csv",
+                                       mime="text/csv", key="shift_plan_csv")
+
+        # Staffing at demand quantiles; simulates from the Step 1 history through the Step 2 summary
+        if demand_data is not None and summary is not None:
+            with st.expander("Staffing under demand uncertainty"):
+                n_scenarios = st.number_input("Scenarios", min_value=100, max_value=20000, value=2000, step=500,
+                                              key="n_scenarios")
+                if st.button("Run Scenarios"):
+                    with span('app.step3.scenarios'):
+                        st.session_state.scenario_table = result_cache.get_or_compute(
+                            make_key("scenario_staffing", demand_data.getvalue(), summary.getvalue(),
+                                     st.session_state.brands, st.session_state.upload_digests, n_scenarios),
+                            run_scenarios, demand_data.getvalue(), demand_data.name, summary.getvalue(), summary.name,
+                            st.session_state.brands, st.session_state.employees, n_scenarios
+                        )
+                table = st.session_state.get("scenario_table")
+                if type(table) == str:
+                    st.write(table)
+                elif table is not None and len(table):
+                    scenario_month = st.selectbox("Scenario Month", list(dict.fromkeys(table['Month'])),
+                                                  key="scenario_month")
+                    st.dataframe(table[table['Month'] == scenario_month].drop(columns='Month'),
+                                 use_container_width=True, hide_index=True)
+
+        # Step 3 outputs: the solved plan with its sensitivity, plus any shift plan and scenario quantiles
+        if st.session_state.opt_plan is not None and st.session_state.opt_results:
+            st.subheader("Downloadable staffing plan:")
+            _, plan, duals = st.session_state.opt_plan
+            outputs = {'staffing_plan': plan, 'sensitivity': duals}
+            shift_plan = st.session_state.get("shift_plan")
+            if type(shift_plan) != str and shift_plan is not None and shift_plan[1]:
+                outputs['shift_plan'] = shift_plan[0]
+            table = st.session_state.get("scenario_table")
+            if type(table) != str and table is not None:
+                outputs['staffing_scenarios'] = table
+            download_tables('step3', ('staffing_plan', plan), outputs)
+
+# Cache effectiveness across all sessions on this server
+cache_stats = result_cache.stats()
+st.sidebar.caption(
+    f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+    f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1024 ** 2:.1f} MB)"
+)
+job_stats = job_manager.stats()
+st.sidebar.caption(
+    f"Background jobs: {job_stats['running']} running, {job_stats['queued']} queued "
+    f"(at most {job_stats['max_jobs']} at once)"
+)
+
+# Optional performance panel: where this run's time went (cached steps show only their app.step span)
+if st.sidebar.checkbox("Show performance panel", key="perf_panel"):
+    with st.sidebar.expander("Performance", expanded=True):
+        if perf_spans:
+            spans_df = pd.DataFrame(perf_spans)
+            by_stage = spans_df.groupby('span')['duration_ms'].agg(['count', 'sum', 'max']).sort_values('sum', ascending=False)
+            st.dataframe(by_stage.round(1), use_container_width=True)
+            st.dataframe(spans_df, use_container_width=True, hide_index=True)
+        else:
+            st.write("No timed work in this run.")
 
 if page == "Productivity Report":
     # Section 2: Productivity Report
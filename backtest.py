@@ -0,0 +1,276 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from profiling import span
+
+# Rolling-origin accuracy backtest of the whole pipeline.
+#
+#   python backtest.py demand.csv summary.csv --capabilities caps/ --step 3 --workers 4 --output backtest/
+#
+# At every cutoff month the demand history up to and including that month is forecast with
+# smoothing(), projected into transactions with forecast_transactions() (the N-brand
+# projection behind forecast_pipeline) and compared with the months that followed. Actual
+# transactions come from an actuals table in forecast_transactions' layout (Brand, Month,
+# ###_transactions ...); without one they are the transactions the actual demand implies
+# through the same summary mix, which isolates the error of the demand forecast. With
+# capabilities ({brand: frame}) both forecast and actual transactions are staffed with the
+# staffing LP, and the difference in employees is the staffing error of the plan.
+#
+# Cutoffs are split into contiguous runs, one per worker process. Within a run forecasts go
+# through a model store (model_store.py): each cutoff carries the previous cutoff's fitted
+# states over the new months and re-optimizes from its parameters instead of fitting from
+# scratch. engine='statsmodels' or 'numpy' fits every cutoff cold instead.
+
+HORIZON = 12
+
+# Cutoffs ('YYYY-MM', last month of training data) every `step` months, ending one month
+# before the last month of the demand table so every cutoff has at least one actual month,
+# with at least min_history months of data up to the first one
+def backtest_cutoffs(demand: pd.DataFrame, step: int = 1, min_history: int = 24) -> list:
+    months = pd.to_datetime(demand['Date']).dt.strftime('%Y-%m').drop_duplicates().sort_values().tolist()
+    return [months[i] for i in range(len(months) - 2, min_history - 2, -step)][::-1]
+
+# Transactions of a forecast_transactions frame in long form: Brand, Month, Type, value
+# (Type is the transaction type code or 'Total')
+def long_transactions(projected: pd.DataFrame, value: str) -> pd.DataFrame:
+    projected = projected.assign(Brand=projected['Brand'].astype(str),
+                                 Month=pd.to_datetime(projected['Month'].astype(str)).dt.strftime('%Y-%m'))
+    columns = {c: c[:-len('_transactions')] for c in projected.columns if str(c).endswith('_transactions')}
+    if 'Total Transactions' in projected.columns:
+        columns['Total Transactions'] = 'Total'
+    long = projected.melt(id_vars=['Brand', 'Month'], value_vars=list(columns), var_name='Type', value_name=value)
+    long['Type'] = long['Type'].map(columns)
+    return long
+
+# The transactions the actual demand implies: every month's actual quantity projected like a forecast
+def implied_transactions(demand: pd.DataFrame, summary: pd.DataFrame, anchor_type: str = '341') -> pd.DataFrame:
+    from orders_to_trans import forecast_transactions
+
+    quantity = demand.set_index(pd.to_datetime(demand['Date']).dt.strftime('%Y-%m'))
+    quantity = quantity[[c for c in quantity.columns if str(c).endswith('_Quantity')]]
+    quantity.columns = [str(c)[:-len('_Quantity')] for c in quantity.columns]
+    return forecast_transactions(summary, quantity.fillna(0), anchor_type=anchor_type)
+
+# Employees per brand, month and role for the brands of `projected` that have capabilities
+def staffing(projected: pd.DataFrame, capabilities: dict) -> pd.DataFrame:
+    from optimization import optimization_model_batch
+    from orders_to_trans import brand_frame
+
+    brands = [b for b in dict.fromkeys(projected['Brand'].astype(str)) if b in capabilities]
+    if not brands:
+        return pd.DataFrame(columns=['Brand', 'Month', 'Position', 'Employees'])
+    plan, _ = optimization_model_batch(brands, [brand_frame(projected, b) for b in brands],
+                                       [capabilities[b] for b in brands])
+    plan = plan[plan['Success']]
+    return plan.assign(Month=pd.to_datetime(plan['Month'].astype(str)).dt.strftime('%Y-%m'))[
+        ['Brand', 'Month', 'Position', 'Employees']]
+
+# One run of adjacent cutoffs, in order (a process pool task). Returns one
+# (cutoff, long forecast transactions with their Horizon, forecast staffing, seconds) per cutoff.
+def run_cutoffs(task: tuple) -> list:
+    from demand_forecast import smoothing
+    from model_store import ModelStore
+    from orders_to_trans import forecast_transactions
+
+    demand, summary, capabilities, cutoffs, horizon, engine, reoptimize, store_path, anchor_type = task
+    store = ModelStore(store_path) if engine == 'store' else None
+    months = pd.to_datetime(demand['Date']).dt.strftime('%Y-%m')
+    results = []
+    for cutoff in cutoffs:
+        start = time.perf_counter()
+        with span('backtest.cutoff', cutoff=cutoff, engine=engine) as s:
+            train = demand[months <= cutoff].reset_index(drop=True)
+            order_plots, _, _, qty_data, brands = smoothing(
+                train, engine='numpy' if engine == 'store' else engine, store=store, reoptimize=reoptimize, plots=False
+            )
+            if type(order_plots) == str:
+                raise ValueError(f"{order_plots} (cutoff {cutoff})")
+            s['forecasted'] = len(qty_data)
+            if not qty_data:
+                results.append((cutoff, None, None, time.perf_counter() - start))
+                continue
+
+            # forecast months counted from the cutoff, also for brands whose history ended earlier
+            ahead = pd.date_range(pd.Period(cutoff, 'M').to_timestamp(), periods=horizon + 1, freq='MS')[1:].strftime('%Y-%m')
+            quantity = pd.concat([table['Forecasted Quantity'].rename(brand)
+                                  for table, brand in zip(qty_data, brands)], axis=1)
+            quantity = quantity.reindex(ahead).fillna(0)
+            projected = forecast_transactions(summary, quantity, anchor_type=anchor_type)
+            planned = staffing(projected, capabilities) if capabilities else None
+        forecast = long_transactions(projected, 'Forecast')
+        forecast['Horizon'] = forecast['Month'].map({month: h + 1 for h, month in enumerate(ahead)})
+        results.append((cutoff, forecast, planned, time.perf_counter() - start))
+    return results
+
+# MAPE (mean absolute percentage error over months with actuals > 0), WAPE and bias (sum of
+# errors / sum of actuals) of the long errors table, per group
+def accuracy(errors: pd.DataFrame, by: list = ('Brand', 'Type')) -> pd.DataFrame:
+    from model_selection import metrics
+
+    by = list(by)
+    positive = errors['Actual'] > 0
+    sums = errors.assign(
+        abs_error=errors['Error'].abs(),
+        ape=np.where(positive, errors['Error'].abs() / errors['Actual'].where(positive, 1), 0.0),
+        count=positive.astype(int),
+    ).groupby(by, sort=False)[['abs_error', 'Actual', 'Error', 'ape', 'count', 'Forecast']].sum()
+    rows = [metrics(totals) for totals in sums[['abs_error', 'Actual', 'Error', 'ape', 'count']].to_numpy()]
+    table = pd.DataFrame(rows, index=sums.index).rename(columns=str.upper)
+    table = table.assign(Forecast=sums['Forecast'], Actual=sums['Actual'],
+                         Compared=errors.groupby(by, sort=False).size())
+    return table.reset_index()[by + ['MAPE', 'WAPE', 'BIAS', 'Forecast', 'Actual', 'Compared']].rename(columns={'BIAS': 'Bias'})
+
+# Staffing error per group: mean absolute and mean signed employee difference, and the share
+# of brand-months-roles that would have been understaffed
+def staffing_accuracy(staffing_errors: pd.DataFrame, by: list = ('Brand', 'Position')) -> pd.DataFrame:
+    by = list(by)
+    grouped = staffing_errors.assign(
+        abs_error=staffing_errors['Error'].abs(), under=staffing_errors['Error'] < 0
+    ).groupby(by, sort=False)
+    return grouped.agg(**{
+        'Mean Abs Error': ('abs_error', 'mean'), 'Mean Error': ('Error', 'mean'), 'Understaffed': ('under', 'mean'),
+        'Forecast': ('Forecast', 'sum'), 'Actual': ('Actual', 'sum'), 'Compared': ('Error', 'size'),
+    }).reset_index()
+
+# Rolling-origin backtest of smoothing -> forecast_transactions (-> staffing LP).
+# demand: Step 1 table; summary: Step 2 transaction summary
+# capabilities: optional {brand: capability frame or CapabilityMatrix} for the staffing error
+# actuals: optional actual transactions (forecast_transactions layout); default: implied by the demand
+# cutoffs: 'YYYY-MM' months (default: backtest_cutoffs(demand, step, min_history))
+# engine: 'store' (reuses fits between adjacent cutoffs), 'numpy' or 'statsmodels' (cold fits)
+# progress: optional callback(done, total, message) as cutoffs finish
+# Returns {'errors', 'accuracy', 'staffing', 'staffing_accuracy', 'cutoffs'}: the per-cutoff, brand,
+# type and month comparison with its Horizon (months after the cutoff), metrics per brand and type,
+# and the same for employees (staffing tables empty without capabilities)
+def backtest(demand: pd.DataFrame, summary: pd.DataFrame, capabilities: dict = None, actuals: pd.DataFrame = None,
+             cutoffs: list = None, step: int = 1, min_history: int = 24, horizon: int = HORIZON,
+             engine: str = 'store', reoptimize: bool = True, workers: int = 1, anchor_type: str = '341',
+             progress=None) -> dict:
+    from ingest import monthly_demand
+    from optimization import compile_capabilities
+
+    if engine not in ('store', 'numpy', 'statsmodels'):
+        raise ValueError("Backtest engine must be 'store', 'numpy' or 'statsmodels'.")
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+    demand = monthly_demand(demand)
+    if list(demand.columns)[:1] != ['Date']:
+        raise ValueError("First column of the demand data must be a valid 'Date' column.")
+    capabilities = {str(b): compile_capabilities(c) for b, c in (capabilities or {}).items()}
+    cutoffs = sorted(cutoffs) if cutoffs is not None else backtest_cutoffs(demand, step, min_history)
+    if not cutoffs:
+        raise ValueError(f"The demand data is too short for a backtest with {min_history} months of history.")
+
+    with span('backtest', cutoffs=len(cutoffs), engine=engine, workers=workers, staffing=bool(capabilities)) as s:
+        actual_table = actuals if actuals is not None else implied_transactions(demand, summary, anchor_type)
+        actual = long_transactions(actual_table, 'Actual')
+
+        runs = [list(run) for run in np.array_split(np.array(cutoffs, dtype=object), min(workers, len(cutoffs)))]
+        results = []
+        with tempfile.TemporaryDirectory(prefix='backtest-') as tmp:
+            tasks = [(demand, summary, capabilities, run, horizon, engine, reoptimize,
+                      os.path.join(tmp, f'run{i}.sqlite'), anchor_type) for i, run in enumerate(runs)]
+            if workers == 1:
+                for task in tasks:
+                    for cutoff in task[3]:
+                        results.extend(run_cutoffs(task[:3] + ([cutoff],) + task[4:]))
+                        if progress is not None:
+                            progress(len(results), len(cutoffs), f'Backtested cutoff {cutoff}')
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(run_cutoffs, task) for task in tasks]
+                    for future in as_completed(futures):
+                        results.extend(future.result())
+                        if progress is not None:
+                            progress(len(results), len(cutoffs), f'Backtested {len(results)} of {len(cutoffs)} cutoffs')
+        results.sort(key=lambda r: r[0])
+
+        frames = []
+        for cutoff, forecast, _, _ in results:
+            if forecast is not None:
+                frames.append(forecast.assign(Cutoff=cutoff))
+        forecasts = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=['Brand', 'Month', 'Type', 'Forecast', 'Cutoff', 'Horizon'])
+        errors = forecasts.merge(actual, on=['Brand', 'Month', 'Type'], how='inner')
+        errors = errors.assign(Error=errors['Forecast'] - errors['Actual'])[
+            ['Cutoff', 'Horizon', 'Brand', 'Type', 'Month', 'Forecast', 'Actual', 'Error']]
+
+        planned = [p.assign(Cutoff=cutoff) for cutoff, _, p, _ in results if p is not None and len(p)]
+        staffing_errors = pd.DataFrame(columns=['Cutoff', 'Brand', 'Month', 'Position', 'Forecast', 'Actual', 'Error'])
+        if planned:
+            planned = pd.concat(planned, ignore_index=True).rename(columns={'Employees': 'Forecast'})
+            # actual staffing of every month that was forecast, solved once for all cutoffs
+            actual_frame = actual_table.assign(
+                Brand=actual_table['Brand'].astype(str),
+                Month=pd.to_datetime(actual_table['Month'].astype(str)).dt.strftime('%Y-%m'))
+            actual_frame = actual_frame[actual_frame['Month'].isin(set(planned['Month']))]
+            needed = staffing(actual_frame, capabilities).rename(columns={'Employees': 'Actual'})
+            staffing_errors = planned.merge(needed, on=['Brand', 'Month', 'Position'], how='inner')
+            staffing_errors = staffing_errors.assign(Error=staffing_errors['Forecast'] - staffing_errors['Actual'])[
+                ['Cutoff', 'Brand', 'Month', 'Position', 'Forecast', 'Actual', 'Error']]
+
+        s.update(compared=len(errors), seconds_per_cutoff=round(float(np.mean([r[3] for r in results])), 3))
+        return {
+            'errors': errors,
+            'accuracy': accuracy(errors),
+            'staffing': staffing_errors,
+            'staffing_accuracy': staffing_accuracy(staffing_errors),
+            'cutoffs': pd.DataFrame({'Cutoff': [r[0] for r in results], 'Seconds': [round(r[3], 3) for r in results]}),
+        }
+
+def main(argv=None):
+    from tables import TABLE_TYPES, read_table
+
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of demand, transaction and staffing forecasts.")
+    parser.add_argument('demand', help="Step 1 demand table (Date, ###_Orders, ###_Quantity)")
+    parser.add_argument('summary', help="Step 2 transaction summary")
+    parser.add_argument('--actuals', help="actual transactions per brand and month (Brand, Month, ###_transactions ...); "
+                                          "default: the transactions the actual demand implies")
+    parser.add_argument('--capabilities', help="directory with one capability table per brand (<brand>.csv ...) "
+                                               "to also measure the staffing error")
+    parser.add_argument('--cutoffs', nargs='+', help="cutoff months (YYYY-MM); default: every --step months")
+    parser.add_argument('--step', type=int, default=1, help="months between cutoffs")
+    parser.add_argument('--min-history', type=int, default=24, help="months of history before the first cutoff")
+    parser.add_argument('--horizon', type=int, default=HORIZON, help="months compared after every cutoff")
+    parser.add_argument('--engine', default='store', choices=['store', 'numpy', 'statsmodels'],
+                        help="'store' carries fits between adjacent cutoffs; the others fit every cutoff cold")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', default='backtest', help="directory for the result tables (CSV)")
+    args = parser.parse_args(argv)
+
+    capabilities = {}
+    if args.capabilities:
+        for name in sorted(os.listdir(args.capabilities)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower().lstrip('.') in TABLE_TYPES:
+                capabilities[stem] = read_table(os.path.join(args.capabilities, name))
+
+    start = time.perf_counter()
+    results = backtest(
+        read_table(args.demand), read_table(args.summary), capabilities,
+        read_table(args.actuals) if args.actuals else None, args.cutoffs, args.step, args.min_history,
+        args.horizon, args.engine, workers=args.workers,
+        progress=lambda done, total, message: print(f'{done}/{total} {message}', file=sys.stderr, flush=True)
+    )
+    os.makedirs(args.output, exist_ok=True)
+    for name, table in results.items():
+        table.to_csv(os.path.join(args.output, f'{name}.csv'), index=False)
+
+    totals = accuracy(results['errors'], by=['Type'])
+    total = totals[totals['Type'] == 'Total']
+    print(f"{len(results['cutoffs'])} cutoffs in {time.perf_counter() - start:.1f} s ({args.output}/)")
+    if len(total):
+        print(f"Total transactions: MAPE {total['MAPE'].iloc[0]:.1%}, bias {total['Bias'].iloc[0]:+.1%}")
+    if len(results['staffing']):
+        error = results['staffing']['Error']
+        print(f"Staffing: mean absolute error {error.abs().mean():.2f} employees per brand, month and role, "
+              f"mean error {error.mean():+.2f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
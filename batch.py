@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from tables import read_table
+
+# Headless batch run of Steps 1-3 for many sites, without Streamlit.
+#
+#   python batch.py INPUT_DIR OUTPUT_DIR [--workers N] [--engine numpy] [--plots] [--integer]
+#
+# INPUT_DIR holds one directory per site (or is itself a single site):
+#
+#   <site>/demand.<table>                   Step 1: Date, ###_Orders, ###_Quantity
+#   <site>/summary.<table>                  Step 2: transaction summary (optional)
+#   <site>/order_lines.csv|parquet          raw order lines, aggregated by ingest.py into
+#                                           whichever of demand and summary is missing
+#   <site>/capabilities/<brand>.<table>     Step 3: capability matrix per brand (optional)
+#
+# <table> is any of parquet, arrow, feather, csv or xlsx (see tables.py).
+#
+# Sites run in parallel on a process pool. Each site's results are written to
+# OUTPUT_DIR/<site>/ by the worker as soon as that site finishes, and a line is
+# appended to OUTPUT_DIR/manifest.csv, which is started afresh every run. Charts
+# are only rendered with --plots, and staffing quantiles over Monte Carlo demand
+# scenarios only with --scenarios N.
+# --integer staffs whole employees with a MILP within --time-limit seconds per site
+# and records the optimality gap it reached in the summary. --shifts also plans every
+# staffed brand per day and shift (shift_plan.csv, see shift_planning.py). brand_report.csv
+# lists every brand's valid history window and, for brands not forecast, why.
+#
+# Every output table carries a Site column. After all sites finish, the staffing plans of
+# this run are combined into OUTPUT_DIR/network_staffing.csv: employees per month and role
+# across the network. --memory-limit MB caps each worker's address space.
+
+TABLE_EXTENSIONS = ('.parquet', '.arrow', '.feather', '.csv', '.xlsx')
+
+# Columns of manifest.csv, one row per site; integer_gap is empty unless --integer staffed the site
+MANIFEST_COLUMNS = ['site', 'status', 'message', 'brands', 'forecasted', 'staffed_brands', 'integer_gap', 'seconds']
+
+def find_table(directory: str, stem: str):
+    for ext in TABLE_EXTENSIONS:
+        path = os.path.join(directory, stem + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+def find_order_lines(directory: str):
+    for ext in ('.parquet', '.csv'):
+        path = os.path.join(directory, 'order_lines' + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+def has_inputs(directory: str) -> bool:
+    return find_table(directory, 'demand') is not None or find_order_lines(directory) is not None
+
+# Site directories under input_dir; input_dir itself when it directly holds a demand file or order lines
+def discover_sites(input_dir: str) -> dict:
+    input_dir = os.path.abspath(input_dir)
+    if has_inputs(input_dir):
+        return {os.path.basename(input_dir.rstrip(os.sep)): input_dir}
+    sites = {}
+    for name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, name)
+        if os.path.isdir(path) and has_inputs(path):
+            sites[name] = path
+    return sites
+
+# Step 1 quantity tables as the Step 2 input: Date + one column per forecasted brand
+def quantity_frame(qty_data: list, brands: list) -> pd.DataFrame:
+    quantity = pd.concat(
+        [table['Forecasted Quantity'].rename(brand) for table, brand in zip(qty_data, brands)], axis=1
+    )
+    return quantity.reset_index(drop=False, names=['Date']).fillna(0)
+
+# A site's summary before anything has run: every manifest column, all zero or empty
+def site_summary(site: str) -> dict:
+    return {'site': site, 'status': 'ok', 'message': '', 'brands': 0, 'forecasted': 0, 'staffed_brands': 0,
+            'integer_gap': None, 'seconds': None}
+
+# Running Steps 1-3 for one site and writing its outputs. Returns a (summary, staffing) tuple:
+# the summary dict and the site's staffed months (Month, Position, Employees of the feasible
+# plan rows; None when nothing was staffed)
+def run_site(site: str, site_dir: str, output_dir: str, plots: bool = False, engine: str = 'statsmodels',
+             scenarios: int = 0, integer: bool = False, time_limit: float = 10.0, shifts: bool = False) -> tuple:
+    from demand_forecast import smoothing, brand_report, chart_filename, render_chart
+    from ingest import ingest_order_lines, monthly_demand
+    from model_selection import select_demand_models
+    from scenarios import scenario_staffing
+    from orders_to_trans import forecast_transactions, total_transactions, brand_frame
+    from optimization import optimization_model_batch
+
+    start = time.perf_counter()
+    out = os.path.join(os.path.abspath(output_dir), site)
+    os.makedirs(out, exist_ok=True)
+    summary = site_summary(site)
+
+    try:
+        # Raw order lines, when the aggregated inputs are not there
+        demand_path, summary_path = find_table(site_dir, 'demand'), find_table(site_dir, 'summary')
+        if demand_path is None or summary_path is None:
+            lines_path = find_order_lines(site_dir)
+            if lines_path is not None:
+                ingested_demand, ingested_summary = ingest_order_lines(lines_path, summary=summary_path is None)
+                if demand_path is None:
+                    demand_path = os.path.join(out, 'demand.csv')
+                    ingested_demand.to_csv(demand_path, index=False)
+                if summary_path is None and ingested_summary is not None:
+                    summary_path = os.path.join(out, 'summary.csv')
+                    ingested_summary.to_csv(summary_path, index=False)
+
+        # Step 1
+        demand = monthly_demand(read_table(demand_path))
+        selection = None
+        if engine == 'auto' and list(demand.columns)[:1] == ['Date']:
+            selection = select_demand_models(demand)
+            selection.to_csv(os.path.join(out, 'model_selection.csv'), index=False)
+        order_plots, qty_plots, order_data, qty_data, brands = smoothing(demand, engine=engine, plots=plots,
+                                                                         selection=selection, site=site)
+        if type(order_plots) == str:
+            summary.update(status='error', message=order_plots)
+            return summary, None
+        forecasted = brands[:len(order_data)]
+        summary.update(brands=len(brands), forecasted=len(forecasted))
+        report = brand_report(demand, forecasted)
+        report.insert(0, 'Site', site)
+        report.to_csv(os.path.join(out, 'brand_report.csv'), index=False)
+        if plots:
+            os.makedirs(os.path.join(out, 'plots'), exist_ok=True)
+            for chart in order_plots + qty_plots:
+                with open(os.path.join(out, 'plots', chart_filename(chart)), 'wb') as f:
+                    f.write(render_chart(chart))
+
+        forecasts = pd.concat([
+            pd.concat([o['Forecasted Orders'], q['Forecasted Quantity']], axis=1).assign(Brand=brand)
+            for o, q, brand in zip(order_data, qty_data, forecasted)
+        ]) if forecasted else pd.DataFrame(columns=['Forecasted Orders', 'Forecasted Quantity', 'Brand'])
+        forecasts = forecasts.reset_index(names=['Month']).assign(Site=site)[
+            ['Site', 'Brand', 'Month', 'Forecasted Orders', 'Forecasted Quantity']]
+        forecasts.to_csv(os.path.join(out, 'demand_forecast.csv'), index=False)
+        if brands[len(forecasted):]:
+            excluded = report[report['Status'] != 'ok']
+            summary['message'] = '; '.join(f'{b}: {r}' for b, r in zip(excluded['Brand'], excluded['Status']))
+        if not forecasted:
+            return summary, None
+        quantity = quantity_frame(qty_data, forecasted)
+        quantity.to_csv(os.path.join(out, 'quantity_forecast.csv'), index=False)
+
+        # Step 2
+        if summary_path is None:
+            return summary, None
+        summary_table = read_table(summary_path)
+        projected = forecast_transactions(summary_table, quantity, site=site)
+        projected.to_csv(os.path.join(out, 'transactions.csv'), index=False)
+        total_transactions(projected).to_csv(os.path.join(out, 'total_transactions.csv'), index=False)
+
+        # Step 3
+        cap_dir = os.path.join(site_dir, 'capabilities')
+        staffed, caps = [], []
+        staffing = None
+        for brand in dict.fromkeys(projected['Brand']):
+            path = find_table(cap_dir, str(brand)) if os.path.isdir(cap_dir) else None
+            if path:
+                staffed.append(str(brand))
+                caps.append(read_table(path))
+        if staffed:
+            plan, success = optimization_model_batch(staffed, [brand_frame(projected, b) for b in staffed], caps,
+                                                     integer=integer, time_limit=time_limit, site=site)
+            plan.to_csv(os.path.join(out, 'staffing_plan.csv'), index=False)
+            staffing = plan.loc[plan['Success'], ['Month', 'Position', 'Employees']]
+            summary['staffed_brands'] = len(staffed)
+            if integer:
+                months = plan[plan['Success']].groupby(['row', 'brand_index']).agg(total=('Employees', 'sum'), gap=('Gap', 'first'))
+                if months['total'].sum() > 0:
+                    summary['integer_gap'] = round(float((months['gap'] * months['total']).sum() / months['total'].sum()), 4)
+            if not success:
+                summary.update(status='partial', message='some month/brand staffing problems were infeasible')
+            if shifts:
+                from shift_planning import plan_shifts
+
+                shift_plans = []
+                for b, cap in zip(staffed, caps):
+                    shift_plan, ok = plan_shifts(cap, brand_frame(projected, b))
+                    shift_plans.append(shift_plan.assign(Brand=b, Success=ok))
+                pd.concat(shift_plans, ignore_index=True).to_csv(os.path.join(out, 'shift_plan.csv'), index=False)
+            if scenarios:
+                table = scenario_staffing(demand, summary_table, dict(zip(staffed, caps)), scenarios=scenarios)
+                table.to_csv(os.path.join(out, 'staffing_scenarios.csv'), index=False)
+        return summary, staffing
+    except Exception as e:
+        summary.update(status='error', message=f'{type(e).__name__}: {e}')
+        with open(os.path.join(out, 'error.txt'), 'w') as f:
+            f.write(traceback.format_exc())
+        return summary, None
+    finally:
+        summary['seconds'] = round(time.perf_counter() - start, 3)
+        with open(os.path.join(out, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+# Bytes of input files under a site directory, to start the largest sites first
+def site_size(site_dir: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(site_dir) for name in names)
+
+# Worker initializer: caps the worker's address space, so an oversized site fails with a
+# MemoryError (recorded in its summary) instead of exhausting the machine. The libraries are
+# imported first, so the ceiling bounds their data rather than failing their imports; it still
+# counts the address space they map (a few hundred MB). Needs the Unix resource module;
+# elsewhere workers run unbounded.
+def limit_memory(megabytes: float) -> None:
+    try:
+        import resource
+    except ImportError:
+        return
+    import warmup
+    warmup.import_all(warmup.HEAVY_MODULES + warmup.APP_MODULES)
+    limit = int(megabytes * 1024 ** 2)
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+# Library entry point: yields each site's (summary, staffing) from run_site as soon as it finishes.
+# Sites are sharded over a pool of at most `workers` processes, largest input first so a
+# big site does not start last; memory_limit_mb caps every worker's address space (the
+# pool is used even for one worker then, so the calling process stays unbounded).
+def iter_batch(input_dir: str, output_dir: str, workers: int = None, plots: bool = False, engine: str = 'statsmodels',
+               scenarios: int = 0, integer: bool = False, time_limit: float = 10.0, shifts: bool = False,
+               memory_limit_mb: float = None):
+    sites = discover_sites(input_dir)
+    sites = dict(sorted(sites.items(), key=lambda item: site_size(item[1]), reverse=True))
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = os.path.join(output_dir, 'manifest.csv')
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+
+    def record(result):
+        row = pd.DataFrame([result[0]]).reindex(columns=MANIFEST_COLUMNS)
+        row.to_csv(manifest, mode='a', header=not os.path.exists(manifest), index=False)
+        return result
+
+    if (workers == 1 or len(sites) <= 1) and not memory_limit_mb:
+        for site, path in sites.items():
+            yield record(run_site(site, path, output_dir, plots, engine, scenarios, integer, time_limit, shifts))
+        return
+
+    limits = {'initializer': limit_memory, 'initargs': (memory_limit_mb,)} if memory_limit_mb else {}
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(sites))), **limits) as pool:
+        futures = {pool.submit(run_site, site, path, output_dir, plots, engine, scenarios, integer, time_limit, shifts): site
+                   for site, path in sites.items()}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # a crashed worker process
+                result = {**site_summary(futures[future]), 'status': 'error', 'message': f'{type(e).__name__}: {e}'}, None
+            yield record(result)
+
+# Network-wide staffing: the sites' staffed months ({site: staffing from run_site}) combined into
+# one total per month and role (Employees), with the number of sites staffing it and a 'Total' row per month
+def network_staffing(staffing: dict) -> pd.DataFrame:
+    plans = [plan.assign(Site=site) for site, plan in staffing.items() if plan is not None]
+    if not plans:
+        return pd.DataFrame(columns=['Month', 'Position', 'Employees', 'Sites'])
+    plan = pd.concat(plans, ignore_index=True)
+    roles = plan.groupby(['Month', 'Position']).agg(Employees=('Employees', 'sum'), Sites=('Site', 'nunique')).reset_index()
+    totals = plan.groupby('Month').agg(Employees=('Employees', 'sum'), Sites=('Site', 'nunique')).reset_index()
+    network = pd.concat([roles, totals.assign(Position='Total')], ignore_index=True)
+    network['Employees'] = network['Employees'].astype(int)
+    return network.sort_values('Month', kind='stable').reset_index(drop=True)  # roles, then the month's Total
+
+def run_batch(input_dir: str, output_dir: str, workers: int = None, plots: bool = False,
+              engine: str = 'statsmodels', scenarios: int = 0, integer: bool = False, time_limit: float = 10.0,
+              shifts: bool = False, memory_limit_mb: float = None) -> pd.DataFrame:
+    results = list(iter_batch(input_dir, output_dir, workers, plots, engine, scenarios, integer,
+                              time_limit, shifts, memory_limit_mb))
+    if results:
+        network = network_staffing({summary['site']: staffing for summary, staffing in results})
+        network.to_csv(os.path.join(output_dir, 'network_staffing.csv'), index=False)
+    return pd.DataFrame([summary for summary, _ in results])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run demand forecasting, transaction projection and staffing for every site in a directory.")
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=None, help="parallel sites (default: CPU count)")
+    parser.add_argument('--engine', default='statsmodels', choices=['statsmodels', 'numpy', 'auto'],
+                        help="'auto' picks each series' model by backtest and writes model_selection.csv")
+    parser.add_argument('--plots', action='store_true', help="also render forecast charts as PNG files")
+    parser.add_argument('--scenarios', type=int, default=0,
+                        help="Monte Carlo demand scenarios for staffing quantiles (staffing_scenarios.csv)")
+    parser.add_argument('--integer', action='store_true', help="staff whole employees with a MILP instead of rounding the LP")
+    parser.add_argument('--time-limit', type=float, default=10.0, help="seconds per site for --integer")
+    parser.add_argument('--shifts', action='store_true', help="also plan staffing per day and shift (shift_plan.csv)")
+    parser.add_argument('--memory-limit', type=float, default=None, metavar='MB',
+                        help="address space ceiling per worker process (Unix)")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    staffed = {}
+    for summary, staffing in iter_batch(args.input_dir, args.output_dir, args.workers, args.plots, args.engine,
+                                        args.scenarios, args.integer, args.time_limit, args.shifts, args.memory_limit):
+        failed += summary['status'] == 'error'
+        staffed[summary['site']] = staffing
+        print(f"{summary['site']}: {summary['status']} {summary.get('message', '')}".rstrip(), flush=True)
+
+    network = network_staffing(staffed)
+    network.to_csv(os.path.join(args.output_dir, 'network_staffing.csv'), index=False)
+    if len(network):
+        print(f"network: {network['Sites'].max()} sites, {network.loc[network['Position'] == 'Total', 'Employees'].max()} "
+              f"employees in the busiest month (network_staffing.csv)", flush=True)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import argparse
+import gc
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import holt_winters
+import synthetic_data
+import warmup
+
+# Benchmark harness for the three pipeline stages on synthetic inputs.
+#
+#   python benchmark.py                          # small, medium and large presets
+#   python benchmark.py --scales medium --engine numpy --output bench.csv
+#
+# Every stage is timed with perf_counter; peak memory is the tracemalloc peak of
+# Python and NumPy allocations during the stage (tracing slows pandas-heavy code
+# down somewhat; use --no-memory for clean wall times). With --output, results
+# are appended to a CSV so runs can be compared over time.
+#
+#   python benchmark.py --startup                # import cost of the app, deferred vs eager
+#   python benchmark.py --check-engines          # numpy vs statsmodels forecasts, exits 1 on a mismatch
+
+SCALES = {
+    'small': {'brands': 5, 'months': 36, 'types': 8, 'roles': 5},
+    'medium': {'brands': 50, 'months': 60, 'types': 20, 'roles': 10},
+    'large': {'brands': 200, 'months': 120, 'types': 40, 'roles': 20},
+}
+
+# Running fn once; returns its result, wall time in seconds and peak traced memory in MB
+def measure(fn, *args, memory: bool = True, **kwargs) -> tuple:
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2 if memory else float('nan')
+        if memory:
+            tracemalloc.stop()
+    return result, wall, peak
+
+# Inputs for every stage at one scale
+def make_inputs(brands: int, months: int, types: int, roles: int, seed: int = 0) -> dict:
+    codes = synthetic_data.brand_codes(brands)
+    return {
+        'demand': synthetic_data.synthetic_demand(brands, months, seed=seed),
+        'summary': synthetic_data.synthetic_summary(codes, types, seed=seed),
+        'quantity': synthetic_data.synthetic_quantity(codes, seed=seed),
+        'brands': codes,
+        'forecasts': [synthetic_data.synthetic_transaction_forecast(types, seed=seed + i) for i in range(brands)],
+        'capabilities': [synthetic_data.synthetic_capabilities(roles, types, seed=seed + i) for i in range(brands)],
+    }
+
+def run_benchmarks(scales: dict, engine: str = 'statsmodels', workers: int = 1, memory: bool = True,
+                   stages: tuple = ('smoothing', 'forecast_transactions', 'optimization_model_batch')) -> pd.DataFrame:
+    from demand_forecast import smoothing
+    from orders_to_trans import forecast_transactions
+    from optimization import optimization_model_batch
+
+    rows = []
+    for name, size in scales.items():
+        inputs = make_inputs(**size)
+        runs = {
+            'smoothing': lambda: smoothing(inputs['demand'].copy(), workers=workers, engine=engine),
+            'forecast_transactions': lambda: forecast_transactions(inputs['summary'], inputs['quantity']),
+            'optimization_model_batch': lambda: optimization_model_batch(
+                inputs['brands'], inputs['forecasts'], inputs['capabilities']
+            ),
+        }
+        for stage in stages:
+            _, wall, peak = measure(runs[stage], memory=memory)
+            rows.append({'scale': name, **size, 'stage': stage, 'wall_s': round(wall, 4), 'peak_mb': round(peak, 2)})
+            print(f"{name:>8} {stage:<26} {wall:9.3f} s {peak:9.1f} MB", flush=True)
+    return pd.DataFrame(rows)
+
+# Relative difference between the 'numpy' and 'statsmodels' forecasts of every series (orders and
+# quantity of each brand, after exp) on one scale's synthetic demand; holt_winters promises at most
+# FORECAST_TOLERANCE. A series only one engine forecast differs by inf.
+def engine_agreement(brands: int, months: int, seed: int = 0) -> pd.DataFrame:
+    from demand_forecast import smoothing
+
+    demand = synthetic_data.synthetic_demand(brands, months, seed=seed)
+    results = {engine: smoothing(demand.copy(), engine=engine, plots=False) for engine in ('numpy', 'statsmodels')}
+    forecasts = {}
+    for engine, (_, _, order_data, qty_data, names) in results.items():
+        for brand, orders, quantity in zip(names, order_data, qty_data):
+            forecasts[engine, brand, 'Orders'] = orders.iloc[:, 0].to_numpy()
+            forecasts[engine, brand, 'Quantity'] = quantity.iloc[:, 0].to_numpy()
+    rows = []
+    for engine, brand, series in forecasts:
+        if engine != 'statsmodels':
+            continue
+        reference = forecasts['statsmodels', brand, series] + 1
+        kernel = forecasts.get(('numpy', brand, series))
+        difference = np.inf if kernel is None else float(np.max(np.abs(kernel + 1 - reference) / reference))
+        rows.append({'brand': brand, 'series': series, 'difference': difference})
+    return pd.DataFrame(rows, columns=['brand', 'series', 'difference'])
+
+# Import time of the app's modules in fresh interpreters (median of `repeats`): 'deferred' is what a
+# first page load costs now, 'eager' adds the heavy dependencies every page load used to import
+def startup_times(repeats: int = 5) -> pd.DataFrame:
+    base = ('pandas', 'streamlit') + warmup.APP_MODULES
+    modes = {'deferred': base, 'eager': base + warmup.HEAVY_MODULES}
+    rows = []
+    for mode, modules in modes.items():
+        code = ("import sys, time; start = time.perf_counter(); import warmup; "
+                f"warmup.import_all({modules!r}); print(time.perf_counter() - start); "
+                f"print(sum(m in sys.modules for m in {warmup.HEAVY_MODULES!r}))")
+        runs = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 capture_output=True, text=True, check=True).stdout.split()
+            runs.append(float(out[0]))
+        wall = statistics.median(runs)
+        rows.append({'scale': 'startup', 'stage': f'import_{mode}', 'wall_s': round(wall, 4), 'peak_mb': float('nan')})
+        print(f"{'startup':>8} {'import_' + mode:<26} {wall:9.3f} s   ({out[1]} of {len(warmup.HEAVY_MODULES)} heavy modules loaded)",
+              flush=True)
+    return pd.DataFrame(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark smoothing, forecast_transactions and optimization_model_batch.")
+    parser.add_argument('--scales', nargs='+', default=list(SCALES), choices=list(SCALES) + ['custom'])
+    parser.add_argument('--brands', type=int, default=20, help="brands for --scales custom")
+    parser.add_argument('--months', type=int, default=48, help="history months for --scales custom")
+    parser.add_argument('--types', type=int, default=10, help="transaction types for --scales custom")
+    parser.add_argument('--roles', type=int, default=8, help="roles for --scales custom")
+    parser.add_argument('--stages', nargs='+', default=['smoothing', 'forecast_transactions', 'optimization_model_batch'],
+                        choices=['smoothing', 'forecast_transactions', 'optimization_model_batch'])
+    parser.add_argument('--engine', default='statsmodels', choices=['statsmodels', 'numpy', 'auto'])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc for undisturbed wall times")
+    parser.add_argument('--output', help="CSV file to append results to")
+    parser.add_argument('--startup', action='store_true', help="measure the app's import time instead of the stages")
+    parser.add_argument('--repeats', type=int, default=5, help="fresh interpreters per --startup measurement")
+    parser.add_argument('--check-engines', action='store_true',
+                        help="check the numpy forecasts against statsmodels instead of timing the stages")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        results = startup_times(args.repeats)
+        results.insert(0, 'timestamp', pd.Timestamp.now().isoformat(timespec='seconds'))
+        results.insert(1, 'engine', args.engine)
+        if args.output:
+            results.to_csv(args.output, mode='a', header=not os.path.exists(args.output), index=False)
+        return 0
+
+    scales = {}
+    for name in args.scales:
+        if name == 'custom':
+            scales[name] = {'brands': args.brands, 'months': args.months, 'types': args.types, 'roles': args.roles}
+        else:
+            scales[name] = SCALES[name]
+
+    if args.check_engines:
+        failed = 0
+        for name, size in scales.items():
+            table = engine_agreement(size['brands'], size['months'])
+            worse = table[~(table['difference'] <= holt_winters.FORECAST_TOLERANCE)]
+            print(f"{name:>8} {len(table)} series, largest difference {table['difference'].max():.4g} "
+                  f"(tolerance {holt_winters.FORECAST_TOLERANCE:g})", flush=True)
+            if len(worse):
+                print(f"{len(worse)} series differ by more than the tolerance:\n{worse.to_string(index=False)}",
+                      file=sys.stderr, flush=True)
+                failed += 1
+        return 1 if failed else 0
+
+    results = run_benchmarks(scales, args.engine, args.workers, not args.no_memory, tuple(args.stages))
+    results.insert(0, 'timestamp', pd.Timestamp.now().isoformat(timespec='seconds'))
+    results.insert(1, 'engine', args.engine)
+    if args.output:
+        results.to_csv(args.output, mode='a', header=not os.path.exists(args.output), index=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
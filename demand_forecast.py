@@ -1,103 +1,305 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from statsmodels.tsa.holtwinters import ExponentialSmoothing
+from concurrent.futures import ProcessPoolExecutor
+import holt_winters
+import model_store
+import model_selection
+from profiling import span, record_span
 import os
-import re
-
-def smoothing(data: pd.DataFrame) -> tuple:    
-    if 'Date' != list(data.columns)[0]:
-        return "ERROR: First column of the data must be a valid 'Date' column.", 0, 0, 0, 0
-    clen = len(data.columns)
-    cols = list(data.columns)
-    i = 1
-    brands = []
-    while i < clen:
-        if not re.match(r'^[0-9]{3}_Orders$', cols[i]):
-            return "ERROR: Data must contain '###_Orders' and '###_Quantity' columns in that order for each desired brand ###.", 0, 0, 0, 0
-        if not re.match(r'^[0-9]{3}_Quantity$', cols[i + 1]):
-            return "ERROR: Data must contain '###_Orders' and '###_Quantity' columns in that order for each desired brand ###.", 0, 0, 0, 0
-        if cols[i][:3] != cols[i + 1][:3]:
-            return "ERROR: Mismatch between brands for an Orders-Quantity column pair detected. Ensure columns are ordered correctly and grouped by brand.", 0, 0, 0, 0
-        brands.append(cols[i][:3])
-        i += 2
+import time
+
+# Fitting one log-transformed series and forecasting the next 12 months.
+# Kept at module level so it can be sent to worker processes; returns None
+# when the fit fails so one bad series does not stop the others.
+def fit_series(hist: pd.Series, periods: int = 12):
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing  # deferred: ~2 s to import
 
     try:
-        data['Date'] = pd.to_datetime(data['Date'])
-    except ValueError as e:
-        return "ERROR: Unable to convert 'Date' column to datetime. Ensure the date format is a valid format in the 'Date' column.", 0, 0, 0, 0
+        model = ExponentialSmoothing(
+            hist,
+            trend='add',
+            seasonal='add',
+            seasonal_periods=6,
+            initialization_method='legacy-heuristic'
+        ).fit(optimized=True)
+        return model.forecast(periods)
+    except Exception:
+        return None
+
+# fit_series plus its wall time, measured where the fit runs (possibly a worker process)
+def fit_series_timed(hist: pd.Series, periods: int = 12) -> tuple:
+    start = time.perf_counter()
+    forecast = fit_series(hist, periods)
+    return forecast, time.perf_counter() - start
+
+# Fitting every series either in this process or across a process pool.
+# Results (forecast, seconds) come back in the same order as hists.
+# progress: optional callback(done, total) after every fitted series; an exception it
+# raises (e.g. a cancelled job) stops the fitting and drops the queued work
+def fit_all_series(hists: list, workers: int = 1, progress=None) -> list:
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(hists))
+    results = []
+    if workers <= 1:
+        for h in hists:
+            results.append(fit_series_timed(h))
+            if progress is not None:
+                progress(len(results), len(hists))
+        return results
+    chunksize = max(1, len(hists) // (workers * 4))
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for result in pool.map(fit_series_timed, hists, chunksize=chunksize):
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(hists))
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return results
+
+# CHARTS
+# smoothing() returns chart data rather than image files; nothing is rasterized
+# until render_chart() is called for a chart somebody actually wants to see.
+
+CHART_STYLE = {
+    'Orders': {'history': 'Historical Orders', 'forecast': 'Forecasted Orders', 'ylabel': 'Total Orders',
+               'marker': 'o', 'avg_color': 'gray'},
+    'Quantity': {'history': 'Actual Quantity', 'forecast': 'Forecast Quantity', 'ylabel': 'Order Quantity',
+                 'marker': 'x', 'avg_color': 'purple'},
+}
 
-    data = data.set_index('Date').asfreq('MS')
+# Everything needed to draw one chart: raw history, forecast and the forecast average
+def forecast_chart(brand: str, series: str, history: pd.Series, forecast: pd.Series) -> dict:
+    return {'brand': brand, 'series': series, 'history': history, 'forecast': forecast,
+            'average': float(forecast.mean())}
+
+# Chart data as one frame (Date index; history, forecast and average columns) for st.line_chart and friends
+def chart_frame(chart: dict) -> pd.DataFrame:
+    style = CHART_STYLE[chart['series']]
+    frame = pd.concat([chart['history'].rename(style['history']), chart['forecast'].rename(style['forecast'])], axis=1)
+    frame[f"Avg Forecast: {chart['average']:.0f}"] = chart['average']
+    return frame
+
+# File name the charts used to be saved under in Images/
+def chart_filename(chart: dict) -> str:
+    if chart['series'] == 'Orders':
+        return f"total_orders_forecast_{chart['brand']}.png"
+    return f"order_quantity_forecast_{chart['brand']}.png"
+
+# Rendering one chart to PNG bytes in memory, styled like the original Images/ plots
+def render_chart(chart: dict, dpi: int = 100) -> bytes:
+    import io
+    from matplotlib.figure import Figure  # no pyplot: no global state, safe off the main thread
+
+    with span('render_chart', brand=chart['brand'], series=chart['series']):
+        style = CHART_STYLE[chart['series']]
+        fig = Figure(figsize=(12, 5))
+        ax = fig.subplots()
+        ax.plot(chart['history'].index, chart['history'], label=style['history'], marker=style['marker'])
+        ax.plot(chart['forecast'].index, chart['forecast'], label=style['forecast'], linestyle='--', marker=style['marker'])
+        ax.axhline(chart['average'], color=style['avg_color'], linestyle=':', label=f"Avg Forecast: {chart['average']:.0f}")
+        ax.set_xlabel('Date')
+        ax.set_ylabel(style['ylabel'])
+        ax.legend()
+        ax.grid(True)
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=dpi)
+        return buffer.getvalue()
+
+# DATA PREPARATION
+# Validating the columns and finding every brand's valid window in one pass over the whole
+# table. A window runs from a brand's first to its last month with any orders or quantity;
+# zero months inside it are kept. Brands need MIN_MONTHS months in their window.
+
+MIN_MONTHS = 12
+COLUMN_ERROR = "ERROR: Data must contain '###_Orders' and '###_Quantity' columns in that order for each desired brand ###."
+
+# Returns an error message, or (brands, data, windows, report):
+#   data     the monthly table indexed by Date (asfreq 'MS'), one Orders and one Quantity column per brand
+#   windows  {brand: (start, stop)} row slices of data for the brands that can be forecast
+#   report   one row per brand: Brand, First, Last, Months, Status ('ok' or why it is excluded)
+def prepare_demand(data: pd.DataFrame):
+    cols = [str(c) for c in data.columns]
+    if not cols or cols[0] != 'Date':
+        return "ERROR: First column of the data must be a valid 'Date' column."
+    parts = pd.Index(cols[1:], dtype=object).str.extract(r'^([0-9]{3})_(Orders|Quantity)$')
+    if len(parts) % 2:
+        return COLUMN_ERROR
+    names, kinds = parts[0].to_numpy(), parts[1].to_numpy()
+    shape_ok = (kinds[0::2] == 'Orders') & (kinds[1::2] == 'Quantity')
+    same_brand = names[0::2] == names[1::2]
+    bad = ~(shape_ok & same_brand)
+    if bad.any():
+        if not shape_ok[bad.argmax()]:
+            return COLUMN_ERROR
+        return "ERROR: Mismatch between brands for an Orders-Quantity column pair detected. Ensure columns are ordered correctly and grouped by brand."
+    brands = list(names[0::2])
+
+    try:
+        dates = pd.to_datetime(data['Date'])
+    except ValueError:
+        return "ERROR: Unable to convert 'Date' column to datetime. Ensure the date format is a valid format in the 'Date' column."
+    data = data.drop(columns='Date').set_axis(pd.DatetimeIndex(dates, name='Date')).asfreq('MS')
+    try:
+        values = data.to_numpy(dtype=float)
+    except (ValueError, TypeError):
+        return "ERROR: Orders and Quantity columns must be numeric."
 
-    # Temorary Images directory
-    if not os.path.exists('Images'):
-        os.makedirs('Images')
+    # first and last active month of every brand; missing months (NaN) count as active, as before
+    active = ~((values[:, 0::2] == 0) & (values[:, 1::2] == 0))
+    has_any = active.any(axis=0)
+    if len(values) == 0:  # header-only upload: every brand is invalid
+        first = stop = np.zeros(len(brands), dtype=int)
+    else:
+        first = active.argmax(axis=0)
+        stop = len(values) - active[::-1].argmax(axis=0)
+    months = np.where(has_any, stop - first, 0)
+
+    status = np.where(months >= MIN_MONTHS, 'ok', np.where(
+        has_any, np.char.add(np.char.add('only ', months.astype(str)), f' months of history (needs {MIN_MONTHS})'),
+        'no orders or quantity'
+    ))
+    index = data.index.strftime('%Y-%m').to_numpy(dtype=object)
+    report = pd.DataFrame({
+        'Brand': brands,
+        'First': np.where(has_any, index[first] if len(index) else None, None),
+        'Last': np.where(has_any, index[stop - 1] if len(index) else None, None),
+        'Months': months,
+        'Status': status,
+    })
+    windows = {b: (int(first[k]), int(stop[k])) for k, b in enumerate(brands) if months[k] >= MIN_MONTHS}
+    return brands, data, windows, report
+
+# Per-brand preparation report of a demand table; with the brands smoothing() forecasted,
+# brands whose models could not be fitted are marked too. Returns an error message for invalid tables.
+def brand_report(data: pd.DataFrame, forecasted: list = None):
+    prepared = prepare_demand(data)
+    if isinstance(prepared, str):
+        return prepared
+    report = prepared[3]
+    if forecasted is not None:
+        failed = (report['Status'] == 'ok') & ~report['Brand'].isin([str(b) for b in forecasted])
+        report.loc[failed, 'Status'] = 'model could not be fitted'
+    return report
+
+# engine: 'statsmodels' fits each series with ExponentialSmoothing (optionally over
+# `workers` processes); 'numpy' fits all series at once with holt_winters.fit_forecast_series
+# store: a model_store.ModelStore (or SQLite path) holding fitted states per series; when given,
+# series whose earlier history is unchanged are only updated with their new months
+# (reoptimize=True also re-tunes their parameters from the stored ones)
+# engine='auto' forecasts every series with its model from model_selection: `selection` is
+# a select_models() table (e.g. from select_demand_models); without one the selection is
+# run here over `workers` processes
+# plots: the first two returned lists hold forecast_chart() data per forecasted brand;
+# False is the forecast-only path and leaves None in their place
+# progress: optional callback(done, total, message) reporting fitted brands (see jobs.Job.report)
+# site: optional site (distribution center) name; the forecast tables then lead with a Site column
+def smoothing(data: pd.DataFrame, workers: int = 1, engine: str = 'statsmodels',
+              store=None, reoptimize: bool = False, plots: bool = True, selection: pd.DataFrame = None,
+              progress=None, site: str = None) -> tuple:
+    site_field = {} if site is None else {'site': site}
+    with span('smoothing', engine=engine, workers=workers, columns=len(data.columns), **site_field) as s:
+        result = _smoothing(data, workers, engine, store, reoptimize, plots, selection, progress)
+        if type(result[0]) == str:
+            s['error'] = result[0]
+        else:
+            s['brands'] = len(result[4])
+            s['forecasted'] = len(result[2])
+            if site is not None:
+                for table in result[2] + result[3]:
+                    table.insert(0, 'Site', site)
+        return result
+
+def _smoothing(data, workers, engine, store, reoptimize, plots, selection, progress):
+    prepare_start = time.perf_counter()
+    if engine not in ('statsmodels', 'numpy', 'auto'):
+        return "ERROR: Forecasting engine must be 'statsmodels', 'numpy' or 'auto'.", 0, 0, 0, 0
+    prepared = prepare_demand(data)
+    if isinstance(prepared, str):
+        return prepared, 0, 0, 0, 0
+    brands, data, windows, report = prepared
 
     order_plots = []
     qty_plots = []
     order_data = []
     qty_data = []
-    invalid_brands = []
-
-    # Forecasting total orders (log-transformed)
-    for brand in brands:
-        # Log-transforming the data
-        tot_orders = data[f'{brand}_Orders'].copy()
-        tot_qty = data[f'{brand}_Quantity'].copy()
-        hist_orders = np.log(data[f'{brand}_Orders'] + 1)
-        hist_qty = np.log(data[f'{brand}_Quantity'] + 1)
-
-        # Trim to valid date range from beginning
-        for d in data.index:
-            if data[f'{brand}_Orders'][d] == 0 and data[f'{brand}_Quantity'][d] == 0:
-                tot_orders = tot_orders[tot_orders.index > d]
-                tot_qty = tot_qty[tot_qty.index > d]
-                hist_orders = hist_orders[hist_orders.index > d]
-                hist_qty = hist_qty[hist_qty.index > d]
-            else:
-                break
-
-        # Trim from the end
-        for d in reversed(data.index):
-            if data[f'{brand}_Orders'][d] == 0 and data[f'{brand}_Quantity'][d] == 0:
-                tot_orders = tot_orders[tot_orders.index < d]
-                tot_qty = tot_qty[tot_qty.index < d]
-                hist_orders = hist_orders[hist_orders.index < d]
-                hist_qty = hist_qty[hist_qty.index < d]
-            else:
-                break
-
-        if len(hist_orders) < 12 or len(hist_qty) < 12:
+    invalid_brands = [b for b in brands if b not in windows]
+
+    # Window views of every forecastable brand; log(x + 1) is taken for the whole table at once
+    logs = np.log(data.to_numpy(dtype=float) + 1)
+    valid = []
+    for k, brand in enumerate(brands):
+        if brand not in windows:
+            continue
+        start, stop = windows[brand]
+        rows = data.index[start:stop]
+        valid.append((
+            brand,
+            data.iloc[start:stop, 2 * k],
+            data.iloc[start:stop, 2 * k + 1],
+            pd.Series(logs[start:stop, 2 * k], index=rows, name=f'{brand}_Orders'),
+            pd.Series(logs[start:stop, 2 * k + 1], index=rows, name=f'{brand}_Quantity'),
+        ))
+
+    record_span('smoothing.prepare', time.perf_counter() - prepare_start, brands=len(brands), rows=len(data),
+                excluded=len(invalid_brands))
+
+    # Per-brand progress; every brand has an orders and a quantity series
+    def fitted(done_series, total_series):
+        if progress is not None and done_series % 2 == 0:
+            progress(done_series // 2, len(valid), f'Fitted {done_series // 2} of {len(valid)} brands')
+
+    # Fitting orders and quantity models for every brand (in parallel when workers > 1)
+    hists = []
+    for brand, tot_orders, tot_qty, hist_orders, hist_qty in valid:
+        hists.extend([hist_orders, hist_qty])
+    with span('smoothing.fit', series=len(hists), engine='store' if store is not None else engine) as fit_span:
+        if store is not None:
+            if isinstance(store, str):
+                store = model_store.ModelStore(store)
+            keys = []
+            for brand, *_ in valid:
+                keys.extend([f'{brand}_Orders', f'{brand}_Quantity'])
+            forecasts, modes = model_store.update_forecast_series(hists, keys, store, reoptimize=reoptimize)
+            fit_span['modes'] = {m: modes.count(m) for m in set(modes)}
+        elif engine == 'numpy':
+            forecasts = holt_winters.fit_forecast_series(hists)
+        elif engine == 'auto':
+            raws, keys = [], []
+            for brand, tot_orders, tot_qty, *_ in valid:
+                raws.extend([tot_orders, tot_qty])
+                keys.extend([f'{brand}_Orders', f'{brand}_Quantity'])
+            if selection is None:
+                selection = model_selection.select_models(dict(zip(keys, raws)), workers=workers, progress=progress)
+            forecasts = model_selection.forecast_selected(raws, keys, selection, progress=fitted)
+            fit_span['models'] = selection.set_index('series')['model'].reindex(keys).dropna().to_dict()
+        else:
+            timed = fit_all_series(hists, workers, progress=fitted)
+            forecasts = [f for f, _ in timed]
+            # per-brand fit times, measured inside whichever process ran the fit
+            for i, (brand, *_) in enumerate(valid):
+                record_span('smoothing.fit_series', timed[2 * i][1], brand=brand, series='Orders')
+                record_span('smoothing.fit_series', timed[2 * i + 1][1], brand=brand, series='Quantity')
+        fitted(len(hists), len(hists))
+
+    for i, (brand, tot_orders, tot_qty, hist_orders, hist_qty) in enumerate(valid):
+        forecast_log_orders = forecasts[2 * i]
+        forecast_log_quantity = forecasts[2 * i + 1]
+        if forecast_log_orders is None or forecast_log_quantity is None:
             invalid_brands.append(brand)
             continue
 
         # Forecasting total orders
-        model_orders = ExponentialSmoothing(
-            hist_orders,
-            trend='add',
-            seasonal='add',
-            seasonal_periods=6,
-            initialization_method='legacy-heuristic'
-        ).fit(optimized=True)
-        forecast_log_orders = model_orders.forecast(12)
         forecast_orders = np.exp(forecast_log_orders)
         forecast_orders = forecast_orders - 1
         avg_orders = forecast_orders.mean()
 
-        # Creating forecasted plots
-        plt.figure(figsize=(12, 5))
-        plt.plot(tot_orders.index, tot_orders, label='Historical Orders', marker='o')
-        plt.plot(forecast_orders.index, forecast_orders, label='Forecasted Orders', linestyle='--', marker='o')
-        plt.axhline(avg_orders, color='gray', linestyle=':', label=f'Avg Forecast: {avg_orders:.0f}')
-        plt.xlabel('Date')
-        plt.ylabel('Total Orders')
-        plt.legend()
-        plt.grid(True)
-        plt.tight_layout()
-        filename = f'Images/total_orders_forecast_{brand}.png'
-        plt.savefig(filename)
-        order_plots.append(filename)
-        plt.close()
+        # Chart data for the orders forecast (rendered later, only if someone looks at it)
+        order_plots.append(forecast_chart(brand, 'Orders', tot_orders, forecast_orders) if plots else None)
 
         order_data.append(pd.DataFrame({
                             'Forecasted Orders': forecast_orders,
@@ -106,32 +308,12 @@ def smoothing(data: pd.DataFrame) -> tuple:
         order_data[-1].index = order_data[-1].index.strftime('%Y-%m')
 
         # Forecasting order quantity (log-transformed)
-        model_quantity = ExponentialSmoothing(
-            hist_qty,
-            trend='add',
-            seasonal='add',
-            seasonal_periods=6,
-            initialization_method='legacy-heuristic'
-        ).fit(optimized=True)
-        forecast_log_quantity = model_quantity.forecast(12)
         forecast_quantity = np.exp(forecast_log_quantity)
         forecast_quantity = forecast_quantity - 1
         avg_quantity = forecast_quantity.mean()
 
-        # Ploting order quantity
-        plt.figure(figsize=(12, 5))
-        plt.plot(tot_qty.index, tot_qty, label='Actual Quantity', marker='x')
-        plt.plot(forecast_quantity.index, forecast_quantity, label='Forecast Quantity', linestyle='--', marker='x')
-        plt.axhline(avg_quantity, color='purple', linestyle=':', label=f'Avg Forecast: {avg_quantity:.0f}')
-        plt.xlabel('Date')
-        plt.ylabel('Order Quantity')
-        plt.legend()
-        plt.grid(True)
-        plt.tight_layout()
-        filename = f'Images/order_quantity_forecast_{brand}.png'
-        plt.savefig(filename)
-        qty_plots.append(filename)
-        plt.close()
+        # Chart data for the quantity forecast
+        qty_plots.append(forecast_chart(brand, 'Quantity', tot_qty, forecast_quantity) if plots else None)
 
         qty_data.append(pd.DataFrame({
                     'Forecasted Quantity': forecast_quantity,
@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+
+# Batched additive-trend, additive-seasonal Holt-Winters in NumPy.
+#
+# Matches ExponentialSmoothing(trend='add', seasonal='add', seasonal_periods=m,
+# initialization_method='legacy-heuristic').fit(optimized=True) as used by
+# demand_forecast.smoothing(): the same legacy initial states, the same
+# recursions and the same constraints (beta <= alpha, gamma <= 1 - alpha), but
+# every series (and every candidate parameter set) is filtered at once over a
+# 2-D array. Parameters are picked by a coarse grid, a batched pattern search
+# and a few batched Newton steps instead of L-BFGS-B. On log-transformed demand
+# series 12-month forecasts agree with statsmodels to within FORECAST_TOLERANCE
+# (relative, after exp); `python benchmark.py --check-engines` checks every
+# synthetic preset. The largest differences are series where statsmodels stops
+# on the beta = 0 bound with a higher SSE than the kernel finds.
+
+LOWER_BOUND = np.sqrt(np.finfo(float).eps)  # same alpha bound statsmodels uses
+FORECAST_TOLERANCE = 0.02
+
+# Offsets of the 3 x 3 x 3 finite-difference stencil around a parameter point
+STENCIL = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'), axis=-1).reshape(-1, 3).astype(float)
+
+# Legacy-heuristic initial level, trend and seasonals for left-aligned series
+# Y: (S, T) array padded with NaN on the right, lengths: (S,) observations per series
+def initial_states(Y: np.ndarray, lengths: np.ndarray, m: int = 6) -> tuple:
+    T = Y.shape[1]
+    on_season = (np.arange(T) % m == 0)[None, :] & (np.arange(T)[None, :] < lengths[:, None])
+    l0 = np.where(on_season, Y, 0.0).sum(axis=1) / on_season.sum(axis=1)
+    b0 = ((Y[:, m:2 * m] - Y[:, :m]) / m).mean(axis=1)
+    s0 = Y[:, :m] - l0[:, None]
+    return l0, b0, s0
+
+# Running the recursions for every series and every candidate parameter set at once.
+# alpha/beta/gamma are (S, P); initial states are per series. Returns the SSE of the
+# one-step-ahead errors (S, P), the states after each series' last observation and
+# the seasonal of the last observed slot before its final update (see forecast_states).
+# offset: (S,) observations already filtered into the given states, so a stored state
+# can be carried forward with only the new observations in Y.
+def filter_series(Y, lengths, alpha, beta, gamma, l0, b0, s0, m: int = 6, offset=None) -> tuple:
+    S, P = alpha.shape
+    rows = np.arange(S)
+    offset = np.zeros(S, dtype=int) if offset is None else np.asarray(offset)
+    level = np.repeat(l0[:, None], P, axis=1)
+    trend = np.repeat(b0[:, None], P, axis=1)
+    season = np.repeat(s0[:, None, :], P, axis=1)  # (S, P, m) circular buffer, slot t % m
+    sse = np.zeros((S, P))
+    stale = np.zeros((S, P))
+    for t in range(Y.shape[1]):
+        valid = (t < lengths)[:, None]
+        y = Y[:, t][:, None]
+        slot = (offset + t) % m
+        s_old = season[rows, :, slot]
+        err = y - (level + trend + s_old)
+        sse += np.where(valid, err * err, 0.0)
+        new_level = alpha * (y - s_old) + (1 - alpha) * (level + trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        new_season = gamma * (y - level - trend) + (1 - gamma) * s_old
+        stale = np.where(valid, s_old, stale)
+        level = np.where(valid, new_level, level)
+        trend = np.where(valid, new_trend, trend)
+        season[rows, :, slot] = np.where(valid, new_season, s_old)
+    return sse, level, trend, season, stale
+
+# Mapping the unit cube onto (alpha, beta, gamma) with statsmodels' constraints
+def to_params(u: np.ndarray) -> tuple:
+    alpha = LOWER_BOUND + u[..., 0] * (1 - 2 * LOWER_BOUND)
+    beta = u[..., 1] * alpha
+    gamma = u[..., 2] * (1 - alpha)
+    return alpha, beta, gamma
+
+def _sse(Y, lengths, u, l0, b0, s0, m):
+    alpha, beta, gamma = to_params(u)
+    return filter_series(Y, lengths, alpha, beta, gamma, l0, b0, s0, m)[0]
+
+# Newton steps on the SSE for every series at once, from a central-difference gradient and
+# Hessian over STENCIL; steepest descent where the Hessian is not positive definite. Each step
+# is line searched (including not moving), so the SSE never increases.
+def refine(Y, lengths, u, l0, b0, s0, m: int = 6, iterations: int = 5, h: float = 1e-3) -> np.ndarray:
+    S = len(u)
+    rows = np.arange(S)
+    fractions = np.array([0.0, 1.0, 0.5, 0.25, 0.125, 0.0625])
+    for _ in range(iterations):
+        centre = np.clip(u, h, 1 - h)  # keeps the stencil inside the unit cube
+        f = _sse(Y, lengths, centre[:, None, :] + STENCIL[None] * h, l0, b0, s0, m).reshape(S, 3, 3, 3)
+        gradient = np.stack([f[:, 2, 1, 1] - f[:, 0, 1, 1], f[:, 1, 2, 1] - f[:, 1, 0, 1],
+                             f[:, 1, 1, 2] - f[:, 1, 1, 0]], axis=-1) / (2 * h)
+        hessian = np.empty((S, 3, 3))
+        hessian[:, 0, 0] = f[:, 2, 1, 1] - 2 * f[:, 1, 1, 1] + f[:, 0, 1, 1]
+        hessian[:, 1, 1] = f[:, 1, 2, 1] - 2 * f[:, 1, 1, 1] + f[:, 1, 0, 1]
+        hessian[:, 2, 2] = f[:, 1, 1, 2] - 2 * f[:, 1, 1, 1] + f[:, 1, 1, 0]
+        hessian[:, 0, 1] = hessian[:, 1, 0] = (f[:, 2, 2, 1] - f[:, 2, 0, 1] - f[:, 0, 2, 1] + f[:, 0, 0, 1]) / 4
+        hessian[:, 0, 2] = hessian[:, 2, 0] = (f[:, 2, 1, 2] - f[:, 2, 1, 0] - f[:, 0, 1, 2] + f[:, 0, 1, 0]) / 4
+        hessian[:, 1, 2] = hessian[:, 2, 1] = (f[:, 1, 2, 2] - f[:, 1, 2, 0] - f[:, 1, 0, 2] + f[:, 1, 0, 0]) / 4
+        hessian /= h * h
+        direction = -gradient
+        convex = np.linalg.eigvalsh(hessian)[:, 0] > 0
+        direction[convex] = -np.linalg.solve(hessian[convex], gradient[convex][..., None])[..., 0]
+        cand = np.clip(u[:, None, :] + fractions[None, :, None] * direction[:, None, :], 0.0, 1.0)
+        sse = _sse(Y, lengths, cand, l0, b0, s0, m)
+        u = cand[rows, np.argmin(sse, axis=1)]
+    return u
+
+# Fitting every series at once. Returns a dict of (S,) arrays: alpha, beta, gamma, sse,
+# level, trend and an (S, m) array of seasonals ordered by slot (t % m).
+# start: optional (S, 3) unit-cube starting points (warm start); skips the grid search.
+# newton: Newton steps (see refine) after the pattern search.
+def fit_batch(Y: np.ndarray, lengths: np.ndarray, m: int = 6, grid: int = 8,
+              iterations: int = 40, start: np.ndarray = None, step: float = 0.125, newton: int = 5) -> dict:
+    Y = np.asarray(Y, dtype=float)
+    lengths = np.asarray(lengths)
+    S = Y.shape[0]
+    l0, b0, s0 = initial_states(Y, lengths, m)
+
+    if start is None:
+        # coarse grid in the unit cube, every point evaluated for every series
+        axis = (np.arange(grid) + 0.5) / grid
+        points = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+        best_u = np.empty((S, 3))
+        chunk = max(1, 2_000_000 // (len(points) * max(Y.shape[1], 1)))
+        for i in range(0, S, chunk):
+            sl = slice(i, i + chunk)
+            u = np.broadcast_to(points, (len(Y[sl]), len(points), 3))
+            sse = _sse(Y[sl], lengths[sl], u, l0[sl], b0[sl], s0[sl], m)
+            best_u[sl] = points[np.argmin(sse, axis=1)]
+        step = 0.5 / grid
+    else:
+        best_u = np.clip(np.asarray(start, dtype=float), 0.0, 1.0)
+
+    # batched pattern search: try +/- step on each coordinate, halve the step when nothing improves
+    moves = np.vstack([np.zeros(3), np.eye(3), -np.eye(3)])  # (7, 3)
+    steps = np.full(S, step)
+    for _ in range(iterations):
+        cand = np.clip(best_u[:, None, :] + moves[None, :, :] * steps[:, None, None], 0.0, 1.0)
+        sse = _sse(Y, lengths, cand, l0, b0, s0, m)
+        pick = np.argmin(sse, axis=1)
+        best_u = cand[np.arange(S), pick]
+        steps = np.where(pick == 0, steps / 2, steps)
+        if np.all(steps < 1e-5):
+            break
+    if newton and S:
+        best_u = refine(Y, lengths, best_u, l0, b0, s0, m, newton)
+
+    alpha, beta, gamma = to_params(best_u)
+    sse, level, trend, season, stale = filter_series(
+        Y, lengths, alpha[:, None], beta[:, None], gamma[:, None], l0, b0, s0, m
+    )
+    return {
+        'alpha': alpha, 'beta': beta, 'gamma': gamma, 'u': best_u,
+        'sse': sse[:, 0], 'level': level[:, 0], 'trend': trend[:, 0], 'season': season[:, 0, :],
+        'stale': stale[:, 0], 'lengths': lengths,
+    }
+
+# h-step forecasts (S, h) from the final states; the next observation after
+# a series of length n uses seasonal slot n % m. statsmodels forecasts the last
+# observed slot ((n - 1) % m) with its value from before the final update, so
+# passing stale reproduces its forecasts exactly.
+def forecast_states(level, trend, season, lengths, h: int = 12, m: int = 6, stale=None) -> np.ndarray:
+    lengths = np.asarray(lengths)
+    steps = np.arange(1, h + 1)
+    slots = (lengths[:, None] + steps[None, :] - 1) % m
+    seasonal = np.take_along_axis(season, slots, axis=1)
+    if stale is not None:
+        seasonal = np.where(slots == ((lengths - 1) % m)[:, None], np.asarray(stale)[:, None], seasonal)
+    return level[:, None] + steps[None, :] * trend[:, None] + seasonal
+
+# Stacking pandas series of different lengths into a left-aligned NaN-padded array
+def stack_series(hists: list) -> tuple:
+    lengths = np.array([len(h) for h in hists])
+    Y = np.full((len(hists), lengths.max() if len(hists) else 0), np.nan)
+    for i, h in enumerate(hists):
+        Y[i, :lengths[i]] = np.asarray(h, dtype=float)
+    return Y, lengths
+
+# Dates for the periods following a history series (plain integers when it has no frequency)
+def forecast_index(hist: pd.Series, periods: int = 12):
+    index = hist.index
+    freq = None
+    if isinstance(index, pd.DatetimeIndex):
+        freq = index.freq or pd.infer_freq(index)
+    if freq is not None:
+        return pd.date_range(index[-1], periods=periods + 1, freq=freq)[1:]
+    return pd.RangeIndex(len(hist), len(hist) + periods)
+
+# Series the kernel can fit: at least two full seasons and no missing values
+def fittable(hist: pd.Series, m: int = 6) -> bool:
+    return len(hist) >= 2 * m and bool(np.all(np.isfinite(np.asarray(hist, dtype=float))))
+
+# Drop-in batch replacement for demand_forecast.fit_series over many series.
+# Returns one forecast Series per input (None for series that cannot be fitted).
+def fit_forecast_series(hists: list, periods: int = 12, m: int = 6) -> list:
+    ok = [i for i, h in enumerate(hists) if fittable(h, m)]
+    results = [None] * len(hists)
+    if not ok:
+        return results
+    Y, lengths = stack_series([hists[i] for i in ok])
+    fit = fit_batch(Y, lengths, m)
+    fc = forecast_states(fit['level'], fit['trend'], fit['season'], lengths, periods, m, fit['stale'])
+    for row, i in enumerate(ok):
+        if not np.all(np.isfinite(fc[row])):
+            continue
+        results[i] = pd.Series(fc[row], index=forecast_index(hists[i], periods), name='predicted_mean')
+    return results
@@ -0,0 +1,196 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from profiling import span
+
+# Building the Step 1 demand table and the Step 2 transaction summary from raw order lines.
+#
+#   python ingest.py order_lines.parquet --demand demand.csv --summary summary.csv
+#
+# The input (CSV or Parquet, any size) has one row per order line:
+#
+#   date, brand, order_id, quantity, transaction_type
+#
+# (column names are configurable). It is read in chunks of `chunksize` rows and only
+# the per-chunk aggregates are kept, so memory is bounded by brands x months and
+# brands x types rather than by the number of lines.
+#
+# Orders are distinct order ids per brand and month, counted in any line order: every
+# chunk's (brand, month, order) keys are merged into one running de-duplicated table of
+# integers (a brand code, the month and a 64-bit hash of the order id), 24 bytes per
+# distinct order. Counts are exact barring a hash collision between two orders of the same
+# brand and month. Without an order column every line is an order.
+# Each line is one transaction of its type; lines without a brand go to `no_brand`.
+
+DEFAULT_COLUMNS = {'date': 'date', 'brand': 'brand', 'order': 'order_id', 'quantity': 'quantity',
+                   'type': 'transaction_type'}
+
+# Chunks of the requested columns from a CSV or Parquet file, as DataFrames
+def read_chunks(path: str, columns: list, chunksize: int = 1_000_000):
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet order lines requires pyarrow (pip install pyarrow).")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=str)
+
+def _brand_labels(brands: pd.Series, no_brand: str) -> pd.Series:
+    labels = brands.astype('string').str.strip()
+    return labels.mask(labels.isna() | (labels == ''), no_brand).astype(str)
+
+# Adding one frame of partial aggregates into the running totals (both indexed the same way)
+def _accumulate(totals, part):
+    if totals is None:
+        return part
+    return totals.add(part, fill_value=0)
+
+# Reading order lines once and aggregating both outputs.
+# Returns (demand, summary): demand is Date, ###_Orders, ###_Quantity (one row per month,
+# months without lines filled with 0) and summary is brand, <type>_transactions,
+# <type>_quantity ..., transactions, quantity. summary is None when `type` is not a column.
+def ingest_order_lines(path: str, columns: dict = None, chunksize: int = 1_000_000,
+                       no_brand: str = 'no_brand', summary: bool = True) -> tuple:
+    names = {**DEFAULT_COLUMNS, **(columns or {})}
+    wanted = [names[k] for k in ('date', 'brand', 'order', 'quantity', 'type')
+              if names[k] is not None and (k != 'type' or summary)]
+
+    monthly = None
+    by_type = None
+    orders = None  # distinct (brand code, month, order hash) keys so far
+    brand_codes = {}  # brand -> its code in orders
+    with span('ingest', file=path, chunksize=chunksize) as s:
+        s['rows'] = s['skipped'] = s['chunks'] = 0
+        for chunk in read_chunks(path, wanted, chunksize):
+            s['chunks'] += 1
+            s['rows'] += len(chunk)
+            # months as integer ordinals (months since 1970-01); boxing Periods per line is slow
+            dates = pd.to_datetime(chunk[names['date']], errors='coerce').to_numpy()
+            month = dates.astype('datetime64[M]').astype(np.int64)
+            qty = pd.to_numeric(chunk[names['quantity']], errors='coerce').to_numpy()
+            ok = ~np.isnat(dates) & ~np.isnan(qty)
+            s['skipped'] += int((~ok).sum())
+            if not ok.all():
+                chunk, month, qty = chunk[ok], month[ok], qty[ok]
+            if chunk.empty:
+                continue
+            lines = pd.DataFrame({'brand': _brand_labels(chunk[names['brand']], no_brand).to_numpy(),
+                                  'month': month, 'quantity': qty})
+
+            # Transaction summary over the whole history: lines and quantity per brand and type
+            if summary and names['type'] is not None:
+                lines['type'] = chunk[names['type']].astype('string').str.strip().values
+                typed = lines[lines['type'].notna() & (lines['type'] != '')]
+                part = typed.groupby(['brand', 'type'], sort=False)['quantity'].agg(['size', 'sum'])
+                by_type = _accumulate(by_type, part)
+
+            # Monthly demand for branded lines
+            branded = lines[lines['brand'] != no_brand]
+            if branded.empty:
+                continue
+            part = branded.groupby(['brand', 'month'], sort=False)['quantity'].sum().to_frame('Quantity')
+            if names['order'] is None:
+                part['Orders'] = branded.groupby(['brand', 'month'], sort=False).size()
+            else:
+                codes, uniques = pd.factorize(branded['brand'])
+                lookup = np.array([brand_codes.setdefault(b, len(brand_codes)) for b in uniques], dtype=np.int64)
+                keys = pd.DataFrame({
+                    'brand': lookup[codes], 'month': branded['month'].to_numpy(),
+                    'order': pd.util.hash_array(chunk[names['order']].to_numpy()[branded.index].astype(str)),
+                })
+                # an order whose lines are spread over several chunks is kept once
+                orders = keys.drop_duplicates() if orders is None else \
+                    pd.concat([orders, keys], ignore_index=True).drop_duplicates(ignore_index=True)
+            monthly = _accumulate(monthly, part)
+
+        if orders is not None:
+            counts = orders.groupby(['brand', 'month'], sort=False).size()
+            brand_names = np.array(list(brand_codes), dtype=object)
+            counts.index = pd.MultiIndex.from_arrays(
+                [brand_names[counts.index.get_level_values('brand')], counts.index.get_level_values('month')],
+                names=['brand', 'month'])
+            monthly['Orders'] = counts
+
+        s['brands'] = 0 if monthly is None else monthly.index.get_level_values('brand').nunique()
+
+    return demand_table(monthly), (summary_table(by_type, no_brand) if by_type is not None else None)
+
+# Quantities stay integers when every line had a whole-number quantity
+def _whole(values: np.ndarray) -> np.ndarray:
+    if np.all(values == np.round(values)):
+        return values.astype(np.int64)
+    return values
+
+# Monthly (brand, month) totals as the wide table smoothing() reads
+def demand_table(monthly) -> pd.DataFrame:
+    if monthly is None or monthly.empty:
+        return pd.DataFrame({'Date': []})
+    wide = monthly[['Orders', 'Quantity']].unstack('brand', fill_value=0)
+    months = np.arange(wide.index.min(), wide.index.max() + 1)
+    wide = wide.reindex(months, fill_value=0)
+    data = {'Date': pd.DatetimeIndex(months.astype('datetime64[M]')).strftime('%Y-%m-%d')}
+    for brand in sorted(wide.columns.get_level_values('brand').unique()):
+        data[f'{brand}_Orders'] = wide[('Orders', brand)].to_numpy().round().astype(np.int64)
+        data[f'{brand}_Quantity'] = _whole(wide[('Quantity', brand)].to_numpy())
+    return pd.DataFrame(data)
+
+# (brand, type) line counts and quantity as the transaction summary forecast_pipeline reads
+def summary_table(by_type: pd.DataFrame, no_brand: str = 'no_brand') -> pd.DataFrame:
+    txn = by_type['size'].unstack('type', fill_value=0)
+    qty = by_type['sum'].unstack('type', fill_value=0)
+    types = sorted(txn.columns)
+    brands = sorted(b for b in txn.index if b != no_brand) + [b for b in txn.index if b == no_brand]
+    data = {'brand': brands}
+    for t in types:
+        data[f'{t}_transactions'] = txn.loc[brands, t].to_numpy().astype(np.int64)
+        data[f'{t}_quantity'] = _whole(qty.loc[brands, t].to_numpy())
+    data['transactions'] = txn.loc[brands, types].sum(axis=1).to_numpy().astype(np.int64)
+    data['quantity'] = _whole(qty.loc[brands, types].sum(axis=1).to_numpy())
+    return pd.DataFrame(data)
+
+# Rolling an already aggregated demand table with sub-monthly dates (e.g. the 1st and 15th)
+# up to calendar months; smoothing() reindexes to month starts and would drop the other rows.
+# Tables that are not a Date column plus numeric columns are returned unchanged so that
+# smoothing() can report what is wrong with them.
+def monthly_demand(demand: pd.DataFrame) -> pd.DataFrame:
+    if list(demand.columns)[:1] != ['Date'] or not all(pd.api.types.is_numeric_dtype(t) for t in demand.dtypes.iloc[1:]):
+        return demand
+    try:
+        dates = pd.to_datetime(demand['Date']).to_numpy()
+    except (ValueError, TypeError):
+        return demand
+    if np.isnat(dates).any():
+        return demand
+    month = dates.astype('datetime64[M]').astype(np.int64)
+    monthly = demand.drop(columns='Date').groupby(month, sort=True).sum()
+    monthly = monthly.reindex(np.arange(month.min(), month.max() + 1), fill_value=0)
+    monthly.insert(0, 'Date', pd.DatetimeIndex(monthly.index.to_numpy().astype('datetime64[M]')).strftime('%Y-%m-%d'))
+    return monthly.reset_index(drop=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate raw order lines into the Step 1 demand table and the Step 2 transaction summary.")
+    parser.add_argument('input', help="order lines (.csv or .parquet)")
+    parser.add_argument('--demand', default='demand.csv', help="output demand table (CSV)")
+    parser.add_argument('--summary', default='summary.csv', help="output transaction summary (CSV)")
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    for key, default in DEFAULT_COLUMNS.items():
+        parser.add_argument(f'--{key}-column', default=default, help=f"column holding the {key} (default: {default})")
+    parser.add_argument('--no-order-column', action='store_true', help="count every line as one order")
+    args = parser.parse_args(argv)
+
+    columns = {key: getattr(args, f'{key}_column') for key in DEFAULT_COLUMNS}
+    if args.no_order_column:
+        columns['order'] = None
+    demand, summary = ingest_order_lines(args.input, columns, args.chunksize)
+    demand.to_csv(args.demand, index=False)
+    print(f"{args.demand}: {len(demand)} months, {(len(demand.columns) - 1) // 2} brands")
+    if summary is not None:
+        summary.to_csv(args.summary, index=False)
+        print(f"{args.summary}: {len(summary)} brands")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
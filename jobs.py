@@ -0,0 +1,130 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from profiling import collect
+
+# Background jobs for the Streamlit app, shared by every session on the server.
+#
+#   job = manager.submit(session_id, 'step1', key, fn, *args)   # fn(job, *args)
+#   if job.done(): value = job.result()
+#   else: show job.progress / job.message and poll again
+#
+# Each session has one slot per stage. Submitting a job with a different key (the inputs
+# changed) cancels the slot's previous job; submitting the same key returns the running job.
+# At most max_jobs jobs run at once; the rest wait in the executor's queue. Cancellation is
+# cooperative: the job function reports progress through job.report(), which raises
+# JobCancelled once the job has been cancelled, so work stops at the next checkpoint.
+# A job runs in a copy of the submitter's context; the timing spans it finishes are kept
+# in job.spans for the script run that picks up its result. A job that failed is replaced
+# when the same key is submitted again, so a rerun retries it.
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, owner: str, slot: str, key: str):
+        self.owner = owner
+        self.slot = slot
+        self.key = key
+        self.progress = 0.0
+        self.message = 'Queued'
+        self.submitted = time.time()
+        self.finished = None
+        self.future = None
+        self.spans = []  # profiling spans finished inside the job
+        self._cancelled = threading.Event()
+
+    # progress callback for the job function: done out of total steps, plus a status line
+    def report(self, done: int, total: int, message: str = '') -> None:
+        if self._cancelled.is_set():
+            raise JobCancelled(f'{self.slot} job cancelled')
+        self.progress = min(1.0, done / total) if total else 0.0
+        if message:
+            self.message = message
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+        self.message = 'Cancelled'
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def error(self):
+        if not self.done() or self.future.cancelled():
+            return None
+        return self.future.exception()
+
+class JobManager:
+    def __init__(self, max_jobs: int = None, keep_seconds: float = 600):
+        self.max_jobs = max_jobs or int(os.environ.get('CPC_MAX_JOBS', 0)) or os.cpu_count() or 1
+        self.keep_seconds = keep_seconds
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='cpc-job')
+        self._jobs = {}  # (owner, slot) -> Job
+        self._lock = threading.Lock()
+
+    # CPU processes one job may use so that max_jobs jobs together do not oversubscribe the server
+    def workers_per_job(self) -> int:
+        return max(1, (os.cpu_count() or 1) // self.max_jobs)
+
+    def submit(self, owner: str, slot: str, key: str, fn, *args, **kwargs) -> Job:
+        with self._lock:
+            self._prune()
+            current = self._jobs.get((owner, slot))
+            if current is not None and current.key == key and not current.cancelled and current.error() is None:
+                return current
+            if current is not None and not current.done():
+                current.cancel()  # its inputs are outdated
+            job = Job(owner, slot, key)
+            job.future = self._executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+            self._jobs[(owner, slot)] = job
+            return job
+
+    def get(self, owner: str, slot: str):
+        with self._lock:
+            return self._jobs.get((owner, slot))
+
+    def cancel(self, owner: str, slot: str) -> None:
+        job = self.get(owner, slot)
+        if job is not None:
+            job.cancel()
+
+    @staticmethod
+    def _run(job: Job, fn, args, kwargs):
+        job.message = 'Running'
+        try:
+            if job.cancelled:
+                raise JobCancelled(f'{job.slot} job cancelled')
+            with collect() as spans:
+                job.spans = spans
+                value = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.message = 'Done'
+            return value
+        finally:
+            job.finished = time.time()
+
+    # forgetting finished jobs nobody has looked at for a while (sessions that went away)
+    def _prune(self) -> None:
+        now = time.time()
+        stale = [k for k, job in self._jobs.items()
+                 if job.finished is not None and now - job.finished > self.keep_seconds]
+        for k in stale:
+            del self._jobs[k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        running = sum(1 for job in jobs if job.message not in ('Queued', 'Done', 'Cancelled') and not job.done())
+        queued = sum(1 for job in jobs if job.message == 'Queued' and not job.done())
+        return {'running': running, 'queued': queued, 'max_jobs': self.max_jobs}
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import holt_winters
+
+# Persisted Holt-Winters parameters and final states per series.
+#
+# When a demand file only gains new months, the stored state is carried forward
+# by filtering just the new observations with the stored parameters (optionally
+# followed by a warm-started re-optimization). A series is refitted from scratch
+# only when its earlier history changed: different start date, fewer
+# observations than stored, or a different hash of the stored prefix.
+#
+# Incremental filtering keeps the initial states of the original fit, so its
+# forecasts can drift slightly from a cold refit, whose legacy initial level is
+# recomputed over the longer history. Pass refit=True to force a cold refit.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hw_state (
+    series_key TEXT PRIMARY KEY,
+    seasonal_periods INTEGER NOT NULL,
+    first_date TEXT NOT NULL,
+    n_obs INTEGER NOT NULL,
+    history_hash TEXT NOT NULL,
+    alpha REAL NOT NULL,
+    beta REAL NOT NULL,
+    gamma REAL NOT NULL,
+    u TEXT NOT NULL,
+    level REAL NOT NULL,
+    trend REAL NOT NULL,
+    season TEXT NOT NULL,
+    stale REAL NOT NULL,
+    sse REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+COLUMNS = ['series_key', 'seasonal_periods', 'first_date', 'n_obs', 'history_hash', 'alpha', 'beta',
+           'gamma', 'u', 'level', 'trend', 'season', 'stale', 'sse', 'updated_at']
+
+def history_hash(values) -> str:
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+# SQLite-backed store; namespace separates series of different datasets sharing one file
+class ModelStore:
+    def __init__(self, path: str = 'hw_state.sqlite', namespace: str = ''):
+        self.path = path
+        self.namespace = namespace
+        with self._connect() as conn:
+            conn.execute(SCHEMA)
+
+    def _connect(self):
+        # a short-lived connection per call keeps the store usable from any thread or process
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _key(self, key: str) -> str:
+        return f'{self.namespace}/{key}' if self.namespace else key
+
+    def load(self, keys: list) -> dict:
+        full = {self._key(k): k for k in keys}
+        if not full:
+            return {}
+        rows = {}
+        with self._connect() as conn:
+            names = list(full)
+            for i in range(0, len(names), 500):  # stay under SQLite's bound-parameter limit
+                chunk = names[i:i + 500]
+                cur = conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM hw_state WHERE series_key IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                )
+                for values in cur:
+                    row = dict(zip(COLUMNS, values))
+                    row['u'] = np.array(json.loads(row['u']))
+                    row['season'] = np.array(json.loads(row['season']))
+                    rows[full[row['series_key']]] = row
+        return rows
+
+    def save(self, records: dict) -> None:
+        now = time.time()
+        values = []
+        for key, r in records.items():
+            values.append((
+                self._key(key), int(r['seasonal_periods']), r['first_date'], int(r['n_obs']), r['history_hash'],
+                float(r['alpha']), float(r['beta']), float(r['gamma']), json.dumps([float(v) for v in r['u']]),
+                float(r['level']), float(r['trend']), json.dumps([float(v) for v in r['season']]),
+                float(r['stale']), float(r['sse']), now
+            ))
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO hw_state ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                values
+            )
+
+    def delete(self, keys: list) -> None:
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM hw_state WHERE series_key = ?", [(self._key(k),) for k in keys])
+
+def _record(hist, values, m, fit, j):
+    return {
+        'seasonal_periods': m, 'first_date': str(hist.index[0]), 'n_obs': len(values),
+        'history_hash': history_hash(values), 'alpha': fit['alpha'][j], 'beta': fit['beta'][j],
+        'gamma': fit['gamma'][j], 'u': fit['u'][j], 'level': fit['level'][j], 'trend': fit['trend'][j],
+        'season': fit['season'][j], 'stale': fit['stale'][j], 'sse': fit['sse'][j],
+    }
+
+# Forecasting series (log-space pd.Series, like demand_forecast.fit_series) through the store.
+# keys identify each series (e.g. '451_Orders'). Returns the forecasts (None when a series
+# cannot be fitted) and how each one was obtained: 'full', 'incremental', 'reoptimized',
+# 'unchanged' or 'invalid'. Series without new observations keep their stored state, also
+# with reoptimize.
+def update_forecast_series(hists: list, keys: list, store: ModelStore, periods: int = 12, m: int = 6,
+                           reoptimize: bool = False, refit: bool = False) -> tuple:
+    forecasts = [None] * len(hists)
+    modes = ['invalid'] * len(hists)
+    ok = [i for i, h in enumerate(hists) if holt_winters.fittable(h, m)]
+    stored = store.load([keys[i] for i in ok]) if not refit else {}
+    values = {i: np.asarray(hists[i], dtype=float) for i in ok}
+
+    full, incremental, unchanged = [], [], []
+    for i in ok:
+        row = stored.get(keys[i])
+        if (row is None or row['seasonal_periods'] != m or row['first_date'] != str(hists[i].index[0])
+                or row['n_obs'] > len(values[i])
+                or history_hash(values[i][:row['n_obs']]) != row['history_hash']):
+            full.append(i)
+        elif row['n_obs'] == len(values[i]):
+            unchanged.append(i)
+        else:
+            incremental.append(i)
+
+    states = {i: stored[keys[i]] for i in unchanged}  # series position -> record
+    changed = {}
+    for i in unchanged:
+        modes[i] = 'unchanged'
+    if full:
+        Y, lengths = holt_winters.stack_series([hists[i] for i in full])
+        fit = holt_winters.fit_batch(Y, lengths, m)
+        for j, i in enumerate(full):
+            states[i] = changed[keys[i]] = _record(hists[i], values[i], m, fit, j)
+            modes[i] = 'full'
+
+    if incremental and reoptimize:
+        # warm start: a short pattern search around the stored parameters over the whole history
+        Y, lengths = holt_winters.stack_series([hists[i] for i in incremental])
+        start = np.array([stored[keys[i]]['u'] for i in incremental])
+        fit = holt_winters.fit_batch(Y, lengths, m, start=start, step=1 / 64, iterations=20)
+        for j, i in enumerate(incremental):
+            states[i] = changed[keys[i]] = _record(hists[i], values[i], m, fit, j)
+            modes[i] = 'reoptimized'
+    elif incremental:
+        rows = [stored[keys[i]] for i in incremental]
+        offset = np.array([r['n_obs'] for r in rows])
+        new = [values[i][r['n_obs']:] for i, r in zip(incremental, rows)]
+        lengths = np.array([len(v) for v in new])
+        Y = np.full((len(new), lengths.max()), np.nan)
+        for j, v in enumerate(new):
+            Y[j, :len(v)] = v
+        col = lambda name: np.array([r[name] for r in rows])[:, None]
+        sse, level, trend, season, stale = holt_winters.filter_series(
+            Y, lengths, col('alpha'), col('beta'), col('gamma'),
+            np.array([r['level'] for r in rows]), np.array([r['trend'] for r in rows]),
+            np.array([r['season'] for r in rows]), m, offset=offset
+        )
+        for j, i in enumerate(incremental):
+            r = dict(rows[j])
+            r.update({
+                'n_obs': len(values[i]), 'history_hash': history_hash(values[i]),
+                'level': level[j, 0], 'trend': trend[j, 0], 'season': season[j, 0, :],
+                'stale': stale[j, 0], 'sse': r['sse'] + sse[j, 0],
+            })
+            states[i] = changed[keys[i]] = r
+            modes[i] = 'incremental'
+
+    if changed:
+        store.save(changed)
+
+    for i, r in states.items():
+        fc = holt_winters.forecast_states(
+            np.array([r['level']]), np.array([r['trend']]), np.array([r['season']]),
+            np.array([r['n_obs']]), periods, m, np.array([r['stale']])
+        )[0]
+        if np.all(np.isfinite(fc)):
+            forecasts[i] = pd.Series(fc, index=holt_winters.forecast_index(hists[i], periods), name='predicted_mean')
+        else:
+            modes[i] = 'invalid'
+    return forecasts, modes
@@ -1,58 +1,179 @@
 import pandas as pd
 import numpy as np
-from scipy.optimize import linprog
-
-# cleaning forecast columns to allow for retrieval
-
-def clean_forecast_columns(df):
-    cleaned_cols = []  # initialize cleaned cols
-    col_map = {}       # initialize col mapping
-    for col in df.columns:
-        if col == "Month":
-            cleaned_cols.append("Month")
-            col_map[col] = "Month"  # keep month as is
-        elif "_transactions" in col:
+import time
+from typing import NamedTuple
+from profiling import span
+
+# PRECOMPILED INPUTS
+# Capability and forecast uploads turned into arrays once (the app does it at "Add Brand" time), so
+# building a month's LP is array indexing: no column parsing and no list.index lookups per solve.
+# Transaction types are sorted ints and unique (the first column of a repeated type wins).
+
+class CapabilityMatrix(NamedTuple):
+    roles: list          # role names, one per row of C
+    types: np.ndarray    # transaction type of every column of C
+    C: np.ndarray        # C[i][j] = type-j transactions one employee of role i completes per month
+
+class ForecastMatrix(NamedTuple):
+    labels: list         # month labels (see month_labels)
+    types: np.ndarray    # transaction type of every column of D
+    D: np.ndarray        # D[m][j] = type-j transactions needed in month m (NaN: not forecast)
+
+def _sorted_types(types, values):
+    types, first = np.unique(np.asarray(types, dtype=np.int64), return_index=True)
+    return types, values[:, first]
+
+def compile_capabilities(df_capabilities):
+    if isinstance(df_capabilities, CapabilityMatrix):
+        return df_capabilities
+    roles = df_capabilities['Position'].tolist()
+    numeric = df_capabilities.drop(columns='Position')
+    types, C = _sorted_types(numeric.columns.astype(int), numeric.to_numpy(dtype=float))
+    return CapabilityMatrix(roles, types, np.ascontiguousarray(C))
+
+# accepts a raw forecast ("341_transactions" columns) or one with integer type columns
+def compile_forecast(df_forecast):
+    if isinstance(df_forecast, ForecastMatrix):
+        return df_forecast
+    columns, types = [], []
+    for col in df_forecast.columns:
+        if isinstance(col, (int, np.integer)):
+            t = int(col)
+        elif isinstance(col, str) and "_transactions" in col:
             try:
-                trans_type = int(col.replace("_transactions", ""))
-                cleaned_cols.append(trans_type)
-                col_map[col] = trans_type  # removing the _transactions from the col name and making the number an int
+                t = int(col.replace("_transactions", ""))
             except ValueError:
-                continue  # skip columns like "Total Transactions" bc gives error
-    df = df[col_map.keys()]
-    df.columns = cleaned_cols  # make the cols clean
-    return df  # return df with cleaned cols
+                continue  # skip columns like "Total Transactions"
+        else:
+            continue
+        columns.append(col)
+        types.append(t)
+    types, D = _sorted_types(types, df_forecast[columns].to_numpy(dtype=float).reshape(len(df_forecast), len(columns)))
+    return ForecastMatrix(month_labels(df_forecast), types, np.ascontiguousarray(D))
+
+
+# building the staffing LP for one month: roles, reduced capability matrix, demand vector and
+# the transaction types of its rows (None when the forecast and capabilities share no types).
+# Takes DataFrames or their compiled forms; pass compiled ones when building many months.
+
+def build_staffing_problem(df_capabilities, df_forecast, row_index=0):
+    cap = compile_capabilities(df_capabilities)
+    forecast = compile_forecast(df_forecast)
+
+    # transaction types both needed this month and possible to fulfill
+    demand = forecast.D[row_index]
+    common, cap_idx, forecast_idx = np.intersect1d(cap.types, forecast.types, assume_unique=True, return_indices=True)
+    needed = ~np.isnan(demand[forecast_idx])
+    if not needed.any():
+        return None
+
+    C_reduced = cap.C[:, cap_idx[needed]]
+    D = demand[forecast_idx[needed]]
+    return cap.roles, C_reduced, D, common[needed].tolist()
 
 
 # OPTIMIZATION FUNCTION
+# integer=True staffs whole employees with a MILP (see integer_staffing) instead of rounding
+# every role of the LP solution up; time_limit (seconds) and mip_rel_gap bound the search.
+# It then also returns the gap reached, as a fourth value: how far the total may be above
+# the best possible one (0 when proven optimal, NaN when the LP failed), as the Gap column of
+# optimization_model_batch does
 
-def optimize_staffing_from_dataframe(df_capabilities, df_forecast, row_index=0):  # taking the dfs and row_index (month)
+def optimize_staffing_from_dataframe(df_capabilities, df_forecast, row_index=0,  # taking the dfs and row_index (month)
+                                     integer=False, time_limit=10.0, mip_rel_gap=1e-3):
+    with span('optimize_staffing', row_index=row_index, integer=integer) as s:
+        staffing, total, success, gap = _optimize_staffing(df_capabilities, df_forecast, row_index,
+                                                           integer, time_limit, mip_rel_gap)
+        s['success'] = success
+        if integer:
+            s['gap'] = gap
+            return staffing, total, success, gap
+        return staffing, total, success
 
-    roles = df_capabilities['Position'].tolist()  # getting role names
-    capability_matrix = df_capabilities.drop(columns='Position')  # dropping position col to get numeric transaction capabilities
-    transaction_types = capability_matrix.columns.astype(int).tolist()  # extracting types as ints
+# INTEGER STAFFING
+# Whole employees for staffing LPs that were already solved, under one time budget. Rounding
+# every role of an LP solution up is always feasible, so it is each block's starting incumbent.
+# A small MILP per block (HiGHS, with mip_rel_gap) then searches for a plan with fewer
+# employees; a cutoff row (total <= incumbent - 1) makes it search only for improvements.
+# Blocks are visited largest possible improvement first, and each gets an equal share of
+# the remaining budget, so unused time carries over. Once the budget runs out, the remaining
+# blocks keep their rounded plans. ceil(LP optimum) bounds a block's integer optimum from
+# below; HiGHS's dual bound may raise it, and an infeasible cutoff proves the incumbent
+# optimal. Gaps are measured against that bound.
+# problems: (roles, C_reduced, D, types) per block; lp_solutions: the LP solution of each
+# progress: optional callback(done, total, message) before every block; an exception it raises
+# (e.g. a cancelled job) stops the search between MILPs
+# Returns the integer solution and the lower bound of every block, plus a summary
+def integer_staffing(problems, lp_solutions, time_limit=10.0, mip_rel_gap=1e-3, name='integer_staffing',
+                     progress=None):
+    from scipy.optimize import milp, LinearConstraint
 
-    C = capability_matrix.to_numpy()  # C[i][j] = number of type-j transactions one employee of role i can complete per month
-    R = len(roles)  # number of roles
+    solutions = [np.ceil(np.maximum(x, 0) - 1e-9) for x in lp_solutions]
+    bounds = [max(0.0, np.ceil(x.sum() - 1e-6)) for x in lp_solutions]
+    rounded_total = int(sum(x.sum() for x in solutions))
+    order = sorted(range(len(problems)), key=lambda i: bounds[i] - solutions[i].sum())
+    deadline = time.perf_counter() + time_limit
+    counts = {'improved': 0, 'optimal': 0, 'out_of_time': 0}
+
+    with span(name, blocks=len(problems), time_limit=time_limit) as s:
+        for n, i in enumerate(order):
+            if progress is not None:
+                progress(n, len(order), f'Integer staffing: {n} of {len(order)} brand-months searched')
+            if solutions[i].sum() <= bounds[i]:
+                counts['optimal'] += 1
+                continue
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                counts['out_of_time'] += 1
+                continue
+            roles, C_reduced, D, _ = problems[i]
+            R = len(roles)
+            res = milp(np.ones(R), integrality=np.ones(R), bounds=(0, np.inf),
+                       constraints=[LinearConstraint(C_reduced.T, D, np.inf),
+                                    LinearConstraint(np.ones((1, R)), -np.inf, solutions[i].sum() - 1)],
+                       options={'time_limit': left / (len(order) - n), 'mip_rel_gap': mip_rel_gap, 'disp': False})
+            if res.status == 2:  # nothing better exists: the incumbent is optimal
+                bounds[i] = solutions[i].sum()
+            else:
+                if res.x is not None:
+                    solutions[i] = np.round(res.x)
+                    counts['improved'] += 1
+                dual_bound = getattr(res, 'mip_dual_bound', None)
+                if dual_bound is not None and np.isfinite(dual_bound):
+                    bounds[i] = max(bounds[i], min(np.ceil(dual_bound - 1e-6), solutions[i].sum()))
+            if solutions[i].sum() <= bounds[i]:
+                counts['optimal'] += 1
+
+        total = sum(x.sum() for x in solutions)
+        bound = sum(bounds)
+        summary = {
+            'total': int(total),
+            'bound': int(bound),
+            'gap': (total - bound) / total if total > 0 else 0.0,
+            'rounded_total': rounded_total,
+            **counts,
+        }
+        s.update(summary)
+    return solutions, bounds, summary
+
+# solving linprog and recording solver iterations, status and time as a span
+def solve_lp(name, **problem):
+    from scipy.optimize import linprog  # deferred until the first solve
 
-    # getting demand for selected month
-    row = df_forecast.iloc[row_index]
-    # making dictionary for required where: (keys = transaction type IDs) and (values = number of transactions needed for that type)
-    required = {
-        int(col): row[col]
-        for col in df_forecast.columns if col != "Month" and not pd.isna(row[col])
-    }
-
-    # finding transaction types appearing in both the capabilities and the forecast (safety check so that
-    # using transaction types that are both needed and possible to fulfill)
-    common_types = sorted(set(transaction_types).intersection(set(required)))
-    if not common_types:
-        return {}, 0, False
-
-    # subsetting the capability matrix C to only the needed transaction types
-    # building demand vector D with one value per transaction type
-    type_indices = [transaction_types.index(t) for t in common_types]
-    C_reduced = C[:, type_indices]
-    D = np.array([required[t] for t in common_types])
+    with span(name, variables=len(problem['c']), constraints=problem['A_ub'].shape[0]) as s:
+        res = linprog(method='highs', **problem)
+        s['status'] = res.status
+        s['iterations'] = int(getattr(res, 'nit', 0))
+        s['objective'] = float(res.fun) if res.success else None
+    return res
+
+def _optimize_staffing(df_capabilities, df_forecast, row_index, integer=False, time_limit=10.0, mip_rel_gap=1e-3):
+    with span('optimize_staffing.build'):
+        problem = build_staffing_problem(df_capabilities, df_forecast, row_index)
+    if problem is None:
+        return {}, 0, False, np.nan
+    roles, C_reduced, D, _ = problem
+    R = len(roles)  # number of roles
 
     # building linear program
     A_ub = -C_reduced.T
@@ -61,28 +182,32 @@ def optimize_staffing_from_dataframe(df_capabilities, df_forecast, row_index=0):
     bounds = [(0, None)] * R
 
     # solving linear program
-    res = linprog(c=c, A_ub=A_ub, b_ub=b_ub, bounds=bounds, method='highs')
+    res = solve_lp('optimize_staffing.linprog', c=c, A_ub=A_ub, b_ub=b_ub, bounds=bounds)
 
     # output
+    if res.success and integer:
+        whole, _, summary = integer_staffing([problem], [res.x], time_limit, mip_rel_gap, 'optimize_staffing.milp')
+        x = whole[0]
+        staffing_solution = {roles[i]: int(x[i]) for i in range(R) if x[i] > 0}
+        return staffing_solution, int(x.sum()), True, summary['gap']
     if res.success:
         staffing_solution = {
             roles[i]: int(np.ceil(res.x[i])) for i in range(R) if res.x[i] > 1e-3
         }
         total_employees = int(np.ceil(sum(res.x)))
-        return staffing_solution, total_employees, True
+        return staffing_solution, total_employees, True, np.nan
     else:
-        return {}, 0, False
+        return {}, 0, False, np.nan
 
-def optimization_model(brands, forecasts, capabilities, row_index=0):
+def optimization_model(brands, forecasts, capabilities, row_index=0, integer=False, time_limit=10.0, mip_rel_gap=1e-3):
     # processing each brand
     staffings = []
     success = True
     totals = []
     
     for brand_name, df_forecast, df_cap in zip(brands, forecasts, capabilities):
-        df_clean = clean_forecast_columns(df_forecast)
-
-        staffing, total, success = optimize_staffing_from_dataframe(df_cap, df_clean, row_index=row_index)
+        staffing, total, success = optimize_staffing_from_dataframe(df_cap, df_forecast, row_index=row_index, integer=integer,
+                                                                    time_limit=time_limit, mip_rel_gap=mip_rel_gap)[:3]
         
         if not success:
             return [], [], False
@@ -91,4 +216,132 @@ def optimization_model(brands, forecasts, capabilities, row_index=0):
             totals.append(total)
     
     return staffings, totals, True
-    
\ No newline at end of file
+    
+
+
+# BATCH OPTIMIZATION: every month x brand in one block-diagonal LP
+
+def month_labels(df_forecast):
+    for col in ("Month", "Date"):
+        if col in df_forecast.columns:
+            return [str(m) for m in df_forecast[col]]
+    return [str(i + 1) for i in range(len(df_forecast))]
+
+# sensitivity=True also returns the LP sensitivity data HiGHS reports for every month and brand:
+# one row per transaction type with its demand, shadow price (employees per extra transaction)
+# and slack (capacity beyond demand); what_if.py answers demand and capability changes from it.
+# integer=True fills Employees from one MILP over all brand-months (see integer_staffing) and adds
+# a Gap column: how far each brand-month's integer total may be above the best possible one.
+# Solution and the sensitivity data stay those of the LP relaxation.
+# site: optional site name, added as a leading Site column of the plan and sensitivity tables
+# progress: optional callback(done, total, message) after every brand is built and between the
+# MILPs of integer staffing (see integer_staffing); an exception it raises stops the solve
+def optimization_model_batch(brands, forecasts, capabilities, sensitivity=False,
+                             integer=False, time_limit=10.0, mip_rel_gap=1e-3, site=None, progress=None):
+    site_field = {} if site is None else {'site': site}
+    with span('optimization_model_batch', brands=len(brands), integer=integer, **site_field) as s:
+        plan, success, duals = _optimization_model_batch(brands, forecasts, capabilities, integer, time_limit,
+                                                         mip_rel_gap, progress)
+        s['success'] = success
+        if site is not None:
+            plan.insert(0, 'Site', site)
+            duals.insert(0, 'Site', site)
+        return (plan, success, duals) if sensitivity else (plan, success)
+
+def _optimization_model_batch(brands, forecasts, capabilities, integer=False, time_limit=10.0, mip_rel_gap=1e-3,
+                              progress=None):
+    # collecting one block (roles, C_reduced, D) per brand and month
+    blocks = []  # (row_index, month label, brand position, brand, problem)
+    with span('optimization_model_batch.build'):
+        for b, (brand_name, df_forecast, df_cap) in enumerate(zip(brands, forecasts, capabilities)):
+            forecast = compile_forecast(df_forecast)
+            cap = compile_capabilities(df_cap)
+            for row_index, label in enumerate(forecast.labels):
+                problem = build_staffing_problem(cap, forecast, row_index)
+                blocks.append((row_index, label, b, brand_name, problem))
+            if progress is not None:
+                progress(b + 1, len(brands), f'Built staffing problems for {b + 1} of {len(brands)} brands')
+
+    solvable = [i for i, block in enumerate(blocks) if block[4] is not None]
+    solutions = {}  # block position -> solution vector
+    sensitivities = {}  # block position -> (shadow prices, slacks)
+    if solvable:
+        # stacking the blocks: the LP separates, so one solve gives every block's optimum
+        from scipy import sparse
+
+        A_ub = sparse.block_diag([-blocks[i][4][1].T for i in solvable], format='csr')
+        b_ub = np.concatenate([-blocks[i][4][2] for i in solvable])
+        c = np.ones(A_ub.shape[1])
+        res = solve_lp('optimization_model_batch.linprog', c=c, A_ub=A_ub, b_ub=b_ub, bounds=(0, None))
+
+        if res.success:
+            offset = 0
+            row = 0
+            for i in solvable:
+                R = len(blocks[i][4][0])
+                K = len(blocks[i][4][2])
+                solutions[i] = res.x[offset:offset + R]
+                sensitivities[i] = (-res.ineqlin.marginals[row:row + K], res.ineqlin.residual[row:row + K])
+                offset += R
+                row += K
+        else:
+            # one infeasible block fails the whole batch, so solve blocks separately to see which ones work
+            for i in solvable:
+                roles, C_reduced, D, _ = blocks[i][4]
+                res = solve_lp('optimization_model_batch.linprog_block', c=np.ones(len(roles)), A_ub=-C_reduced.T, b_ub=-D, bounds=(0, None))
+                if res.success:
+                    solutions[i] = res.x
+                    sensitivities[i] = (-res.ineqlin.marginals, res.ineqlin.residual)
+
+    # whole employees for every solved block
+    employees = {i: np.where(x > 1e-3, np.ceil(x), 0) for i, x in solutions.items()}
+    gaps = {}
+    if integer and solutions:
+        solved = list(solutions)
+        whole, lower, _ = integer_staffing([blocks[i][4] for i in solved], [solutions[i] for i in solved],
+                                           time_limit, mip_rel_gap, 'optimization_model_batch.milp', progress)
+        for i, x, bound in zip(solved, whole, lower):
+            employees[i] = x
+            gaps[i] = (x.sum() - bound) / x.sum() if x.sum() > 0 else 0.0
+
+    # month-indexed staffing table: one line per month, brand and role
+    records = []
+    for i, (row_index, label, b, brand_name, problem) in enumerate(blocks):
+        x = solutions.get(i)
+        if x is None:
+            records.append((row_index, label, b, brand_name, None, np.nan, 0, False, np.nan))
+            continue
+        for role, value, n in zip(problem[0], x, employees[i]):
+            records.append((row_index, label, b, brand_name, role, value, int(n), True, gaps.get(i, np.nan)))
+    plan = pd.DataFrame(records, columns=["row", "Month", "brand_index", "Brand", "Position", "Solution", "Employees", "Success", "Gap"])
+    if not integer:
+        plan = plan.drop(columns="Gap")
+
+    # sensitivity table: one line per month, brand and transaction type of every solved block
+    records = []
+    for i, (shadow, slack) in sensitivities.items():
+        row_index, label, b, brand_name, problem = blocks[i]
+        for t, demand, price, extra in zip(problem[3], problem[2], shadow, slack):
+            records.append((row_index, label, b, brand_name, t, demand, price, extra))
+    duals = pd.DataFrame(records, columns=["row", "Month", "brand_index", "Brand", "Type", "Demand", "Shadow Price", "Slack"])
+    return plan, bool(plan["Success"].all()) if len(plan) else False, duals
+
+# looking up one month of a batch plan in the same shape optimization_model returns;
+# integer plans (with a Gap column) total their whole employees, LP plans round the LP total up
+def staffing_for_month(plan, brands, row_index=0):
+    month = plan[plan["row"] == row_index]
+    staffings = []
+    totals = []
+    for b in range(len(brands)):
+        rows = month[month["brand_index"] == b]
+        if rows.empty or not rows["Success"].all():
+            return [], [], False
+        if "Gap" in rows.columns:
+            # integer plans: the roles the MILP staffs, not those of its LP relaxation
+            totals.append(int(rows["Employees"].sum()))
+            rows = rows[rows["Employees"] > 0]
+        else:
+            totals.append(int(np.ceil(rows["Solution"].sum())))
+            rows = rows[rows["Solution"] > 1e-3]
+        staffings.append({role: int(n) for role, n in zip(rows["Position"], rows["Employees"])})
+    return staffings, totals, True
@@ -1,109 +1,163 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime
+from profiling import timed
 import os
 
-def forecast_400_constant_ratio(summary, forecast_451, forecast_900):
-    tot400 = summary.loc[summary['brand'] == '400', 'quantity'].sum()
-    tot451 = summary.loc[summary['brand'] == '451', 'quantity'].sum()
-    tot900 = summary.loc[summary['brand'] == '900', 'quantity'].sum()
-
-    if tot451 + tot900 == 0:
-        # If both 451 and 900 have no quantity, return a zero-filled list
-        return [0] * len(forecast_451)
-
-    ratio = tot400 / (tot451 + tot900)  # e.g. 0.055
-
-    combined = np.array(forecast_451) + np.array(forecast_900)
-    result   = (ratio * combined).round().astype(int).tolist()
-    return result
-
-#Project Transactions for Each Brand
-def project_transactions(summary, brand, forecast_values, first_mo, anchor_type='341'):
-    df = summary[summary['brand'] == str(brand)].copy()
-    
-    txn_cols = [c for c in df.columns if c.endswith('_transactions')]
-
-    total_txn = df[txn_cols].sum().sum()
-    anchor_txn = df[f'{anchor_type}_transactions'].sum()
-    anchor_qty = df[f'{anchor_type}_quantity'].sum()
-
-    avg_qty_per_anchor = anchor_qty / anchor_txn
-    anchor_share = anchor_txn / total_txn
-    other_total = total_txn - anchor_txn
-
-    shares = {t: df[f'{t}_transactions'].sum() / other_total
-              for t in sorted(set(c.split('_')[0] for c in txn_cols) - {anchor_type})}
-
-    months = pd.date_range(first_mo, periods=12, freq='MS')
-    df_out = pd.DataFrame({'Month': months.strftime('%Y-%m')})
-    df_out[f'{anchor_type}_transactions'] = [v / avg_qty_per_anchor for v in forecast_values]
-    df_out['Total Transactions'] = df_out[f'{anchor_type}_transactions'] / anchor_share
-
-    for t, share in shares.items():
-        df_out[f'{t}_transactions'] = (df_out['Total Transactions'] - df_out[f'{anchor_type}_transactions']) * share
-
-    # Round transactions to integers
-    txn_cols_out = [c for c in df_out.columns if c != 'Month']
-    df_out[txn_cols_out] = df_out[txn_cols_out].round(0).astype(int)
-
-    df_out.to_csv(f'projected_summary_{brand}.csv', index=False)
-    return df_out
-
-#Forecast No-Brand Transactions by Type
-def forecast_no_brand_transactions(summary, first_mo):
-    df_no = summary[summary['brand'] == 'no_brand'].copy()
-    
-    txn_cols = [c for c in df_no.columns if c.endswith('_transactions')]
-    
-    shares = {c: (list(df_no[c])[0] / list(df_no['transactions'])[0]) for c in txn_cols}
-
-    for c in shares:
-        if pd.isna(shares[c]):
-            shares[c] = 0
-
-    # Read final projected brand transactions
-    p451 = pd.read_csv('projected_summary_451.csv')['Total Transactions']
-    p900 = pd.read_csv('projected_summary_900.csv')['Total Transactions']
-    p400 = pd.read_csv('projected_summary_400.csv')['Total Transactions']
-    total_brand = p451 + p900 + p400
-
-    hist_total = list(df_no['transactions'])[0]
-    brand_hist = sum([514877, 228341, 228831, 1689715, 1429982, 1500546, 1092, 972, 1134])
-    ratio = hist_total / brand_hist
-
-    months = pd.date_range(first_mo, periods=12, freq='MS')
-    df_f = pd.DataFrame({'Month': months.strftime("%Y-%m"), 'total_no': (total_brand * ratio).round(0)})
-    for c, s in shares.items():
-        df_f[c] = (df_f['total_no'] * s).round(0)
-
-    df_f.drop(columns='total_no', inplace=True)
-    # Round to integers
-    txn_cols_no = [c for c in df_f.columns if c != 'Month']
-    df_f[txn_cols_no] = df_f[txn_cols_no].astype(int)
-    df_f['Total Transactions'] = df_f[txn_cols_no].sum(axis=1)
-
-    df_f.to_csv('projected_summary_no_brand.csv', index=False)
-    return df_f
-
-def forecast_pipeline(summary, forecast_451, forecast_900):
-    # Generate 400 forecast from shares
-    forecast_400 = forecast_400_constant_ratio(summary, forecast_451, forecast_900)
-    
-    first_mo = str(forecast_451.index[0])
-
-    # Project transactions for each brand
-    df_451 = project_transactions(summary, '451', forecast_451, first_mo)
-    df_900 = project_transactions(summary, '900', forecast_900, first_mo)
-    df_400 = project_transactions(summary, '400', forecast_400, first_mo)
-
-    # Forecast no-brand transactions using type shares
-    df_no_brand = forecast_no_brand_transactions(summary, first_mo)
-
-    # delete all csv files in current directory
-    files = os.listdir('.')
-    for file in files:
-        if os.path.exists(file) and (file.endswith('.csv') or file.endswith('.xlsx')):
-            os.remove(file)
-
+# N-BRAND PROJECTION
+# Every brand and transaction type is projected in one array computation:
+#   forecast quantity (month x brand) * share matrix (brand x type) -> transactions (month x brand x type)
+# where share[b, t] = historical type-t transactions of brand b per unit of anchor-type quantity.
+# Derived brands (in the summary but not forecast) and no_brand are scaled from the forecast brands.
+
+def transaction_types(summary):
+    return [c[:-len('_transactions')] for c in summary.columns if c.endswith('_transactions')]
+
+# brand totals from the summary (several rows per brand are summed)
+def brand_totals(summary, anchor_type='341'):
+    types = transaction_types(summary)
+    cols = [f'{t}_transactions' for t in types] + [f'{anchor_type}_quantity', 'transactions', 'quantity']
+    totals = summary.assign(brand=summary['brand'].astype(str)).groupby('brand', sort=False)[cols].sum()
+    return totals, types
+
+# share matrix (brand x type) and total transactions per unit of anchor quantity (brand,)
+def share_matrix(totals, types, anchor_type='341'):
+    txn = totals[[f'{t}_transactions' for t in types]].to_numpy(dtype=float)
+    anchor_qty = totals[f'{anchor_type}_quantity'].to_numpy(dtype=float)[:, None]
+    # brands without anchor quantity cannot be projected and get zero transactions
+    shares = np.divide(txn, anchor_qty, out=np.zeros_like(txn), where=anchor_qty > 0)
+    return shares, shares.sum(axis=1)
+
+# quantity: forecast quantity per brand, one column per brand (str names) and 12 rows of months
+# (a 'Date' column or a Date index). Brands in the summary without a forecast column are scaled
+# from the forecast brands by their share of historical quantity.
+# Returns one long frame: Brand, Month, <anchor>_transactions, Total Transactions, <type>_transactions...
+# With a site name the frame leads with a Site column.
+@timed('forecast_transactions')
+def forecast_transactions(summary, quantity, anchor_type='341', no_brand='no_brand', export_dir=None, site=None):
+    if 'Date' in quantity.columns:
+        quantity = quantity.set_index('Date')
+    quantity = quantity.rename(columns=str)
+    totals, types = brand_totals(summary, anchor_type)
+
+    brands = [b for b in totals.index if b != no_brand]
+    forecast_brands = [b for b in brands if b in quantity.columns]
+    derived_brands = [b for b in brands if b not in quantity.columns]
+    brands = forecast_brands + derived_brands
+
+    first_mo = str(quantity.index[0])
+    months = pd.date_range(first_mo, periods=len(quantity), freq='MS').strftime('%Y-%m')
+
+    # forecast quantity matrix (month x brand)
+    F = np.zeros((len(months), len(brands)))
+    F[:, :len(forecast_brands)] = quantity[forecast_brands].to_numpy(dtype=float)
+    if derived_brands:
+        qty = totals['quantity']
+        base = qty[forecast_brands].sum()
+        ratios = qty[derived_brands].to_numpy(dtype=float) / base if base else np.zeros(len(derived_brands))
+        F[:, len(forecast_brands):] = np.round(F[:, :len(forecast_brands)].sum(axis=1)[:, None] * ratios[None, :])
+
+    shares, total_share = share_matrix(totals.loc[brands], types, anchor_type)
+    txn = np.round(F[:, :, None] * shares[None, :, :])           # month x brand x type
+    total = np.round(F * total_share[None, :])                    # month x brand
+
+    # columns: anchor, total, then the other types sorted
+    others = sorted(set(types) - {anchor_type})
+    order = [types.index(anchor_type)] + [types.index(t) for t in others]
+    columns = [f'{anchor_type}_transactions', 'Total Transactions'] + [f'{t}_transactions' for t in others]
+    values = np.concatenate([txn[:, :, order[:1]], total[:, :, None], txn[:, :, order[1:]]], axis=2)
+
+    M, B = len(months), len(brands)
+    blocks = [values.transpose(1, 0, 2).reshape(B * M, -1)]
+    brand_col = np.repeat(brands, M)
+    month_col = np.tile(months, B)
+
+    if no_brand in totals.index:
+        # unbranded transactions follow total branded volume at their historical ratio, split by type share
+        nb = totals.loc[no_brand]
+        nb_txn = nb[[f'{t}_transactions' for t in types]].to_numpy(dtype=float)
+        nb_shares = np.nan_to_num(nb_txn / nb['transactions']) if nb['transactions'] else np.zeros(len(types))
+        brand_hist = totals.loc[brands, 'transactions'].sum()
+        ratio = nb['transactions'] / brand_hist if brand_hist else 0.0
+        total_no = np.round(total.sum(axis=1) * ratio)
+        nb_values = np.round(total_no[:, None] * nb_shares[None, :])[:, order]
+        nb_values = np.insert(nb_values, 1, nb_values.sum(axis=1), axis=1)
+        blocks.append(nb_values)
+        brand_col = np.concatenate([brand_col, np.repeat(no_brand, M)])
+        month_col = np.concatenate([month_col, months])
+
+    out = pd.DataFrame(np.vstack(blocks).astype(int), columns=columns)
+    out.insert(0, 'Month', month_col)
+    out.insert(0, 'Brand', brand_col)
+    if site is not None:
+        out.insert(0, 'Site', site)
+
+    if export_dir is not None:
+        out.to_csv(os.path.join(export_dir, 'projected_summary.csv'), index=False)
+    return out
+
+# The projection in forecast_transactions is linear in the forecast quantity. Returns
+# (brands, types, W) with W[f, o, k] = type-k transactions of output brand o per unit of
+# forecast brand f's quantity, so transactions = F @ W for any stack of quantity paths F
+# (forecast_transactions additionally rounds its intermediate and final results).
+# Output brands are the forecast brands, the derived brands and no_brand, in that order.
+def projection_weights(summary, forecast_brands, anchor_type='341', no_brand='no_brand'):
+    totals, types = brand_totals(summary, anchor_type)
+    brands = [b for b in totals.index if b != no_brand]
+    forecast_brands = [str(b) for b in forecast_brands if str(b) in brands]
+    derived_brands = [b for b in brands if b not in forecast_brands]
+    brands = forecast_brands + derived_brands
+    Bf = len(forecast_brands)
+
+    # G[f, o]: quantity of output brand o per unit of forecast brand f
+    G = np.zeros((Bf, len(brands)))
+    G[:, :Bf] = np.eye(Bf)
+    if derived_brands:
+        qty = totals['quantity']
+        base = qty[forecast_brands].sum()
+        if base:
+            G[:, Bf:] = qty[derived_brands].to_numpy(dtype=float)[None, :] / base
+
+    shares, total_share = share_matrix(totals.loc[brands], types, anchor_type)
+    W = G[:, :, None] * shares[None, :, :]
+
+    if no_brand in totals.index:
+        nb = totals.loc[no_brand]
+        nb_txn = nb[[f'{t}_transactions' for t in types]].to_numpy(dtype=float)
+        nb_shares = np.nan_to_num(nb_txn / nb['transactions']) if nb['transactions'] else np.zeros(len(types))
+        brand_hist = totals.loc[brands, 'transactions'].sum()
+        ratio = nb['transactions'] / brand_hist if brand_hist else 0.0
+        W_nb = (G @ total_share * ratio)[:, None] * nb_shares[None, :]
+        W = np.concatenate([W, W_nb[:, None, :]], axis=1)
+        brands = brands + [no_brand]
+    return brands, types, W
+
+# Total transactions per month over every brand (the Step 2 total)
+def total_transactions(projected):
+    keys = ['Site', 'Month'] if 'Site' in projected.columns else 'Month'
+    total = projected.drop(columns='Brand').groupby(keys, sort=False).sum().reset_index()
+    return total.rename(columns={'Month': 'Date'})
+
+# Frames of one brand from forecast_transactions: Month, <anchor>_transactions, Total Transactions, <type>_transactions...
+def brand_frame(projected, brand):
+    return projected[projected['Brand'] == str(brand)].drop(columns='Brand').reset_index(drop=True)
+
+# export_dir: optional directory to also write each projected summary to as CSV
+# site: optional site name, kept as a leading Site column of every frame
+@timed('forecast_pipeline')
+def forecast_pipeline(summary, forecast_451, forecast_900, export_dir=None, site=None):
+    quantity = pd.DataFrame({'451': forecast_451, '900': forecast_900})
+    projected = forecast_transactions(summary, quantity, site=site)
+
+    frames = []
+    for brand in ['400', '451', '900', 'no_brand']:
+        df = brand_frame(projected, brand)
+        if brand == 'no_brand':
+            # no_brand layout: types in summary order, total last
+            df = df[(['Site'] if site is not None else []) + ['Month']
+                    + [f'{t}_transactions' for t in transaction_types(summary)] + ['Total Transactions']]
+        if export_dir is not None:
+            df.to_csv(os.path.join(export_dir, f'projected_summary_{brand}.csv'), index=False)
+        frames.append(df)
+
+    df_400, df_451, df_900, df_no_brand = frames
     return df_400, df_451, df_900, df_no_brand
@@ -0,0 +1,80 @@
+import contextvars
+import functools
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+# Named timing spans for the pipeline stages.
+#
+#   with span('smoothing.fit', brands=12) as s:
+#       ...
+#       s['iterations'] = 7       # extra fields can be added while the span is open
+#
+# Each finished span is logged as one JSON line on the 'cpc.timing' logger and,
+# inside collect(), appended to the caller's list (the app's performance panel).
+
+logger = logging.getLogger('cpc.timing')
+
+_collector = contextvars.ContextVar('cpc_timing_collector', default=None)
+_parent = contextvars.ContextVar('cpc_timing_parent', default=None)
+
+def _emit(record: dict) -> None:
+    logger.info(json.dumps(record, default=str))
+    spans = _collector.get()
+    if spans is not None:
+        spans.append(record)
+
+@contextmanager
+def span(name: str, **fields):
+    record = {'span': name, 'parent': _parent.get(), **fields}
+    token = _parent.set(name)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        _parent.reset(token)
+        _emit(record)
+
+# Decorator form: one span per call, named after the function unless given
+def timed(name: str = None):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+# Recording a span that was timed elsewhere, e.g. a fit that ran in a worker process
+def record_span(name: str, seconds: float, **fields) -> None:
+    _emit({'span': name, 'parent': _parent.get(), **fields, 'duration_ms': round(seconds * 1000, 3)})
+
+# Collecting the spans finished inside the block
+@contextmanager
+def collect():
+    spans = []
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+# Starting a collection that lasts for the rest of the current context (one Streamlit script run)
+def start_collection() -> list:
+    spans = []
+    _collector.set(spans)
+    return spans
+
+# Sending the JSON span lines to a stream (stderr by default); safe to call more than once
+def enable_json_logging(stream=None) -> None:
+    if any(getattr(h, '_cpc_timing', False) for h in logger.handlers):
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    handler._cpc_timing = True
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
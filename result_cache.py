@@ -0,0 +1,97 @@
+import copy
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Building a cache key from a step name, uploaded file bytes and model parameters
+def make_key(step: str, *parts) -> str:
+    h = hashlib.sha256(step.encode())
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(part)
+        else:
+            h.update(repr(part).encode())
+        h.update(b'\x00')  # separator so ('ab', 'c') and ('a', 'bc') differ
+    return h.hexdigest()
+
+# Approximate memory footprint of a cached result (DataFrames, arrays, bytes and containers of them)
+def estimate_size(value) -> int:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+# LRU cache bounded by entry count and total size, shared between Streamlit sessions
+class ResultCache:
+    def __init__(self, max_entries: int = 64, max_bytes: int = 256 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # returns (True, value) on a hit and (False, None) on a miss
+    def get(self, key: str) -> tuple:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = self._entries[key][0]
+        # callers get their own copy so in-place edits never reach the cache
+        return True, copy.deepcopy(value)
+
+    def put(self, key: str, value) -> None:
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return  # never cache something that would evict everything else
+        value = copy.deepcopy(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def get_or_compute(self, key: str, fn, *args, **kwargs):
+        hit, value = self.get(key)
+        if hit:
+            return value
+        value = fn(*args, **kwargs)
+        self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self.evictions,
+            }
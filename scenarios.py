@@ -0,0 +1,251 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import holt_winters
+from model_selection import demand_series
+from orders_to_trans import projection_weights
+from optimization import compile_capabilities
+from profiling import span
+
+# Monte Carlo staffing: staffing levels at demand quantiles instead of a point forecast.
+#
+#   table = scenario_staffing(demand, summary, {'451': caps_451, '900': caps_900}, scenarios=2000)
+#
+# 1. Every brand's quantity history is fitted with the NumPy Holt-Winters kernel (log space,
+#    additive, 6-month season) and `scenarios` future paths are simulated at once: the
+#    one-step errors are drawn from N(0, sigma^2) with sigma from the in-sample fit and pushed
+#    through the model's error-correction recursions, so shocks persist in level, trend and
+#    season the way the fitted model says they do.
+# 2. The quantity paths go through the Step 2 projection as one tensor product with
+#    orders_to_trans.projection_weights (scenario x month x brand x type).
+# 3. The staffing LP of every scenario and month (min employees s.t. capacity >= demand)
+#    only differs in its demand vector. A few scenarios are solved with HiGHS; each solution
+#    gives a certificate (the roles it staffs, the demand constraints it meets exactly and
+#    its dual prices) that is checked against all remaining scenarios with array operations:
+#    solving the same tight constraints for the new demand gives a primal solution, and when
+#    it is feasible and costs no more than the dual bound it is optimal. Scenarios no
+#    certificate covers are solved as block-diagonal LPs across a process pool.
+#
+# The result has one row per brand, month and role (plus a 'Total' role and an 'All brands'
+# sum over brands) with the mean and the requested quantiles of employees needed.
+
+QUANTILES = (0.5, 0.8, 0.95)
+TOLERANCE = 1e-7
+
+# Simulated quantity paths (scenarios, series, h) in original units.
+# hists: raw quantity histories; point: (series, h) point forecasts in original units, or
+# None for the kernel's own forecasts
+def simulate_quantity(hists: list, h: int = 12, scenarios: int = 1000, seed: int = 0, point=None,
+                      m: int = 6) -> np.ndarray:
+    Y, lengths = holt_winters.stack_series([np.log1p(np.asarray(x, dtype=float)) for x in hists])
+    fit = holt_winters.fit_batch(Y, lengths, m)
+    if point is None:
+        center = holt_winters.forecast_states(fit['level'], fit['trend'], fit['season'], lengths, h, m, fit['stale'])
+    else:
+        center = np.log1p(np.maximum(np.asarray(point, dtype=float), 0))
+    sigma = np.sqrt(fit['sse'] / lengths)
+    alpha, beta, gamma = fit['alpha'], fit['beta'], fit['gamma']
+
+    # deviations from the point forecast, all scenarios of all series at once (series, scenarios)
+    rng = np.random.default_rng(seed)
+    S = len(hists)
+    level = np.zeros((S, scenarios))
+    trend = np.zeros((S, scenarios))
+    season = np.zeros((S, scenarios, m))
+    paths = np.empty((S, scenarios, h))
+    for k in range(h):
+        error = sigma[:, None] * rng.standard_normal((S, scenarios))
+        slot = k % m
+        paths[:, :, k] = level + trend + season[:, :, slot] + error
+        level = level + trend + alpha[:, None] * error
+        trend = trend + (alpha * beta)[:, None] * error
+        season[:, :, slot] += gamma[:, None] * error
+    paths += center[:, None, :]
+    return np.maximum(np.expm1(paths), 0).transpose(1, 0, 2)
+
+# Certificate of one solved staffing LP: (staffed roles, tight constraints, pseudo-inverse, duals)
+def certificate(A: np.ndarray, d: np.ndarray, res) -> tuple:
+    x = res.x
+    duals = -res.ineqlin.marginals
+    support = x > TOLERANCE * max(1.0, x.max())
+    tight = res.ineqlin.residual <= TOLERANCE * np.maximum(1.0, np.abs(d))
+    return support, tight, np.linalg.pinv(A[np.ix_(tight, support)]), duals
+
+# Solutions of all demand rows D the certificate proves optimal; (X, solved mask)
+def apply_certificate(cert: tuple, A: np.ndarray, D: np.ndarray) -> tuple:
+    support, tight, pinv, duals = cert
+    X = np.zeros((len(D), A.shape[1]))
+    X[:, support] = D[:, tight] @ pinv.T
+    scale = np.maximum(1.0, np.abs(D))
+    feasible = (X >= -TOLERANCE * np.maximum(1.0, np.abs(X).max(axis=1, keepdims=True))).all(axis=1)
+    feasible &= (X @ A.T >= D - TOLERANCE * scale).all(axis=1)
+    bound = D @ duals  # dual objective: a lower bound on every feasible staffing
+    optimal = feasible & (X.sum(axis=1) <= bound + TOLERANCE * np.maximum(1.0, np.abs(bound)))
+    return np.maximum(X, 0), optimal
+
+# Solving many staffing LPs with one capability matrix as a block-diagonal LP (worker function).
+# Returns (X, success) with NaN rows for infeasible demand rows.
+def solve_rows(task: tuple) -> tuple:
+    from scipy import sparse
+    from scipy.optimize import linprog
+
+    A, D = task
+    P, R = len(D), A.shape[1]
+    res = linprog(np.ones(P * R), A_ub=sparse.kron(sparse.identity(P), -A, format='csr'), b_ub=-D.ravel(),
+                  bounds=(0, None), method='highs')
+    if res.success:
+        return res.x.reshape(P, R), np.ones(P, dtype=bool)
+    X = np.full((P, R), np.nan)
+    ok = np.zeros(P, dtype=bool)
+    for i, d in enumerate(D):
+        res = linprog(np.ones(R), A_ub=-A, b_ub=-d, bounds=(0, None), method='highs')
+        if res.success:
+            X[i], ok[i] = res.x, True
+    return X, ok
+
+# Staffing for every demand row: A is (types x roles) capability, D (rows x types) demand.
+# Returns (X rows x roles, success mask, counts of how the rows were solved)
+def solve_staffing_rows(A: np.ndarray, D: np.ndarray, workers: int = 1, probes: int = 8,
+                        chunk: int = 250) -> tuple:
+    from scipy.optimize import linprog
+
+    P, R = len(D), A.shape[1]
+    X = np.full((P, R), np.nan)
+    solved = np.zeros(P, dtype=bool)
+    failed = np.zeros(P, dtype=bool)
+    counts = {'certified': 0, 'probed': 0, 'solved': 0}
+
+    # probing: solve one open row, certify every open row its solution covers, repeat
+    for _ in range(probes):
+        open_rows = np.flatnonzero(~solved & ~failed)
+        if len(open_rows) == 0:
+            break
+        i = open_rows[len(open_rows) // 2]
+        res = linprog(np.ones(R), A_ub=-A, b_ub=-D[i], bounds=(0, None), method='highs')
+        counts['probed'] += 1
+        if not res.success:
+            failed[i] = True
+            continue
+        X[i], solved[i] = res.x, True
+        open_rows = open_rows[open_rows != i]
+        if len(open_rows) == 0:
+            break
+        Xc, ok = apply_certificate(certificate(A, D[i], res), A, D[open_rows])
+        X[open_rows[ok]] = Xc[ok]
+        solved[open_rows[ok]] = True
+        counts['certified'] += int(ok.sum())
+
+    # whatever no certificate covers: block-diagonal LPs, chunks spread over workers
+    rest = np.flatnonzero(~solved & ~failed)
+    if len(rest):
+        tasks = [(A, D[rest[i:i + chunk]]) for i in range(0, len(rest), chunk)]
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+                results = list(pool.map(solve_rows, tasks))
+        else:
+            results = [solve_rows(task) for task in tasks]
+        for i, (Xc, ok) in zip(range(0, len(rest), chunk), results):
+            rows = rest[i:i + chunk]
+            X[rows[ok]] = Xc[ok]
+            solved[rows[ok]] = True
+        counts['solved'] = len(rest)
+    return X, solved, counts
+
+# Employees per role like the point plan: ceil of the LP value, zero below 1e-3
+def employees(X: np.ndarray) -> np.ndarray:
+    return np.where(X > 1e-3, np.ceil(X - TOLERANCE), 0)
+
+def _quantile_rows(values: np.ndarray, ok: np.ndarray, quantiles: tuple) -> dict:
+    values = values[ok]
+    if len(values) == 0:
+        return {'Mean': np.nan, **{f'P{round(q * 100)}': np.nan for q in quantiles}}
+    return {'Mean': values.mean(),
+            **{f'P{round(q * 100)}': np.quantile(values, q, method='higher') for q in quantiles}}
+
+# Staffing distributions for the brands in `capabilities` ({brand: capability frame or compiled CapabilityMatrix}).
+# demand: Step 1 table; summary: Step 2 transaction summary. Returns a long frame
+# Brand, Month, Position, Scenarios (feasible ones), Mean, P50, P80, P95. Months are the calendar
+# months any brand is forecast for; a brand has no demand in months outside its own forecast.
+def scenario_staffing(demand: pd.DataFrame, summary: pd.DataFrame, capabilities: dict,
+                      scenarios: int = 1000, h: int = 12, quantiles: tuple = QUANTILES, seed: int = 0,
+                      workers: int = 1, anchor_type: str = '341', no_brand: str = 'no_brand') -> pd.DataFrame:
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+    with span('scenario_staffing', scenarios=scenarios, brands=len(capabilities), workers=workers) as s:
+        series = demand_series(demand)
+        keys = [k for k in series if k.endswith('_Quantity')]
+        brands = [k[:-len('_Quantity')] for k in keys]
+        if not brands:
+            raise ValueError("No brand in the demand data has 12 months of history to simulate.")
+        hists = [series[k] for k in keys]
+
+        with span('scenario_staffing.simulate'):
+            F = simulate_quantity(hists, h, scenarios, seed)  # (N, B, h)
+        # every brand's paths on one calendar: histories trimmed of trailing zeros end in different
+        # months, so brands are aligned on calendar months (zero outside their own forecast) before
+        # they are projected and summed
+        index = [holt_winters.forecast_index(hist, h) for hist in hists]
+        if all(isinstance(i, pd.DatetimeIndex) for i in index):
+            calendar = index[0].append(index[1:]).unique().sort_values()
+            aligned = np.zeros((scenarios, len(brands), len(calendar)))
+            for b, i in enumerate(index):
+                aligned[:, b, calendar.get_indexer(i)] = F[:, b, :]
+            F, months = aligned, calendar.strftime('%Y-%m')
+        else:
+            months = [str(i + 1) for i in range(h)]
+        H = len(months)
+
+        with span('scenario_staffing.project'):
+            out_brands, types, W = projection_weights(summary, brands, anchor_type, no_brand)
+            forecast_brands = [b for b in brands if b in set(out_brands)]
+            F = F[:, [brands.index(b) for b in forecast_brands], :]
+            T = np.einsum('nfh,fok->nhok', F, W)  # (N, months, brand, type)
+
+        rows = []
+        counts = {'certified': 0, 'probed': 0, 'solved': 0}
+        role_totals = {}  # role -> (N, h) employees summed over brands
+        feasible_all = np.ones((scenarios, H), dtype=bool)
+        for brand, caps in capabilities.items():
+            brand = str(brand)
+            if brand not in out_brands:
+                continue
+            cap = compile_capabilities(caps)
+            roles = cap.roles
+            cap_pos = {str(t): j for j, t in enumerate(cap.types)}
+            common = [k for k, t in enumerate(types) if t in cap_pos]
+            if not common:
+                continue
+            A = cap.C[:, [cap_pos[types[k]] for k in common]].T  # (types, roles)
+            D = T[:, :, out_brands.index(brand), :][:, :, common].reshape(-1, len(common))
+
+            with span('scenario_staffing.solve', brand=brand, rows=len(D)) as solve_span:
+                X, ok, brand_counts = solve_staffing_rows(A, D, workers)
+                solve_span.update(brand_counts)
+            for key in counts:
+                counts[key] += brand_counts[key]
+            X = X.reshape(scenarios, H, len(roles))
+            ok = ok.reshape(scenarios, H)
+            feasible_all &= ok
+            staff = employees(np.nan_to_num(X))
+            total = np.ceil(np.nan_to_num(X).sum(axis=2) - TOLERANCE)
+            for j, month in enumerate(months):
+                for r, role in enumerate(roles):
+                    rows.append({'Brand': brand, 'Month': month, 'Position': role, 'Scenarios': int(ok[:, j].sum()),
+                                 **_quantile_rows(staff[:, j, r], ok[:, j], quantiles)})
+                rows.append({'Brand': brand, 'Month': month, 'Position': 'Total', 'Scenarios': int(ok[:, j].sum()),
+                             **_quantile_rows(total[:, j], ok[:, j], quantiles)})
+            for r, role in enumerate(roles):
+                role_totals[role] = role_totals.get(role, 0) + staff[:, :, r]
+            role_totals['Total'] = role_totals.get('Total', 0) + total
+
+        # network view: employees per role summed over brands within each scenario
+        for role, values in role_totals.items():
+            for j, month in enumerate(months):
+                rows.append({'Brand': 'All brands', 'Month': month, 'Position': role,
+                             'Scenarios': int(feasible_all[:, j].sum()),
+                             **_quantile_rows(values[:, j], feasible_all[:, j], quantiles)})
+        s.update(counts)
+
+    return pd.DataFrame(rows, columns=['Brand', 'Month', 'Position', 'Scenarios', 'Mean',
+                                       *[f'P{round(q * 100)}' for q in quantiles]])
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from optimization import compile_capabilities, compile_forecast
+from profiling import span
+
+# Staffing per day and shift instead of per month.
+#
+#   plan, success = plan_shifts(capabilities, forecast, max_change=2, min_staff=1)
+#
+# The monthly transaction forecast of a brand (a Step 2 brand frame or one of the frames
+# forecast_pipeline returns) is spread over the days of each month by a weekday profile,
+# and every day over its shifts by a shift profile. Capabilities are transactions per
+# employee per month; one employee works shifts_per_month shifts a month, so a shift of
+# one employee handles capability / shifts_per_month transactions.
+#
+# All periods (day x shift) go into one LP with a sparse constraint matrix:
+#   coverage    every period meets its demand of every transaction type
+#   continuity  a role's headcount changes by at most max_change between consecutive shifts
+#   minimum     every role with capacity has at least min_staff people on every open shift
+# The objective is the total number of staffed shifts.
+
+# Share of a week's volume per weekday, Monday first; weights are normalized per month
+WEEKDAY_PROFILE = (1.1, 1.05, 1.0, 1.0, 1.15, 0.45, 0.25)
+
+# Share of a day's volume per shift
+SHIFT_PROFILE = {'Early': 0.45, 'Late': 0.40, 'Night': 0.15}
+
+# Shifts one employee works in a month (five 8-hour shifts a week)
+SHIFTS_PER_MONTH = 21.7
+
+# Month starts of a compiled forecast's labels ('2025-01', '2025-01-01', ...)
+def month_starts(labels) -> pd.DatetimeIndex:
+    try:
+        return pd.to_datetime(pd.Series(labels, dtype=str), format='mixed').dt.to_period('M').dt.to_timestamp()
+    except (ValueError, TypeError):
+        raise ValueError("Daily planning needs the forecast's Month or Date column to hold calendar months.")
+
+# Daily transactions of every type: each month's forecast spread over its days in proportion
+# to the weekday profile (a day whose weekday weighs 0 gets no demand). Returns (days, types, D).
+def daily_demand(forecast, weekday_profile=WEEKDAY_PROFILE) -> tuple:
+    forecast = compile_forecast(forecast)
+    weights = np.asarray(weekday_profile, dtype=float)
+    if weights.shape != (7,) or (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError("The weekday profile needs seven non-negative weights, Monday first.")
+    starts = month_starts(forecast.labels)
+    days = pd.date_range(starts.min(), starts.max() + pd.offsets.MonthEnd(0), freq='D')
+    month_of_day = np.searchsorted(starts.to_numpy(), days.to_numpy(), side='right') - 1
+    keep = np.isin(days.to_period('M'), starts.dt.to_period('M'))  # gaps between forecast months
+    days, month_of_day = days[keep], month_of_day[keep]
+
+    day_weight = weights[days.weekday]
+    month_weight = np.bincount(month_of_day, weights=day_weight, minlength=len(starts))
+    share = np.divide(day_weight, month_weight[month_of_day], out=np.zeros(len(days)), where=month_weight[month_of_day] > 0)
+    D = np.nan_to_num(forecast.D)[month_of_day] * share[:, None]
+    return days, forecast.types, D
+
+# Builds and solves the day x shift staffing LP for one brand.
+# capabilities / forecast: DataFrames or their compiled forms (optimization.compile_*)
+# max_change: largest headcount change of a role between consecutive shifts (None: unlimited)
+# min_staff: per-role floor on every shift with demand, for roles that handle any demanded type
+# Returns (plan, success): one row per day, shift and role with the LP headcount (Staff) and
+# whole Employees (Staff rounded up), empty when the LP has no solution
+def plan_shifts(capabilities, forecast, weekday_profile=WEEKDAY_PROFILE, shift_profile=None,
+                shifts_per_month: float = SHIFTS_PER_MONTH, max_change: float = None, min_staff: float = 0) -> tuple:
+    from scipy import sparse
+    from scipy.optimize import linprog
+
+    cap = compile_capabilities(capabilities)
+    shift_profile = dict(SHIFT_PROFILE if shift_profile is None else shift_profile)
+    shares = np.asarray(list(shift_profile.values()), dtype=float)
+    if len(shares) == 0 or (shares < 0).any() or shares.sum() <= 0:
+        raise ValueError("The shift profile needs at least one shift with a positive share.")
+    shares = shares / shares.sum()
+
+    days, types, daily = daily_demand(forecast, weekday_profile)
+    common, cap_idx, demand_idx = np.intersect1d(cap.types, types, assume_unique=True, return_indices=True)
+    if len(common) == 0:
+        raise ValueError("The forecast and capabilities share no transaction types.")
+    A = cap.C[:, cap_idx].T / shifts_per_month  # (types, roles): transactions per person-shift
+    demand = (daily[:, demand_idx][:, None, :] * shares[None, :, None]).reshape(-1, len(common))  # (periods, types)
+    P, R = len(demand), len(cap.roles)
+
+    with span('plan_shifts', days=len(days), shifts=len(shares), roles=R, types=len(common)) as s:
+        # coverage: block-diagonal, one (types x roles) block per period
+        blocks = [sparse.kron(sparse.identity(P, format='csr'), sparse.csr_matrix(-A), format='csr')]
+        bounds_ub = [-demand.ravel()]
+        # continuity: -max_change <= x[p+1] - x[p] <= max_change for every role
+        if max_change is not None and P > 1:
+            step = sparse.kron(sparse.diags([-np.ones(P - 1), np.ones(P - 1)], [0, 1], shape=(P - 1, P)),
+                               sparse.identity(R), format='csr')
+            blocks.extend([step, -step])
+            bounds_ub.extend([np.full(2 * (P - 1) * R, float(max_change))])
+        A_ub = sparse.vstack(blocks, format='csr')
+        b_ub = np.concatenate(bounds_ub)
+
+        # minimum staffing on open shifts for roles that can work the demanded types
+        lower = np.zeros((P, R))
+        if min_staff:
+            useful = (A > 0).any(axis=0)
+            lower[np.ix_(demand.sum(axis=1) > 0, useful)] = min_staff
+        res = linprog(np.ones(P * R), A_ub=A_ub, b_ub=b_ub, bounds=np.column_stack([lower.ravel(), np.full(P * R, np.inf)]),
+                      method='highs')
+        s.update(variables=P * R, constraints=A_ub.shape[0], nonzeros=A_ub.nnz, status=res.status)
+        if not res.success:
+            return pd.DataFrame(columns=['Date', 'Weekday', 'Shift', 'Position', 'Staff', 'Employees']), False
+        s['objective'] = float(res.fun)
+
+    X = res.x.reshape(P, R)
+    period_day = np.repeat(np.arange(len(days)), len(shares))
+    period_shift = np.tile(np.arange(len(shares)), len(days))
+    shift_names = np.array(list(shift_profile), dtype=object)
+    plan = pd.DataFrame({
+        'Date': np.repeat(days[period_day].strftime('%Y-%m-%d'), R),
+        'Weekday': np.repeat(days[period_day].day_name(), R),
+        'Shift': np.repeat(shift_names[period_shift], R),
+        'Position': np.tile(np.asarray(cap.roles, dtype=object), P),
+        'Staff': X.ravel(),
+        'Employees': np.where(X.ravel() > 1e-3, np.ceil(X.ravel() - 1e-9), 0).astype(int),
+    })
+    return plan, True
+
+# Staffed shifts per day and role, e.g. for a roster overview
+def daily_totals(plan: pd.DataFrame) -> pd.DataFrame:
+    return plan.pivot_table(index='Date', columns='Position', values='Employees', aggfunc='sum', sort=False).reset_index()
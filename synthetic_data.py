@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic inputs in the formats each step expects, for benchmarks and smoke runs.
+# Every generator is deterministic for a given seed.
+
+ANCHOR_TYPE = '341'
+
+def brand_codes(brands: int) -> list:
+    if brands > 900:
+        raise ValueError("At most 900 three-digit brand codes are available.")
+    return [str(100 + i) for i in range(brands)]
+
+def type_codes(types: int, anchor_type: str = ANCHOR_TYPE) -> list:
+    codes = [anchor_type]
+    t = 300
+    while len(codes) < types:
+        if str(t) != anchor_type:
+            codes.append(str(t))
+        t += 1
+    return codes
+
+# Step 1 input: Date, ###_Orders, ###_Quantity per brand. Monthly orders follow a
+# level with trend, a 6-month season and noise; some brands start late (leading
+# zeros) like newly launched brands in real uploads.
+def synthetic_demand(brands: int = 10, months: int = 48, seed: int = 0, start: str = '2020-01-01',
+                     late_start_fraction: float = 0.1) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=months, freq='MS')
+    t = np.arange(months)[None, :]
+    codes = brand_codes(brands)
+
+    base = rng.uniform(50, 2000, (brands, 1))
+    growth = rng.normal(0.005, 0.01, (brands, 1))
+    amplitude = rng.uniform(0.05, 0.3, (brands, 1))
+    phase = rng.uniform(0, 2 * np.pi, (brands, 1))
+    orders = base * (1 + growth) ** t * (1 + amplitude * np.sin(2 * np.pi * t / 6 + phase))
+    orders = np.maximum(0, orders * rng.lognormal(0, 0.05, orders.shape)).round()
+    units = rng.uniform(1.2, 4.0, (brands, 1))
+    quantity = np.maximum(0, orders * units * rng.lognormal(0, 0.03, orders.shape)).round()
+
+    late = rng.random(brands) < late_start_fraction
+    for i in np.flatnonzero(late):
+        cut = rng.integers(1, max(2, months // 3))
+        orders[i, :cut] = 0
+        quantity[i, :cut] = 0
+
+    data = {'Date': dates.strftime('%Y-%m-%d')}
+    for i, code in enumerate(codes):
+        data[f'{code}_Orders'] = orders[i].astype(int)
+        data[f'{code}_Quantity'] = quantity[i].astype(int)
+    return pd.DataFrame(data)
+
+# Step 2 input: one row per brand (plus no_brand) with transactions and quantity
+# per type ('<type>_transactions', '<type>_quantity') and their totals
+def synthetic_summary(brands: list, types: int = 10, seed: int = 0, no_brand: bool = True,
+                      anchor_type: str = ANCHOR_TYPE) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    codes = type_codes(types, anchor_type)
+    names = list(brands) + (['no_brand'] if no_brand else [])
+    txn = rng.integers(500, 200000, (len(names), len(codes)))
+    txn[:, 0] = rng.integers(50000, 500000, len(names))  # the anchor type dominates
+    qty = txn * rng.integers(1, 6, (len(names), len(codes)))
+
+    data = {'brand': names}
+    for j, code in enumerate(codes):
+        data[f'{code}_transactions'] = txn[:, j]
+        data[f'{code}_quantity'] = qty[:, j]
+    data['transactions'] = txn.sum(axis=1)
+    data['quantity'] = qty.sum(axis=1)
+    return pd.DataFrame(data)
+
+# Step 2 input: 12 months of forecast quantity per brand (Date + one column per brand)
+def synthetic_quantity(brands: list, months: int = 12, seed: int = 0, start: str = '2025-01-01') -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(1000, 50000, (1, len(brands))) * rng.lognormal(0, 0.1, (months, len(brands)))
+    df = pd.DataFrame(values.round(2), columns=list(brands))
+    df.insert(0, 'Date', pd.date_range(start, periods=months, freq='MS').strftime('%Y-%m'))
+    return df
+
+# Step 3 input: one month per row with '<type>_transactions' columns, like the Step 2 output
+def synthetic_transaction_forecast(types: int = 10, months: int = 12, seed: int = 0,
+                                   start: str = '2025-01-01') -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    codes = type_codes(types)
+    values = rng.integers(1000, 100000, (1, len(codes))) * rng.lognormal(0, 0.1, (months, len(codes)))
+    df = pd.DataFrame(values.round().astype(int), columns=[f'{c}_transactions' for c in codes])
+    df.insert(1, 'Total Transactions', df.sum(axis=1))
+    df.insert(0, 'Date', pd.date_range(start, periods=months, freq='MS').strftime('%Y-%m'))
+    return df
+
+# Step 3 input: a Position column and one column per transaction type with the monthly
+# number of transactions one employee in that role completes (zero where a role cannot)
+def synthetic_capabilities(roles: int = 5, types: int = 10, seed: int = 0, coverage: float = 0.5) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    codes = type_codes(types)
+    rates = rng.integers(200, 5000, (roles, len(codes))) * (rng.random((roles, len(codes))) < coverage)
+    # every type needs at least one role able to do it, or the LP is infeasible
+    for j in range(len(codes)):
+        if not rates[:, j].any():
+            rates[rng.integers(roles), j] = rng.integers(200, 5000)
+    df = pd.DataFrame(rates, columns=codes)
+    df.insert(0, 'Position', [f'Role {i + 1}' for i in range(roles)])
+    return df
+
+# Raw order lines (date, brand, order_id, quantity, transaction_type) whose monthly
+# aggregation is exactly synthetic_demand(brands, months, seed): each order has 1-3
+# adjacent lines, and a `no_brand_fraction` of extra unbranded lines is mixed in
+def synthetic_order_lines(brands: int = 10, months: int = 48, types: int = 10, seed: int = 0,
+                          start: str = '2020-01-01', no_brand_fraction: float = 0.05) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    demand = synthetic_demand(brands, months, seed=seed, start=start)
+    codes = type_codes(types)
+    dates = pd.to_datetime(demand['Date']).to_numpy()
+
+    frames = []
+    next_order = 0
+    for brand in brand_codes(brands):
+        orders = demand[f'{brand}_Orders'].to_numpy()
+        quantity = demand[f'{brand}_Quantity'].to_numpy()
+        n = int(orders.sum())
+        if n == 0:
+            continue
+        month = np.repeat(np.arange(months), orders)
+        lines = rng.integers(1, 4, n)
+        order_month = np.repeat(month, lines)
+        order_id = np.repeat(np.arange(next_order, next_order + n), lines)
+        next_order += n
+        # spreading each month's quantity over its lines, every line getting at least zero units
+        qty = np.zeros(len(order_month), dtype=np.int64)
+        bounds = np.searchsorted(order_month, np.arange(months + 1))
+        for m in np.flatnonzero(orders):
+            lo, hi = bounds[m], bounds[m + 1]
+            qty[lo:hi] = rng.multinomial(quantity[m], np.full(hi - lo, 1 / (hi - lo)))
+        day = rng.integers(0, 28, len(order_month)).astype('timedelta64[D]')
+        frames.append(pd.DataFrame({
+            'date': (dates[order_month] + day).astype('datetime64[ns]'),
+            'brand': brand,
+            'order_id': order_id,
+            'quantity': qty,
+            'transaction_type': rng.choice(codes, len(order_month)),
+        }))
+
+    lines = pd.concat(frames, ignore_index=True)
+    extra = int(len(lines) * no_brand_fraction)
+    if extra:
+        lines = pd.concat([lines, pd.DataFrame({
+            'date': dates[rng.integers(0, months, extra)] + rng.integers(0, 28, extra).astype('timedelta64[D]'),
+            'brand': None,
+            'order_id': np.arange(next_order, next_order + extra),
+            'quantity': rng.integers(1, 5, extra),
+            'transaction_type': rng.choice(codes, extra),
+        })], ignore_index=True)
+    lines['date'] = lines['date'].dt.strftime('%Y-%m-%d')
+    return lines
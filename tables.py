@@ -0,0 +1,90 @@
+import importlib.util
+import io
+import zipfile
+import numpy as np
+import pandas as pd
+from profiling import span
+
+# Reading and writing the tables every step exchanges.
+#
+#   frame = read_table(raw, 'summary.parquet')
+#   data = bundle({'quantity_forecast': quantity, 'brand_report': report}, 'parquet')
+#
+# Uploads may be CSV, Excel, Parquet or Arrow IPC (.arrow/.feather). Columnar files keep
+# their column types, so brand codes like '001' stay text and dates stay dates, and their
+# integer columns are read as int32, which halves the memory of large transaction
+# summaries. Parquet downloads store floats as float32 too wherever that is exact; they
+# upload into the next step as they are, with the same results as the CSV version.
+# pyarrow is only needed for the columnar formats.
+
+TABLE_TYPES = ['csv', 'xlsx', 'parquet', 'arrow', 'feather']
+
+# Download formats: name -> (extension, mime type)
+FORMATS = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'csv': ('.csv', 'text/csv'),
+}
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("Parquet and Arrow tables require pyarrow (pip install pyarrow).")
+
+# Numeric columns as int32 / float32 wherever every value survives the round trip.
+# floats=False leaves float columns as float64 (float32 ones are widened back), so every
+# computation on an uploaded table runs in the same precision as on its CSV version
+def downcast(frame: pd.DataFrame, floats: bool = True) -> pd.DataFrame:
+    dtypes = {}
+    for name, column in frame.items():
+        if column.dtype == np.int64:
+            values = column.to_numpy()
+            if len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+                dtypes[name] = np.int32
+        elif column.dtype == np.float64 and floats:
+            values = column.to_numpy()
+            if np.array_equal(values.astype(np.float32), values, equal_nan=True):
+                dtypes[name] = np.float32
+        elif column.dtype == np.float32 and not floats:
+            dtypes[name] = np.float64
+    return frame.astype(dtypes) if dtypes else frame
+
+# Excel is read with calamine (Rust) when python-calamine is installed, which is several
+# times faster than openpyxl on large sheets
+def _excel_engine():
+    return 'calamine' if importlib.util.find_spec('python_calamine') is not None else None
+
+# A table from upload bytes or a path; name (or the path) decides the format by its extension
+def read_table(source, name: str = None) -> pd.DataFrame:
+    name = (name or str(source)).lower()
+    data = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    if name.endswith('.csv'):
+        return pd.read_csv(data)
+    if name.endswith('.parquet') or name.endswith('.pq'):
+        _require_pyarrow()
+        return downcast(pd.read_parquet(data), floats=False)
+    if name.endswith('.arrow') or name.endswith('.feather'):
+        _require_pyarrow()
+        return downcast(pd.read_feather(data), floats=False)
+    return pd.read_excel(data, engine=_excel_engine())
+
+# One table as file bytes in the given format
+def write_table(frame: pd.DataFrame, fmt: str = 'parquet') -> bytes:
+    if fmt == 'csv':
+        return frame.to_csv(index=False).encode()
+    if fmt != 'parquet':
+        raise ValueError(f"Unknown table format '{fmt}'; use one of {', '.join(FORMATS)}.")
+    _require_pyarrow()
+    buffer = io.BytesIO()
+    downcast(frame.rename(columns=str)).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+# Zip archive of named tables ({file stem: frame}), each written in the given format
+def bundle(tables: dict, fmt: str = 'parquet') -> bytes:
+    extension = FORMATS[fmt][0]
+    buffer = io.BytesIO()
+    with span('bundle', tables=len(tables), format=fmt):
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for stem, frame in tables.items():
+                archive.writestr(stem + extension, write_table(frame, fmt))
+    return buffer.getvalue()
@@ -0,0 +1,102 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+import holt_winters
+from model_store import ModelStore, update_forecast_series
+
+M = 6
+
+# Log-space monthly demand series like demand_forecast.fit_series gets: trend, season and noise
+def make_series(n, seed):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    y = 8 + 0.01 * t + 0.3 * np.sin(2 * np.pi * t / M) + rng.normal(0, 0.05, n)
+    return pd.Series(y, index=pd.date_range('2020-01-01', periods=n, freq='MS'))
+
+@pytest.fixture
+def series():
+    return [make_series(36, seed) for seed in range(4)]
+
+@pytest.fixture
+def store(tmp_path):
+    return ModelStore(str(tmp_path / 'hw_state.sqlite'))
+
+KEYS = ['s0', 's1', 's2', 's3']
+
+def prefixes(series, n=24):
+    return [s.iloc[:n] for s in series]
+
+def stored_rows(store):
+    with sqlite3.connect(store.path) as conn:
+        return conn.execute('SELECT * FROM hw_state ORDER BY series_key').fetchall()
+
+def test_first_update_is_a_full_fit(series, store):
+    forecasts, modes = update_forecast_series(series, KEYS, store)
+    assert modes == ['full'] * 4
+    for fc, direct in zip(forecasts, holt_winters.fit_forecast_series(series)):
+        assert fc.index.equals(direct.index)
+        np.testing.assert_allclose(fc, direct)
+
+# Filtering only the new months must equal filtering the whole history with the stored
+# parameters and the initial states of the original fit
+def test_incremental_update_matches_a_full_refilter(series, store):
+    update_forecast_series(prefixes(series), KEYS, store)
+    forecasts, modes = update_forecast_series(series, KEYS, store)
+    assert modes == ['incremental'] * 4
+
+    Y0, lengths0 = holt_winters.stack_series(prefixes(series))
+    fit = holt_winters.fit_batch(Y0, lengths0, M)
+    l0, b0, s0 = holt_winters.initial_states(Y0, lengths0, M)
+    Y, lengths = holt_winters.stack_series(series)
+    sse, level, trend, season, stale = holt_winters.filter_series(
+        Y, lengths, fit['alpha'][:, None], fit['beta'][:, None], fit['gamma'][:, None], l0, b0, s0, M
+    )
+    direct = holt_winters.forecast_states(level[:, 0], trend[:, 0], season[:, 0, :], lengths, 12, M, stale[:, 0])
+    np.testing.assert_allclose(np.array(forecasts), direct, rtol=1e-12)
+    rows = store.load(KEYS)
+    np.testing.assert_allclose([rows[k]['sse'] for k in KEYS], sse[:, 0], rtol=1e-9)
+    assert all(rows[k]['n_obs'] == 36 for k in KEYS)
+
+def test_refit_matches_a_cold_fit(series, store):
+    update_forecast_series(prefixes(series), KEYS, store)
+    forecasts, modes = update_forecast_series(series, KEYS, store, refit=True)
+    assert modes == ['full'] * 4
+    for fc, direct in zip(forecasts, holt_winters.fit_forecast_series(series)):
+        np.testing.assert_allclose(fc, direct)
+
+def test_changed_history_is_refitted(series, store):
+    update_forecast_series(prefixes(series), KEYS, store)
+    revised = [s.copy() for s in series]
+    revised[1].iloc[3] += 0.1  # an earlier month was corrected
+    revised[2] = revised[2].iloc[1:]  # a different start date
+    forecasts, modes = update_forecast_series(revised, KEYS, store)
+    assert modes == ['incremental', 'full', 'full', 'incremental']
+    direct = holt_winters.fit_forecast_series(revised)
+    for i in (1, 2):
+        np.testing.assert_allclose(forecasts[i], direct[i])
+
+@pytest.mark.parametrize('reoptimize', [False, True])
+def test_no_new_data_leaves_the_store_unchanged(series, store, reoptimize):
+    first, _ = update_forecast_series(series, KEYS, store)
+    before = stored_rows(store)
+    forecasts, modes = update_forecast_series(series, KEYS, store, reoptimize=reoptimize)
+    assert modes == ['unchanged'] * 4
+    assert stored_rows(store) == before
+    for fc, expected in zip(forecasts, first):
+        pd.testing.assert_series_equal(fc, expected)
+
+# The warm-started search only accepts moves that lower the SSE of its starting point
+def test_reoptimize_does_not_worsen_the_stored_parameters(series, store):
+    update_forecast_series(prefixes(series), KEYS, store)
+    start = np.array([store.load(KEYS)[k]['u'] for k in KEYS])
+    forecasts, modes = update_forecast_series(series, KEYS, store, reoptimize=True)
+    assert modes == ['reoptimized'] * 4
+
+    Y, lengths = holt_winters.stack_series(series)
+    l0, b0, s0 = holt_winters.initial_states(Y, lengths, M)
+    alpha, beta, gamma = holt_winters.to_params(start)
+    sse = holt_winters.filter_series(Y, lengths, alpha[:, None], beta[:, None], gamma[:, None], l0, b0, s0, M)[0]
+    rows = store.load(KEYS)
+    assert all(rows[k]['sse'] <= sse[j, 0] + 1e-12 for j, k in enumerate(KEYS))
+    assert all(fc is not None and np.isfinite(fc).all() for fc in forecasts)
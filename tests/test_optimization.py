@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from scipy.optimize import LinearConstraint, linprog, milp
+import synthetic_data
+from optimization import (build_staffing_problem, integer_staffing, optimization_model_batch,
+                          optimize_staffing_from_dataframe, staffing_for_month)
+
+BRANDS = ['a', 'b']
+
+@pytest.fixture(scope='module')
+def inputs():
+    forecasts = [synthetic_data.synthetic_transaction_forecast(6, seed=i) for i in range(len(BRANDS))]
+    capabilities = [synthetic_data.synthetic_capabilities(6, 8, seed=i) for i in range(len(BRANDS))]
+    return forecasts, capabilities
+
+def lp_solution(problem):
+    res = linprog(np.ones(len(problem[0])), A_ub=-problem[1].T, b_ub=-problem[2], bounds=(0, None), method='highs')
+    assert res.success
+    return res.x
+
+def milp_total(problem):
+    R = len(problem[0])
+    res = milp(np.ones(R), integrality=np.ones(R), bounds=(0, np.inf),
+               constraints=[LinearConstraint(problem[1].T, problem[2], np.inf)])
+    assert res.success
+    return round(res.fun)
+
+def feasible(problem, x):
+    return (x >= 0).all() and (problem[1].T @ x >= problem[2] - 1e-6).all()
+
+# (roles, C_reduced, D, types) of every month of both brands
+@pytest.fixture(scope='module')
+def problems(inputs):
+    return [build_staffing_problem(cap, fc, row) for fc, cap in zip(*inputs) for row in range(len(fc))]
+
+def test_integer_staffing_matches_milp(problems):
+    whole, bounds, summary = integer_staffing(problems, [lp_solution(p) for p in problems], time_limit=60)
+    for p, x, bound in zip(problems, whole, bounds):
+        assert feasible(p, x)
+        assert x.sum() == milp_total(p) == bound
+    assert summary['gap'] == 0
+    assert summary['total'] == sum(milp_total(p) for p in problems) <= summary['rounded_total']
+
+def test_out_of_time_keeps_the_rounded_lp(problems):
+    lp = [lp_solution(p) for p in problems]
+    whole, bounds, summary = integer_staffing(problems, lp, time_limit=0)
+    for p, x, y, bound in zip(problems, whole, lp, bounds):
+        assert feasible(p, x)
+        assert (x == np.ceil(y - 1e-9)).all()
+        assert bound == np.ceil(y.sum() - 1e-6)
+    assert summary['total'] == summary['rounded_total']
+    assert summary['gap'] == pytest.approx((summary['total'] - sum(bounds)) / summary['total'])
+    assert summary['out_of_time'] + summary['optimal'] == len(problems)
+
+# An LP optimum of 1 that no single employee covers: the cutoff (total <= 1) is infeasible,
+# which proves the rounded plan of 2 optimal
+def test_infeasible_cutoff_proves_rounding_optimal():
+    problem = (['x', 'y'], np.eye(2), np.array([0.5, 0.5]), [1, 2])
+    whole, bounds, summary = integer_staffing([problem], [np.array([0.5, 0.5])])
+    assert whole[0].tolist() == [1, 1]
+    assert bounds == [2]
+    assert summary['gap'] == 0 and summary['improved'] == 0 and summary['optimal'] == 1
+
+def test_integral_lp_skips_the_milp():
+    problem = (['x', 'y'], np.eye(2), np.array([1.0, 2.0]), [1, 2])
+    calls = []
+    whole, bounds, summary = integer_staffing([problem], [np.array([1.0, 2.0])],
+                                              progress=lambda *args: calls.append(args))
+    assert whole[0].tolist() == [1, 2] and bounds == [3]
+    assert summary['optimal'] == 1 and summary['improved'] == 0
+    assert calls == [(0, 1, 'Integer staffing: 0 of 1 brand-months searched')]
+
+def test_progress_exception_stops_the_search(problems):
+    class Stop(Exception):
+        pass
+
+    def progress(done, total, message):
+        if done == 1:
+            raise Stop
+
+    with pytest.raises(Stop):
+        integer_staffing(problems, [lp_solution(p) for p in problems], progress=progress)
+
+def test_optimize_staffing_returns_the_gap(inputs):
+    forecasts, capabilities = inputs
+    problem = build_staffing_problem(capabilities[0], forecasts[0], 2)
+    staffing, total, success, gap = optimize_staffing_from_dataframe(capabilities[0], forecasts[0], 2,
+                                                                     integer=True, time_limit=60)
+    assert success and gap == 0
+    assert total == sum(staffing.values()) == milp_total(problem)
+    assert len(optimize_staffing_from_dataframe(capabilities[0], forecasts[0], 2)) == 3
+
+def test_batch_integer_plan_matches_milp(inputs, problems):
+    plan, success = optimization_model_batch(BRANDS, *inputs, integer=True, time_limit=60)
+    assert success and (plan['Gap'] == 0).all()
+    totals = plan.groupby(['brand_index', 'row'])['Employees'].sum()
+    assert totals.tolist() == [milp_total(p) for p in problems]
+
+    staffings, month_totals, ok = staffing_for_month(plan, BRANDS, 0)
+    assert ok and month_totals == [totals[(b, 0)] for b in range(len(BRANDS))]
+    for b, staffing in enumerate(staffings):
+        assert all(n > 0 for n in staffing.values())
+        assert sum(staffing.values()) == month_totals[b]
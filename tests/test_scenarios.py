@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from scipy.optimize import linprog
+import scenarios
+import synthetic_data
+
+# Staffing LPs whose demand rows are a base demand scaled by +/-20% per type, so one
+# certificate covers many rows and a few rows need their own solve
+@pytest.fixture
+def problem():
+    rng = np.random.default_rng(3)
+    A = rng.uniform(50, 400, size=(6, 5)) * (rng.random((6, 5)) < 0.7)
+    A[:, 0] = np.maximum(A[:, 0], 60)  # every type has at least one role
+    D = rng.uniform(2_000, 8_000, size=6) * rng.uniform(0.8, 1.2, size=(200, 6))
+    return A, D
+
+def direct(A, d):
+    res = linprog(np.ones(A.shape[1]), A_ub=-A, b_ub=-d, bounds=(0, None), method='highs')
+    assert res.success
+    return res.fun
+
+def test_certified_rows_are_optimal(problem):
+    A, D = problem
+    res = linprog(np.ones(A.shape[1]), A_ub=-A, b_ub=-D[0], bounds=(0, None), method='highs')
+    X, ok = scenarios.apply_certificate(scenarios.certificate(A, D[0], res), A, D)
+    assert ok[0] and ok.sum() > 1
+    for i in np.flatnonzero(ok):
+        assert (A @ X[i] >= D[i] * (1 - 1e-9)).all()
+        assert X[i].sum() == pytest.approx(direct(A, D[i]), rel=1e-7)
+
+def test_certificate_rejects_rows_it_does_not_cover(problem):
+    A, D = problem
+    res = linprog(np.ones(A.shape[1]), A_ub=-A, b_ub=-D[0], bounds=(0, None), method='highs')
+    cert = scenarios.certificate(A, D[0], res)
+    # shifting all demand onto one type changes which roles are worth staffing
+    skewed = D[:5] * np.r_[8.0, np.full(A.shape[0] - 1, 0.1)]
+    X, ok = scenarios.apply_certificate(cert, A, skewed)
+    for i in np.flatnonzero(ok):
+        assert X[i].sum() == pytest.approx(direct(A, skewed[i]), rel=1e-7)
+    assert not ok.all()
+
+@pytest.mark.parametrize('probes', [0, 1, 8])
+def test_solve_staffing_rows_matches_linprog(problem, probes):
+    A, D = problem
+    X, solved, counts = scenarios.solve_staffing_rows(A, D, probes=probes, chunk=64)
+    assert solved.all()
+    assert counts['certified'] + counts['probed'] + counts['solved'] == len(D)
+    for i in range(0, len(D), 7):
+        assert X[i].sum() == pytest.approx(direct(A, D[i]), rel=1e-7)
+
+def test_infeasible_rows_are_reported():
+    A = np.array([[100.0, 0.0], [0.0, 0.0]])  # nobody does the second type
+    D = np.array([[500.0, 0.0], [500.0, 10.0]])
+    X, solved, _ = scenarios.solve_staffing_rows(A, D, probes=0)
+    assert solved.tolist() == [True, False]
+    assert X[0].sum() == pytest.approx(5.0)
+
+# Brands whose histories end in different months are summed on calendar months
+def test_scenario_months_are_aligned_across_brands():
+    demand = synthetic_data.synthetic_demand(2, 36, seed=1)
+    brands = [c[:-len('_Orders')] for c in demand.columns if c.endswith('_Orders')]
+    demand.loc[demand.index[-3:], [f'{brands[1]}_Orders', f'{brands[1]}_Quantity']] = 0  # ends 3 months early
+    summary = synthetic_data.synthetic_summary(brands, types=4, seed=1)
+    caps = {b: synthetic_data.synthetic_capabilities(3, 4, seed=k) for k, b in enumerate(brands)}
+    table = scenarios.scenario_staffing(demand, summary, caps, scenarios=50)
+    totals = table[table['Position'] == 'Total'].pivot_table(index='Month', columns='Brand', values='Mean')
+    assert len(totals) == 12 + 3
+    assert (totals[brands[0]].iloc[:3] == 0).all() and (totals[brands[0]].iloc[3:] > 0).all()
+    assert (totals[brands[1]].iloc[-3:] == 0).all() and (totals[brands[1]].iloc[:-3] > 0).all()
+    assert np.allclose(totals['All brands'], totals[brands[0]] + totals[brands[1]], atol=0.05)
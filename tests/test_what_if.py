@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from scipy.optimize import LinearConstraint, linprog, milp
+import synthetic_data
+from optimization import build_staffing_problem, optimization_model_batch
+from what_if import what_if
+
+BRANDS = ['a', 'b', 'c']
+
+@pytest.fixture(scope='module')
+def inputs():
+    forecasts = [synthetic_data.synthetic_transaction_forecast(8, seed=i) for i in range(len(BRANDS))]
+    capabilities = [synthetic_data.synthetic_capabilities(6, 8, seed=i) for i in range(len(BRANDS))]
+    return forecasts, capabilities
+
+@pytest.fixture(scope='module')
+def lp_plan(inputs):
+    plan, success, duals = optimization_model_batch(BRANDS, *inputs, sensitivity=True)
+    assert success
+    return plan, duals
+
+# The changed month (A: types x roles, d) solved from scratch
+def changed_problem(inputs, b, row, demand_change=None, capability_change=None):
+    roles, C, d, types = build_staffing_problem(inputs[1][b], inputs[0][b], row)
+    A, d = np.array(C, dtype=float).T, np.array(d, dtype=float)
+    for t, change in (demand_change or {}).items():
+        d[types.index(t)] *= 1 + change
+    for role, change in (capability_change or {}).items():
+        A[:, roles.index(role)] *= 1 + change
+    return roles, A, d, types
+
+def lp_total(A, d):
+    res = linprog(np.ones(A.shape[1]), A_ub=-A, b_ub=-d, bounds=(0, None), method='highs')
+    assert res.success
+    return res.fun
+
+def milp_total(A, d):
+    R = A.shape[1]
+    res = milp(np.ones(R), integrality=np.ones(R), bounds=(0, np.inf), constraints=[LinearConstraint(A, d, np.inf)])
+    assert res.success
+    return round(res.fun)
+
+def types_of(inputs, b, row):
+    return build_staffing_problem(inputs[1][b], inputs[0][b], row)[3]
+
+@pytest.mark.parametrize('b,row', [(0, 0), (1, 4), (2, 11)])
+def test_small_demand_change_uses_shadow_prices(inputs, lp_plan, b, row):
+    change = {t: 0.02 for t in types_of(inputs, b, row)[:2]}
+    answer = what_if(*lp_plan, inputs[1][b], inputs[0][b], b, row, demand_change=change)
+    exact = lp_total(*changed_problem(inputs, b, row, change)[1:3])
+    assert answer['success'] and answer['method'] == 'sensitivity'
+    assert answer['estimate'] == pytest.approx(exact, rel=1e-7)
+    assert answer['total'] == int(np.ceil(exact - 1e-7))
+
+@pytest.mark.parametrize('change', [0.5, 3.0, -0.9])
+def test_large_changes_match_a_fresh_solve(inputs, lp_plan, change):
+    methods = set()
+    for b in range(len(BRANDS)):
+        for row in (0, 6):
+            for t in types_of(inputs, b, row):
+                answer = what_if(*lp_plan, inputs[1][b], inputs[0][b], b, row, demand_change={t: change})
+                exact = lp_total(*changed_problem(inputs, b, row, {t: change})[1:3])
+                assert answer['total'] == int(np.ceil(exact - 1e-7))
+                methods.add(answer['method'])
+    assert 'resolve' in methods
+
+@pytest.mark.parametrize('change', [0.05, -0.3, 1.0])
+def test_capability_change_matches_a_fresh_solve(inputs, lp_plan, change):
+    for b in range(len(BRANDS)):
+        roles = list(inputs[1][b]['Position'])
+        for role in roles:
+            answer = what_if(*lp_plan, inputs[1][b], inputs[0][b], b, 3, capability_change={role: change})
+            _, A, d, _ = changed_problem(inputs, b, 3, capability_change={role: change})
+            assert answer['method'] in ('basis', 'resolve')
+            assert answer['total'] == int(np.ceil(lp_total(A, d) - 1e-7))
+
+def test_integer_plan_answers_in_whole_employees(inputs):
+    plan, success, duals = optimization_model_batch(BRANDS, *inputs, sensitivity=True, integer=True, time_limit=30)
+    assert success
+    for b in range(len(BRANDS)):
+        row = 2
+        change = {t: 0.25 for t in types_of(inputs, b, row)[:3]}
+        answer = what_if(plan, duals, inputs[1][b], inputs[0][b], b, row, demand_change=change, time_limit=10)
+        shown = plan[(plan['brand_index'] == b) & (plan['row'] == row)].set_index('Position')['Employees']
+        assert answer['integer']
+        assert answer['staffing'].set_index('Position')['Base'].equals(shown.reindex(answer['staffing']['Position']))
+        assert answer['total_base'] == milp_total(*changed_problem(inputs, b, row)[1:3])
+        assert answer['total'] == milp_total(*changed_problem(inputs, b, row, change)[1:3])
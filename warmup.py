@@ -0,0 +1,34 @@
+import importlib
+import os
+import threading
+import time
+
+# Deferred heavy dependencies.
+#
+# The pipeline modules import statsmodels (fits), scipy (LP solves) and matplotlib
+# (PNG rendering) inside the functions that use them, so importing them - and with
+# them the app's first page - costs only pandas and numpy. prewarm() imports the heavy
+# dependencies on a background thread so the first Step 1 or Step 3 run usually finds
+# them loaded; CPC_PREWARM=0 turns that off.
+
+HEAVY_MODULES = ('statsmodels.tsa.holtwinters', 'scipy.optimize', 'scipy.sparse', 'matplotlib.figure')
+
+# The project modules app.py imports when a page is first served
+APP_MODULES = ('demand_forecast', 'orders_to_trans', 'optimization', 'ingest', 'model_selection',
+               'scenarios', 'what_if', 'shift_planning', 'tables', 'result_cache', 'profiling', 'jobs')
+
+# Importing modules in order; seconds each took (0 for ones already imported)
+def import_all(modules=HEAVY_MODULES) -> dict:
+    seconds = {}
+    for name in modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        seconds[name] = time.perf_counter() - start
+    return seconds
+
+def prewarm(modules=HEAVY_MODULES):
+    if os.environ.get('CPC_PREWARM', '1') == '0':
+        return None
+    thread = threading.Thread(target=import_all, args=(modules,), name='cpc-prewarm', daemon=True)
+    thread.start()
+    return thread
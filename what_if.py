@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+from optimization import build_staffing_problem, integer_staffing
+from profiling import span
+
+# What-if questions on a solved staffing plan ("what if type 341 rises 10%?", "what if
+# Pickers get 5% faster?") answered from the LP sensitivity data instead of a new run.
+#
+#   plan, success, duals = optimization_model_batch(brands, forecasts, capabilities, sensitivity=True)
+#   answer = what_if(plan, duals, capabilities[0], forecasts[0], brand_index=0, row_index=0,
+#                    demand_change={341: 0.10})
+#
+# The optimal solution of a staffing LP is fixed by its basis: the roles it staffs and the
+# transaction types whose demand it meets exactly. After a change the same basis is solved
+# again (a small linear system) and kept when it is still primal feasible (no negative
+# staffing, every demand met) and dual feasible (non-negative shadow prices that make no
+# role cheaper per transaction than its cost) - then it is still optimal. For demand-only
+# changes the stored shadow prices already give the exact change in employees. Only when
+# the basis changes is the LP solved again.
+#
+# For an integer plan (optimization_model_batch(..., integer=True), with a Gap column) the
+# base staffing is the plan's whole employees, and the changed month is staffed the same way
+# (integer_staffing from its LP solution), so Base, What-if and Change are all MILP staffing.
+
+TOLERANCE = 1e-7
+
+# Staffed roles and tight demand rows of a solution
+def basis_sets(x: np.ndarray, slack: np.ndarray, d: np.ndarray) -> tuple:
+    support = x > TOLERANCE * max(1.0, np.abs(x).max(initial=0.0))
+    tight = slack <= TOLERANCE * np.maximum(1.0, np.abs(d))
+    return support, tight
+
+# Solution and shadow prices of the LP min sum(x) s.t. A x >= d, x >= 0 (A: types x roles)
+# for the given basis, or None when that basis is not optimal for (A, d)
+def solve_basis(A: np.ndarray, d: np.ndarray, support: np.ndarray, tight: np.ndarray):
+    M = A[np.ix_(tight, support)]
+    if M.size == 0:
+        return None
+    x_basic = np.linalg.lstsq(M, d[tight], rcond=None)[0]
+    y_tight = np.linalg.lstsq(M.T, np.ones(support.sum()), rcond=None)[0]
+    x = np.zeros(A.shape[1])
+    x[support] = x_basic
+    y = np.zeros(A.shape[0])
+    y[tight] = y_tight
+    scale = TOLERANCE * max(1.0, np.abs(d).max())
+    primal = (np.abs(M @ x_basic - d[tight]) <= scale).all() and (x >= -scale).all() and (A @ x >= d - scale).all()
+    dual = (np.abs(M.T @ y_tight - 1) <= 1e-6).all() and (y >= -1e-9).all() and (A.T @ y <= 1 + 1e-6).all()
+    if not (primal and dual):
+        return None
+    return np.maximum(x, 0), np.maximum(y, 0)
+
+def _employees(x: np.ndarray) -> np.ndarray:
+    return np.where(x > 1e-3, np.ceil(x - TOLERANCE), 0).astype(int)
+
+# Answering one what-if for one brand and month of a plan from optimization_model_batch(..., sensitivity=True).
+# The capabilities and forecast are the brand's DataFrames or their compiled forms (optimization.compile_*).
+# demand_change: {type: relative change} (0.10 = +10%); capability_change: {role: relative change} for all
+# of a role's transaction rates, or {(role, type): relative change} for single rates.
+# time_limit: seconds for the changed month's MILP when the plan is an integer plan.
+# Returns a dict with the per-role table (Position, Base, What-if, Change), both totals, the first-order
+# estimate from the shadow prices (of the LP relaxation), whether the staffing is integer, and the
+# method used: 'sensitivity' (demand only, basis unchanged), 'basis' (capabilities changed, basis
+# unchanged) or 'resolve'.
+def what_if(plan: pd.DataFrame, duals: pd.DataFrame, df_capabilities: pd.DataFrame, df_forecast: pd.DataFrame,
+            brand_index: int, row_index: int, demand_change: dict = None, capability_change: dict = None,
+            time_limit: float = 1.0) -> dict:
+    with span('what_if', brand_index=brand_index, row_index=row_index) as s:
+        problem = build_staffing_problem(df_capabilities, df_forecast, row_index)
+        if problem is None:
+            return {'success': False, 'message': "The forecast and capabilities share no transaction types."}
+        roles, C, d, types = problem
+        A = np.asarray(C, dtype=float).T
+        d = np.asarray(d, dtype=float)
+
+        solved = plan[(plan['brand_index'] == brand_index) & (plan['row'] == row_index)]
+        sens = duals[(duals['brand_index'] == brand_index) & (duals['row'] == row_index)]
+        if solved.empty or not solved['Success'].all() or len(sens) != len(types):
+            return {'success': False, 'message': "This month was not solved; run the optimization first."}
+        x0 = solved.set_index('Position')['Solution'].reindex(roles).to_numpy(dtype=float)
+        y0 = sens['Shadow Price'].to_numpy(dtype=float)
+        slack0 = sens['Slack'].to_numpy(dtype=float)
+
+        # applying the changes
+        type_pos = {t: k for k, t in enumerate(types)}
+        role_pos = {role: k for k, role in enumerate(roles)}
+        d1 = d.copy()
+        for t, change in (demand_change or {}).items():
+            if int(t) in type_pos:
+                d1[type_pos[int(t)]] *= 1 + change
+        A1 = A.copy()
+        for key, change in (capability_change or {}).items():
+            role, t = key if isinstance(key, tuple) else (key, None)
+            if role not in role_pos:
+                continue
+            if t is None:
+                A1[:, role_pos[role]] *= 1 + change
+            elif int(t) in type_pos:
+                A1[type_pos[int(t)], role_pos[role]] *= 1 + change
+
+        estimate = float(x0.sum() + y0 @ (d1 - d))  # exact while the basis holds and capabilities are unchanged
+        support, tight = basis_sets(x0, slack0, d)
+        result = solve_basis(A1, d1, support, tight)
+        if result is not None:
+            x1 = result[0]
+            method = 'basis' if capability_change else 'sensitivity'
+        else:
+            from scipy.optimize import linprog
+
+            res = linprog(np.ones(len(roles)), A_ub=-A1, b_ub=-d1, bounds=(0, None), method='highs')
+            method = 'resolve'
+            if not res.success:
+                s.update(method=method, success=False)
+                return {'success': False, 'method': method, 'estimate': estimate,
+                        'message': "No staffing meets the changed demand with these capabilities."}
+            x1 = res.x
+        s['method'] = method
+
+        integer = 'Gap' in plan.columns
+        if integer:
+            base = solved.set_index('Position')['Employees'].reindex(roles).to_numpy().astype(int)
+            changed = integer_staffing([(roles, A1.T, d1, types)], [x1], time_limit, name='what_if.milp')[0][0]
+            changed = changed.astype(int)
+            total_base, total = int(base.sum()), int(changed.sum())
+        else:
+            base, changed = _employees(x0), _employees(x1)
+            total_base, total = int(np.ceil(x0.sum() - TOLERANCE)), int(np.ceil(x1.sum() - TOLERANCE))
+        s['integer'] = integer
+
+    table = pd.DataFrame({'Position': roles, 'Base': base, 'What-if': changed})
+    table['Change'] = table['What-if'] - table['Base']
+    return {
+        'success': True,
+        'method': method,
+        'integer': integer,
+        'staffing': table,
+        'total_base': total_base,
+        'total': total,
+        'estimate': estimate,
+    }
+
+# Shadow prices of one brand and month, scaled to employees per 1,000 extra transactions
+def shadow_prices(duals: pd.DataFrame, brand_index: int, row_index: int) -> pd.DataFrame:
+    sens = duals[(duals['brand_index'] == brand_index) & (duals['row'] == row_index)]
+    return pd.DataFrame({
+        'Type': sens['Type'].to_numpy(),
+        'Demand': sens['Demand'].to_numpy(),
+        'Employees per 1,000 more': (sens['Shadow Price'] * 1000).round(4).to_numpy(),
+        'Spare capacity': sens['Slack'].round(1).to_numpy(),
+    })